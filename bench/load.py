@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+Load generating client for a rump selection server. Opens `--concurrency`
+keep-alive connections and issues selection requests over them as fast as
+responses come back, e.g.:
+
+.. code:: bash
+
+    $ rump serve -e -c rump.conf &
+    $ python bench/load.py -c 200 -n 50000 -H google.example.com 127.0.0.1:4114
+
+and reports throughput and latency percentiles as JSON. Connections closed by
+the server (e.g. ``wsgiref`` servers w/o keep-alive) are re-opened.
+"""
+import argparse
+import asynchat
+import asyncore
+import json
+import socket
+import sys
+import time
+
+
+class Client(asynchat.async_chat):
+
+    def __init__(self, address, request, stats):
+        asynchat.async_chat.__init__(self, map=stats.map)
+        self.address = address
+        self.request = request
+        self.stats = stats
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect(address)
+        self._buffer = []
+        self._length = None
+        self._sent_at = None
+        self.set_terminator('\r\n\r\n')
+
+    def send_request(self):
+        if not self.stats.claim():
+            self.close_when_done()
+            return
+        self._sent_at = time.time()
+        self.push(self.request)
+
+    # asynchat.async_chat
+
+    def handle_connect(self):
+        self.send_request()
+
+    def collect_incoming_data(self, data):
+        self._buffer.append(data)
+
+    def found_terminator(self):
+        data = ''.join(self._buffer)
+        self._buffer = []
+        if self._length is None:
+            status = data.split(' ', 2)[1]
+            length = 0
+            for line in data.split('\r\n')[1:]:
+                name, _, value = line.partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value.strip())
+            if length:
+                self._length = length
+                self._status = status
+                self.set_terminator(length)
+                return
+        else:
+            status = self._status
+        self._length = None
+        self.set_terminator('\r\n\r\n')
+        self.stats.record(status, time.time() - self._sent_at)
+        self._sent_at = None
+        self.send_request()
+
+    def handle_close(self):
+        # NOTE: servers w/o keep-alive close after each response so reconnect.
+        self.close()
+        if self._sent_at is not None:
+            self.stats.issued -= 1
+        if self.stats.issued < self.stats.total:
+            self.stats.connects += 1
+            self.__class__(self.address, self.request, self.stats)
+
+    def handle_error(self):
+        self.stats.errors += 1
+        self.close()
+
+
+class Stats(object):
+
+    def __init__(self, total):
+        self.map = {}
+        self.total = total
+        self.issued = 0
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.connects = 0
+
+    def claim(self):
+        if self.issued >= self.total:
+            return False
+        self.issued += 1
+        return True
+
+    def record(self, status, latency):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latencies.append(latency)
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        return {
+            'requests': len(latencies),
+            'errors': self.errors,
+            'reconnects': self.connects,
+            'statuses': self.statuses,
+            'elapsed': elapsed,
+            'rps': len(latencies) / elapsed if elapsed else None,
+            'latency_ms': dict(
+                (name, (percentile(p) or 0) * 1000.0)
+                for name, p in [
+                    ('p50', 0.50), ('p90', 0.90), ('p99', 0.99), ('max', 1.0)
+                ]
+            ),
+        }
+
+
+def run(address, requests, concurrency, host, path):
+    request = (
+        'GET {path} HTTP/1.1\r\n'
+        'Host: {host}\r\n'
+        'Connection: keep-alive\r\n'
+        '\r\n'
+    ).format(path=path, host=host)
+    stats = Stats(requests)
+    for _ in xrange(concurrency):
+        Client(address, request, stats)
+    started_at = time.time()
+    asyncore.loop(timeout=1.0, use_poll=True, map=stats.map)
+    return stats.summary(time.time() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('address', help='HOST:PORT of the rump server.')
+    parser.add_argument('-n', '--requests', type=int, default=10000)
+    parser.add_argument('-c', '--concurrency', type=int, default=100)
+    parser.add_argument('-H', '--host', default='localhost')
+    parser.add_argument('-p', '--path', default='/')
+    args = parser.parse_args()
+    host, _, port = args.address.rpartition(':')
+    summary = run(
+        (host or '127.0.0.1', int(port)),
+        args.requests, args.concurrency, args.host, args.path,
+    )
+    json.dump(summary, sys.stdout, indent=4, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Measures per-request latency of ``rump.wsgi.app`` selections in the default
+and lean (i.e. ``lean = true``) response modes, each with and without
+metrics (i.e. ``metrics = false``), by calling the WSGI app directly, so no
+HTTP parsing or socket overhead is included:
+
+.. code:: bash
+
+    $ python bench/response.py -n 20000
+
+"""
+import argparse
+import json
+import sys
+import time
+
+import rump
+
+
+def settings(lean, metrics):
+    return {
+        'lean': lean,
+        'metrics': metrics,
+        'routers': [{
+            'name': 'bench',
+            'hosts': ['bench\.'],
+            'rules': [
+                'path startswith "/v{0}/" => http://v{0}.internal'.format(i)
+                for i in range(10)
+            ],
+            'default_upstream': 'http://default.internal',
+        }],
+    }
+
+
+def environ():
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/v9/a/b',
+        'QUERY_STRING': 'c=d',
+        'HTTP_HOST': 'bench.example.com',
+        'REMOTE_ADDR': '10.0.0.1',
+    }
+
+
+def measure(lean, metrics, requests):
+
+    def start_response(status, headers):
+        assert status.startswith('200'), status
+
+    rump.wsgi.app.settings.map(settings(lean, metrics))
+    for _ in xrange(min(requests, 1000)):
+        rump.wsgi.app(environ(), start_response)
+    started_at = time.time()
+    for _ in xrange(requests):
+        rump.wsgi.app(environ(), start_response)
+    elapsed = time.time() - started_at
+    return {
+        'requests': requests,
+        'elapsed': elapsed,
+        'us_per_request': elapsed / requests * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-n', '--requests', type=int, default=10000)
+    args = parser.parse_args()
+    results = {
+        'default': measure(False, True, args.requests),
+        'default-no-metrics': measure(False, False, args.requests),
+        'lean': measure(True, True, args.requests),
+        'lean-no-metrics': measure(True, False, args.requests),
+    }
+    json.dump(results, sys.stdout, indent=4, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
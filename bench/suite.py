@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""
+Micro and macro benchmarks for rump's hot paths:
+
+- ``rules.match`` of synthetic rule sets (compiled and interpreted)
+- ``CompiledRule.match_context``
+- ``Request`` field resolution
+- ``Upstream.__call__``
+- rule and upstream parsing
+- end-to-end ``rump.wsgi.app`` selections
+- ``import`` of rump (and of its WSGI application) by a fresh interpreter
+
+Run them all, or those whose names contain ``-k``, and save the JSON results:
+
+.. code:: bash
+
+    $ python bench/suite.py -o before.json
+    $ git checkout my-branch
+    $ python bench/suite.py -o after.json --compare before.json
+
+Rule sets and request environments are generated from ``--seed`` so results
+are comparable between commits.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import rump
+
+
+benchmarks = []
+
+#: Seed for generated rule sets and environments, see ``--seed``.
+seed = 0
+
+
+def benchmark(name, **params):
+    """
+    Registers a benchmark factory once per combination of `params`. The
+    factory is called with those params and returns a ``(run, ops)`` pair
+    where ``run()`` performs ``ops`` operations.
+    """
+
+    def _register(func):
+        combos = [{}]
+        for key, values in sorted(params.items()):
+            combos = [
+                dict(combo, **{key: value})
+                for combo in combos for value in values
+            ]
+        for combo in combos:
+            label = name
+            if combo:
+                label += '[' + ','.join(
+                    '{0}={1}'.format(k, v) for k, v in sorted(combo.items())
+                ) + ']'
+            benchmarks.append((label, func, combo))
+        return func
+
+    return _register
+
+
+# generators
+
+METHODS = ['GET', 'POST', 'PUT', 'DELETE', 'PATCH', 'HEAD']
+
+
+def generate_rules(count, seed=None):
+    """
+    Generates `count` rule strings of mixed operation types, none of which
+    shadow each other.
+    """
+    rng = random.Random(globals()['seed'] if seed is None else seed)
+    rules = []
+    for i in xrange(count):
+        kind = i % 8
+        if kind == 0:
+            match = 'path startswith "/v{0}/"'.format(i)
+        elif kind == 1:
+            match = 'method in ["{0}", "{1}"] and path endswith ".r{2}"'.format(
+                rng.choice(METHODS), rng.choice(METHODS), i,
+            )
+        elif kind == 2:
+            match = 'host ~ "h{0}[.].*[.]com"'.format(i)
+        elif kind == 3:
+            match = 'query.k{0} = "v{0}"'.format(i)
+        elif kind == 4:
+            match = 'content_length > {0} and path startswith "/c{1}"'.format(
+                rng.randint(0, 1024), i,
+            )
+        elif kind == 5:
+            match = 'client_ip4 in 10.{0}.{1}.0/24'.format(i // 256 % 256, i % 256)
+        elif kind == 6:
+            match = 'path = "/exact/{0}" or path = "/also/{0}"'.format(i)
+        else:
+            match = 'not has_content and path startswith "/n{0}/"'.format(i)
+        rules.append('{0} => http://u{1}.internal'.format(match, i))
+    return rules
+
+
+def generate_environs(count, rule_count, seed=None):
+    """
+    Generates `count` WSGI environments, most of which hit one of
+    `generate_rules(rule_count)` (uniformly by index) and the rest hit none.
+    """
+    rng = random.Random(globals()['seed'] if seed is None else seed)
+    environs = []
+    for _ in xrange(count):
+        i = rng.randint(0, rule_count - 1) if rng.random() < 0.9 else None
+        environ = {
+            'REQUEST_METHOD': rng.choice(METHODS),
+            'PATH_INFO': '/miss/{0}'.format(rng.randint(0, 1000)),
+            'QUERY_STRING': 'a=b&c=d',
+            'HTTP_HOST': 'bench.example.com',
+            'HTTP_USER_AGENT': 'bench/1.0',
+            'REMOTE_ADDR': '192.168.0.1',
+        }
+        kind = None if i is None else i % 8
+        if kind == 0:
+            environ['PATH_INFO'] = '/v{0}/a/b'.format(i)
+        elif kind == 2:
+            environ['HTTP_HOST'] = 'h{0}.example.com'.format(i)
+        elif kind == 3:
+            environ['QUERY_STRING'] = 'k{0}=v{0}'.format(i)
+        elif kind == 4:
+            environ.update({
+                'PATH_INFO': '/c{0}/x'.format(i),
+                'CONTENT_TYPE': 'application/json',
+                'CONTENT_LENGTH': '2048',
+            })
+        elif kind == 5:
+            environ['REMOTE_ADDR'] = '10.{0}.{1}.7'.format(i // 256 % 256, i % 256)
+        elif kind == 6:
+            environ['PATH_INFO'] = '/also/{0}'.format(i)
+        elif kind == 7:
+            environ['PATH_INFO'] = '/n{0}/x'.format(i)
+        environs.append(environ)
+    return environs
+
+
+def parsed_rules(count, compiled):
+    return rump.Rules(
+        [rump.parser.for_rule()(rule) for rule in generate_rules(count)],
+        compile=compiled,
+    )
+
+
+# benchmarks
+
+@benchmark('rules.match', mode=['compiled', 'interpreted'], rules=[10, 100, 500])
+def rules_match(mode, rules):
+    parsed = parsed_rules(rules, mode == 'compiled')
+    environs = generate_environs(200, rules)
+
+    def run():
+        for environ in environs:
+            parsed.match(rump.Request(environ))
+
+    return run, len(environs)
+
+
+@benchmark('compiled_rule.match_context')
+def compiled_rule_match_context():
+    rule = rump.parser.for_rule()(generate_rules(2)[1])
+    symbols = rump.Expression.symbols()
+    compiled = rule.compile(symbols)
+    request = rump.Request(generate_environs(1, 1)[0])
+
+    def run():
+        for _ in xrange(1000):
+            compiled.match_context(request.context(symbols))
+
+    return run, 1000
+
+
+@benchmark('request.fields', field=['path', 'query', 'client_ip4', 'has_content'])
+def request_fields(field):
+    environs = generate_environs(200, 100)
+
+    def run():
+        for environ in environs:
+            getattr(rump.Request(environ), field)
+
+    return run, len(environs)
+
+
+@benchmark('upstream.call', weights=['uniform', 'weighted'])
+def upstream_call(weights):
+    upstream = rump.parser.for_upstream()(
+        'http://a,1 http://b,1 http://c,1'
+        if weights == 'uniform'
+        else 'http://a,10 http://b,5 http://c,1'
+    )
+
+    def run():
+        for _ in xrange(1000):
+            upstream()
+
+    return run, 1000
+
+
+@benchmark('parser.rule')
+def parser_rule():
+    parse = rump.parser.for_rule()
+    rules = generate_rules(40)
+
+    def run():
+        for rule in rules:
+            parse(rule)
+
+    return run, len(rules)
+
+
+@benchmark('parser.upstream')
+def parser_upstream():
+    parse = rump.parser.for_upstream()
+
+    def run():
+        for _ in xrange(100):
+            parse('https://a.internal:8443,10 http://b.internal,5')
+
+    return run, 100
+
+
+@benchmark('import', module=['sys', 'rump', 'rump.wsgi'])
+def import_(module):
+    # NOTE: includes interpreter startup, compare w/ module "sys"
+    command = [sys.executable, '-c', 'import {0}'.format(module)]
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(rump.__file__))),
+    )
+
+    def run():
+        subprocess.check_call(command, env=env)
+
+    return run, 1
+
+
+@benchmark('wsgi.select', mode=['compiled', 'interpreted'], lean=[False, True])
+def wsgi_select(mode, lean):
+    rules = 100
+    rump.wsgi.app.settings.map({
+        'lean': lean,
+        'routers': [{
+            'name': 'bench',
+            'hosts': ['.*\\.com'],
+            'compile_rules': mode == 'compiled',
+            'rules': generate_rules(rules),
+            'default_upstream': 'http://default.internal',
+        }],
+    })
+    environs = generate_environs(200, rules)
+
+    def start_response(status, headers):
+        pass
+
+    def run():
+        for environ in environs:
+            rump.wsgi.app(dict(environ), start_response)
+
+    return run, len(environs)
+
+
+# runner
+
+def measure(run, ops, min_time, repeat):
+    run()
+    loops = 1
+    while True:
+        started_at = time.time()
+        for _ in xrange(loops):
+            run()
+        elapsed = time.time() - started_at
+        if elapsed >= min_time:
+            break
+        loops *= 2
+    timings = [elapsed]
+    for _ in xrange(repeat - 1):
+        started_at = time.time()
+        for _ in xrange(loops):
+            run()
+        timings.append(time.time() - started_at)
+    per_op = sorted(timing / (loops * ops) * 1e6 for timing in timings)
+    return {
+        'ops': loops * ops,
+        'us_per_op': per_op[0],
+        'us_per_op_median': per_op[len(per_op) // 2],
+    }
+
+
+def meta():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'rump': rump.__version__,
+        'commit': commit,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'at': datetime.datetime.utcnow().isoformat(),
+        'seed': seed,
+    }
+
+
+def compare(results, base):
+    names = sorted(results)
+    width = max(len(name) for name in names)
+    lines = ['{0:<{w}} {1:>12} {2:>12} {3:>8}'.format(
+        'benchmark', 'base(us)', 'now(us)', 'ratio', w=width,
+    )]
+    for name in names:
+        now = results.get(name, {}).get('us_per_op')
+        was = base.get(name, {}).get('us_per_op')
+        ratio = '{0:.2f}'.format(now / was) if now and was else '-'
+        lines.append('{0:<{w}} {1:>12} {2:>12} {3:>8}'.format(
+            name,
+            '{0:.2f}'.format(was) if was else '-',
+            '{0:.2f}'.format(now) if now else '-',
+            ratio,
+            w=width,
+        ))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-k', '--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('-t', '--min-time', type=float, default=0.2)
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write JSON results to this file')
+    parser.add_argument('-c', '--compare', help='compare to JSON results in this file')
+    parser.add_argument('--list', action='store_true', help='list benchmarks and exit')
+    args = parser.parse_args()
+    globals()['seed'] = args.seed
+
+    selected = [
+        (name, func, params) for name, func, params in benchmarks
+        if not args.filter or args.filter in name
+    ]
+    if args.list:
+        for name, _, _ in selected:
+            print name
+        return
+
+    results = {}
+    for name, func, params in selected:
+        run, ops = func(**params)
+        results[name] = measure(run, ops, args.min_time, args.repeat)
+        sys.stderr.write('{0} {1:.2f} us/op\n'.format(name, results[name]['us_per_op']))
+    document = {'meta': meta(), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as fo:
+            json.dump(document, fo, indent=4, sort_keys=True)
+            fo.write('\n')
+    if args.compare:
+        with open(args.compare, 'r') as fo:
+            base = json.load(fo)
+        print compare(results, base['results'])
+    elif not args.output:
+        json.dump(document, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
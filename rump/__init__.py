@@ -110,7 +110,10 @@ remote data store, and used like:
 """
 __version__ = '0.2.1'
 
+import importlib
 import json
+import sys
+from types import ModuleType
 
 
 def loads(text):
@@ -135,24 +138,20 @@ def dumps(obj):
     return json.dumps(obj, indent=4, default=_default)
 
 from . import exc
+from . import metrics
 from . import exp
 from .exp import Expression, and_, or_, not_, types
 from . import request
 from .request import Request
 from .rule import Rule, Rules
 from .upstream import Upstream, Selection, Server
-from . import parser
-from . import router
-from .router import Router, Dynamic
-from .settings import Settings
-from . import cli
-from . import wsgi
 
 
 __all__ = [
     'loads',
     'dumps',
     'exc',
+    'metrics',
     'exp',
     'Expression',
     'and_',
@@ -170,6 +169,76 @@ __all__ = [
     'Router',
     'Dynamic',
     'Settings',
+    'watch',
+    'reloader',
+    'snapshot',
+    'artifact',
+    'profiling',
+    'analysis',
+    'trace',
     'wsgi',
     'cli',
+    'prefork',
+    'evented',
 ]
+
+
+# lazy
+
+#: Attributes imported on first access, as ``(module, name)`` where a name of
+#: None is the module itself. These pull in grammars, dynamics (e.g. redis,
+#: kazoo), the WSGI application, etc so those only matching w/ `Rules` don't
+#: pay for them.
+_lazy = {
+    'parser': ('.parser', None),
+    'router': ('.router', None),
+    'Router': ('.router', 'Router'),
+    'Dynamic': ('.router', 'Dynamic'),
+    'settings': ('.settings', None),
+    'Settings': ('.settings', 'Settings'),
+    'watch': ('.watch', None),
+    'reloader': ('.reloader', None),
+    'snapshot': ('.snapshot', None),
+    'artifact': ('.artifact', None),
+    'cli': ('.cli', None),
+    'profiling': ('.profiling', None),
+    'analysis': ('.analysis', None),
+    'trace': ('.trace', None),
+    'wsgi': ('.wsgi', None),
+    'prefork': ('.prefork', None),
+    'evented': ('.evented', None),
+}
+
+
+class _LazyModule(ModuleType):
+    """
+    Stands in for this package in ``sys.modules`` so `_lazy` attributes are
+    imported on first access.
+    """
+
+    def __getattr__(self, name):
+        if name not in _lazy:
+            raise AttributeError(
+                "'module' object has no attribute '{0}'".format(name)
+            )
+        module_name, attr = _lazy[name]
+        value = importlib.import_module(module_name, __name__)
+        if attr is not None:
+            value = getattr(value, attr)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__).union(_lazy))
+
+
+def _install():
+    module = sys.modules[__name__]
+    lazy = _LazyModule(__name__, __doc__)
+    lazy.__dict__.update(module.__dict__)
+    # NOTE: keeps this module, and so the globals of its functions, alive
+    lazy.__dict__['_module'] = module
+    sys.modules[__name__] = lazy
+
+
+_install()
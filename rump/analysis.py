@@ -0,0 +1,241 @@
+"""
+Rule coverage and dead rule analysis. Rules that are never hit, or that can
+never be hit because an earlier rule always matches first (i.e. they are
+shadowed), only lengthen the linear scan done by ``rump.Rules.match``:
+
+.. code:: python
+
+    analysis = rump.analysis.Analysis(router)
+    for request in requests:
+        analysis.evaluate(request)
+    print analysis.reports()
+
+or from the command line:
+
+.. code:: bash
+
+    $ rump analyze my-router -r requests.http
+
+Shadowing is determined statically and conservatively, so a rule reported as
+shadowed is provably dead but not all dead rules are reported as shadowed.
+"""
+import numbers
+import StringIO
+
+from .exp import (
+    Expression, And, Or, UnaryOp, FieldOp, FieldEqual, FieldNotEqual,
+    FieldLessThan, FieldLessThanEqual, FieldGreaterThan,
+    FieldGreaterThanEqual, FieldStartswith, FieldEndswith, FieldMatch,
+    FieldIn,
+)
+from .metrics import SelectionMetrics
+
+
+__all__ = [
+    'Analysis',
+    'implies',
+    'shadowed',
+]
+
+
+def implies(expression, other):
+    """
+    Determines whether any request matching `expression` provably also
+    matches `other`. This is conservative so False means "unknown".
+
+    :param expression: A ``rump.Expression``.
+    :param other: A ``rump.Expression``.
+
+    :return: True if `expression` implies `other`, otherwise False.
+    """
+    if isinstance(expression, Or):
+        return (
+            implies(expression.lhs, other) and implies(expression.rhs, other)
+        )
+    if isinstance(other, And):
+        return implies(expression, other.lhs) and implies(expression, other.rhs)
+    if isinstance(other, Or):
+        if implies(expression, other.lhs) or implies(expression, other.rhs):
+            return True
+    if isinstance(expression, And):
+        return implies(expression.lhs, other) or implies(expression.rhs, other)
+    if isinstance(other, Or):
+        return False
+    return _atom_implies(expression, other)
+
+
+def shadowed(rules):
+    """
+    Finds rules that are shadowed by an earlier rule.
+
+    :param rules: A ``rump.Rules``, or list of rules.
+
+    :return: List of ``(index, shadowing index)`` pairs.
+    """
+    pairs = []
+    for i, rule in enumerate(rules):
+        for j in xrange(i):
+            if implies(rule.expression, rules[j].expression):
+                pairs.append((i, j))
+                break
+    return pairs
+
+
+class Analysis(object):
+    """
+    Rule hit counts for a corpus of requests evaluated by `router`, along with
+    never hit and shadowed rules.
+    """
+
+    def __init__(self, router):
+        self.router = router
+        self.metrics = SelectionMetrics()
+        #: Number of requests evaluated.
+        self.requests = 0
+
+    def evaluate(self, request):
+        """
+        Evaluates a `request` (an instance of ``Router.request_type``) and
+        records which rule, if any, it hit.
+        """
+        self.requests += 1
+        return self.router.match_upstream(request, self.metrics)
+
+    def hits(self, name):
+        """
+        :param name: Either "overrides" or "rules".
+
+        :return: List of hit counts by rule index.
+        """
+        counts = self.metrics.rule_hits.values()
+        return [
+            counts.get((self.router.name, name, i), 0)
+            for i in xrange(len(getattr(self.router, name)))
+        ]
+
+    @property
+    def misses(self):
+        """
+        Number of requests not matching any rule.
+        """
+        return self.requests - sum(self.metrics.rule_hits.values().values())
+
+    def report(self, io):
+        """
+        Writes hit counts per rule, noting never hit and shadowed rules.
+        """
+        never, shadows = 0, 0
+        io.write('router {0} - {1} request(s), {2} matched no rule\n'.format(
+            self.router.name, self.requests, self.misses,
+        ))
+        for name in ['overrides', 'rules']:
+            rules = getattr(self.router, name)
+            if not len(rules):
+                continue
+            by = dict(shadowed(rules))
+            io.write('\n{0:>8}  {1}\n'.format('hits', name))
+            for i, hits in enumerate(self.hits(name)):
+                notes = []
+                if not hits:
+                    notes.append('never hit')
+                    never += 1
+                if i in by:
+                    notes.append('shadowed by [{0}]'.format(by[i]))
+                    shadows += 1
+                io.write('{0:>8}  [{1}] {2}{3}\n'.format(
+                    hits, i, rules[i],
+                    '  # ' + ', '.join(notes) if notes else '',
+                ))
+        io.write('\n{0} never hit, {1} shadowed\n'.format(never, shadows))
+
+    def reports(self):
+        io = StringIO.StringIO()
+        self.report(io)
+        return io.getvalue()
+
+
+# internals
+
+def _path(field):
+    return Expression._field_literal(field)
+
+
+def _atom_implies(expression, other):
+    if str(expression) == str(other):
+        return True
+    if isinstance(expression, UnaryOp) or isinstance(other, UnaryOp):
+        return False
+    if not isinstance(expression, FieldOp) or not isinstance(other, FieldOp):
+        return False
+    if expression.inv or other.inv:
+        return False
+    if _path(expression.field) != _path(other.field):
+        return False
+    value, literal = expression.literal, other.literal
+
+    # other is field startswith/endswith literal
+    if type(other) in (FieldStartswith, FieldEndswith):
+        if not isinstance(literal, basestring):
+            return False
+        test = (
+            'startswith' if type(other) is FieldStartswith else 'endswith'
+        )
+        if type(expression) in (type(other), FieldEqual):
+            return (
+                isinstance(value, basestring) and getattr(value, test)(literal)
+            )
+        return False
+
+    # other is field in literal
+    if type(other) is FieldIn:
+        if type(expression) is FieldEqual:
+            return _contains(literal, value)
+        if type(expression) is FieldIn:
+            if isinstance(value, (list, tuple, set, frozenset)):
+                return all(_contains(literal, item) for item in value)
+            return _contains(literal, value)
+        return False
+
+    # other is field != literal
+    if type(other) is FieldNotEqual:
+        if type(expression) is FieldEqual:
+            return value is not None and value != literal
+        return False
+
+    # other is field ~ literal
+    if type(other) is FieldMatch:
+        if type(expression) is FieldEqual and isinstance(value, basestring):
+            return literal.match(value) is not None
+        return False
+
+    # other is an ordering
+    orderings = {
+        FieldLessThan: lambda v, l, strict: v < l or (strict and v == l),
+        FieldLessThanEqual: lambda v, l, strict: v <= l,
+        FieldGreaterThan: lambda v, l, strict: v > l or (strict and v == l),
+        FieldGreaterThanEqual: lambda v, l, strict: v >= l,
+    }
+    if type(other) in orderings:
+        if not (isinstance(value, numbers.Number) and
+                isinstance(literal, numbers.Number)):
+            return False
+        compare = orderings[type(other)]
+        if type(expression) is FieldEqual:
+            return compare(value, literal, False)
+        lower = (FieldGreaterThan, FieldGreaterThanEqual)
+        upper = (FieldLessThan, FieldLessThanEqual)
+        if ((type(other) in lower and type(expression) in lower) or
+            (type(other) in upper and type(expression) in upper)):
+            # NOTE: a strict bound implies an equal non-strict or strict one.
+            strict = type(expression) in (FieldGreaterThan, FieldLessThan)
+            return compare(value, literal, strict)
+        return False
+
+    return False
+
+
+def _contains(collection, item):
+    try:
+        return item in collection
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,245 @@
+"""
+Rules parsed ahead of time, so loading settings does not have to build rule
+grammars or parse rules. An artifact is built from settings by:
+
+.. code:: bash
+
+    $ rump compile -o /etc/rump/rump.compiled
+
+and used by loading those settings w/ it configured:
+
+.. code:: ini
+
+    [rump]
+    includes = ./*.conf
+    compiled = ./rump.compiled
+
+Rules are looked up by their text and the request type they are parsed for.
+Those not in the artifact (e.g. changed since it was built) are just parsed
+as usual. Parsed rules of each request type are stored as separate pickles
+(see ``rump.snapshot.pickler``) that are only loaded when first needed. An
+artifact built by a different version of rump is ignored.
+
+Loading an artifact unpickles it, which can run arbitrary code, so it and its
+directory must only be writable by trusted users. Artifacts that could have
+been written by another user are ignored, see
+``rump.snapshot.check_trusted``.
+
+Artifacts are also used to cache the rules parsed from each included file,
+see ``rump.Settings.cache_dir``.
+"""
+import cPickle as pickle
+import errno
+import logging
+import os
+import StringIO
+import tempfile
+import time
+
+from . import __version__, Rule, snapshot
+
+
+__all__ = [
+    'Artifact',
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Version of the artifact format.
+FORMAT = 2
+
+
+class Artifact(object):
+    """
+    Parsed rules by request type and rule text.
+
+    :param record: Whether rules parsed because they are not in this artifact
+                   are added to it, e.g. when building one.
+    """
+
+    def __init__(self, record=False):
+        self.record = record
+        #: Path this artifact was loaded from or saved to.
+        self.path = None
+        #: Number of rules found in this artifact.
+        self.hits = 0
+        #: Number of rules not found in this artifact.
+        self.misses = 0
+        self._tables = {}
+        self._pickled = {}
+
+    @classmethod
+    def load(cls, path, key=None):
+        """
+        Loads artifact @ `path`.
+
+        :param key: If given the artifact is stale unless saved w/ this key.
+
+        :return: The ``Artifact``, or None if it is missing, stale or
+                 untrusted.
+        """
+        try:
+            with open(path, 'rb') as fo:
+                snapshot.check_trusted(fo)
+                stamps = pickle.load(fo)
+                if stamps.get('format') != FORMAT or stamps.get('rump') != __version__:
+                    raise snapshot.Stale('format {0!r}, rump {1!r}'.format(
+                        stamps.get('format'), stamps.get('rump'),
+                    ))
+                if key is not None and stamps.get('key') != key:
+                    raise snapshot.Stale('key {0!r} != {1!r}'.format(
+                        stamps.get('key'), key,
+                    ))
+                pickled = pickle.load(fo)
+        except IOError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            logger.info('no compiled rules @ %s', path)
+            return None
+        except snapshot.Stale, ex:
+            logger.info('compiled rules @ %s are stale - %s', path, ex)
+            return None
+        except snapshot.Untrusted, ex:
+            logger.warning('ignoring compiled rules @ %s - %s', path, ex)
+            return None
+        artifact = cls()
+        artifact.path = path
+        artifact._pickled = pickled
+        logger.info(
+            'loaded compiled rules for %s @ %s', sorted(pickled), path,
+        )
+        return artifact
+
+    def save(self, path, key=None):
+        """
+        Atomically (over)writes artifact @ `path`.
+
+        :param key: Optional key to save it w/, see `load`.
+        """
+        directory = os.path.dirname(path) or '.'
+        fd, tmp_path = tempfile.mkstemp(
+            dir=directory, prefix='.' + os.path.basename(path),
+        )
+        try:
+            with os.fdopen(fd, 'wb') as fo:
+                stamps = {
+                    'format': FORMAT,
+                    'rump': __version__,
+                    'key': key,
+                    'at': time.time(),
+                }
+                pickle.dump(stamps, fo, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(self._pickle(), fo, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self.path = path
+        logger.info('saved %s compiled rule(s) to %s', len(self), path)
+
+    def dumps(self):
+        """
+        Dumps this artifact to a string, e.g. to send to another process.
+        """
+        return pickle.dumps(self._pickle(), pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def loads(cls, s):
+        artifact = cls()
+        artifact._pickled = pickle.loads(s)
+        return artifact
+
+    def merge(self, other):
+        """
+        Adds the rules of `other` artifact to this one.
+        """
+        for name, chunks in other._pickle().iteritems():
+            self._pickled.setdefault(name, []).extend(chunks)
+            if name in self._tables:
+                request_type, table = self._tables[name]
+                for chunk in chunks:
+                    table.update(self._unpickle(name, chunk, request_type))
+
+    def __len__(self):
+        """
+        Number of rules in the tables loaded (or added to) so far.
+        """
+        return sum(len(table) for _, table in self._tables.itervalues())
+
+    def rule(self, request_type, text):
+        """
+        Gets rule `text` parsed for `request_type`.
+
+        :return: The ``rump.Rule``, or None if it is not in this artifact.
+        """
+        table = self._table(request_type)
+        parsed = table.get(text) if table is not None else None
+        if parsed is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Rule(*parsed)
+
+    def add(self, request_type, text, rule):
+        """
+        Adds `rule` parsed from `text` for `request_type`.
+        """
+        table = self._table(request_type, create=True)
+        table[text] = (rule.expression, rule.upstream)
+
+    def parse(self, request_type, text, parse):
+        """
+        Gets rule `text` parsed for `request_type` from this artifact, or by
+        `parse` (recording it if `record`) if it is not in it.
+        """
+        rule = self.rule(request_type, text)
+        if rule is None:
+            rule = parse(text)
+            if self.record:
+                self.add(request_type, text, rule)
+        return rule
+
+    # internals
+
+    def _pickle(self):
+        # NOTE: request type name to pickled table chunks
+        pickled = dict(
+            (name, list(chunks)) for name, chunks in self._pickled.iteritems()
+        )
+        for name, (request_type, table) in self._tables.iteritems():
+            io = StringIO.StringIO()
+            snapshot.pickler(io, request_type).dump(table)
+            pickled[name] = [io.getvalue()]
+        return pickled
+
+    def _unpickle(self, name, chunk, request_type):
+        try:
+            return snapshot.unpickler(
+                StringIO.StringIO(chunk), request_type,
+            ).load()
+        except Exception, ex:
+            # NOTE: e.g. a field has since been removed from request_type
+            logger.warning(
+                'compiled rules for %s @ %s are stale - %s', name, self.path, ex,
+            )
+            return {}
+
+    def _table(self, request_type, create=False):
+        name = snapshot.qualified(request_type)
+        entry = self._tables.get(name)
+        if entry is not None and entry[0] is request_type:
+            return entry[1]
+        table = None
+        chunks = self._pickled.get(name)
+        if chunks is not None:
+            table = {}
+            for chunk in chunks:
+                table.update(self._unpickle(name, chunk, request_type))
+            logger.debug('loaded %s compiled rule(s) for %s', len(table), name)
+        if table is None and create:
+            table = {}
+        if table is not None:
+            self._tables[name] = (request_type, table)
+        return table
@@ -9,7 +9,7 @@ Commands for interacting w/ a rump install. These are exposed by bin/rump, so:
 import argparse
 import logging
 import os
-import pprint
+import socket
 import SocketServer
 import subprocess
 import sys
@@ -90,7 +90,10 @@ def parser(log_level=None, conf_file=None):
     edit_parser(commands, [root])
     watch_parser(commands, [root])
     check_parser(commands, [root])
+    compile_parser(commands, [root])
     upstream_parser(commands, [root])
+    profile_parser(commands, [root])
+    analyze_parser(commands, [root])
     serve_parser(commands, [root])
 
     return parser
@@ -120,7 +123,13 @@ def setup(args):
         stream=sys.stderr,
     )
     if args.auto_load_settings:
-        args.settings = rump.Settings.from_file(args.conf_file)
+        # NOTE: only build the routers a command is for, if it names them
+        names = None
+        if getattr(args, 'name', None):
+            names = [args.name]
+        elif isinstance(getattr(args, 'names', None), list) and args.names:
+            names = args.names
+        args.settings = rump.Settings.from_file(args.conf_file, names=names)
     if args.dynamic:
         for router in args.settings.routers:
             if router.is_dynamic:
@@ -140,6 +149,28 @@ def check(conf_file, name):
     router_with_name(settings.routers, name)
 
 
+def compile_rules(conf_file, path=None):
+    """
+    Parses the rules of all routers in settings `conf_file` and saves them as
+    a ``rump.artifact.Artifact``.
+
+    :param path: Where to save it, defaults to the settings `compiled`.
+
+    :return: The saved artifact.
+    """
+    artifact = rump.artifact.Artifact(record=True)
+    with pilo.ctx(artifact=artifact):
+        settings = rump.Settings.from_file(conf_file)
+    path = path or settings.compiled
+    if not path:
+        raise ValueError(
+            'No path to save compiled rules to, use -o or set compiled in {0}'
+            .format(conf_file)
+        )
+    artifact.save(path)
+    return artifact
+
+
 def edit(router, io=None):
     if not router.is_dynamic:
         raise ValueError('Router {0} is not dynamic'.format(router.name))
@@ -220,54 +251,98 @@ def watch(routers, timeout=None, notifications=None, poll=1.0):
             router.disconnect()
 
 
-def eval_requests(routers, io, default_router=None):
+def eval_requests(routers, io, default_router=None, tracer=None):
     for request in rump.wsgi.Request.read(io):
+        record = tracer.begin(request) if tracer is not None else None
         for router in routers:
             if router.match_me(request):
                 break
         else:
             if default_router is None:
-                logger.warning(
-                   'no router for - \n%s', pprint.pformat(request.environ)
-                )
+                logger.warning('no router for %s', request.request_line)
+                if record is not None:
+                    tracer.end(record, None, request, error='no router')
                 continue
             router = default_router
-        upstream = router.match_upstream(router.request_type(request.environ))
+        routed = request.for_router(router)
+        upstream = router.match_upstream(routed, trace=record)
         if upstream is None:
             logger.warning(
-               'router %s has no upstream for - \n%s',
-               router.name, pprint.pformat(request.environ)
+               'router %s has no upstream for %s',
+               router.name, request.request_line,
             )
+            if record is not None:
+                tracer.end(record, router, routed, error='no upstream')
             continue
         logger.debug(
-           'router %s matched upstream %s for - \n%s',
-           router.name, upstream, pprint.pformat(request.environ)
+           'router %s matched upstream %s for %s',
+           router.name, upstream, request.request_line,
         )
         server = upstream()
+        if record is not None:
+            tracer.end(record, router, routed, upstream, server)
         print '{0}://{1}'.format(server.protocol, server.location)
 
 
-def server_for(host, port, mode=None):
+def profile_requests(routers, io, repeat=1):
+    environs = [request.environ for request in rump.wsgi.Request.read(io)]
+    profile = rump.profiling.Profile()
+    for router in routers:
+        router.profile(profile)
+    try:
+        for _ in xrange(repeat):
+            for environ in environs:
+                request = rump.wsgi.Request(
+                    environ, rump.wsgi.app.settings.id_header
+                )
+                for router in routers:
+                    if router.match_me(request):
+                        break
+                else:
+                    continue
+                router.match_upstream(request.for_router(router))
+    finally:
+        for router in routers:
+            router.profile(None)
+    return profile
+
+
+def analyze_requests(router, io, all_hosts=False):
+    analysis = rump.analysis.Analysis(router)
+    for request in rump.wsgi.Request.read(io):
+        if not all_hosts and not router.match_me(request):
+            continue
+        analysis.evaluate(request.for_router(router))
+    return analysis
+
+
+def server_for(host, port, mode=None, reuse_port=False):
+    if mode == 'evented':
+        return rump.evented.Server(
+            (host, port), app=rump.wsgi.app, reuse_port=reuse_port,
+        )
+
+    class server_cls(wsgiref.simple_server.WSGIServer):
+
+        def server_bind(self):
+            if reuse_port:
+                self.socket.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_REUSEPORT, 1
+                )
+            wsgiref.simple_server.WSGIServer.server_bind(self)
+
     if mode == 'thread':
 
-        class server_cls(
-                  SocketServer.ThreadingMixIn,
-                  wsgiref.simple_server.WSGIServer,
-              ):
+        class server_cls(SocketServer.ThreadingMixIn, server_cls):
+
             pass
 
     elif mode == 'fork':
 
-        class server_clsserver_cls(
-                  SocketServer.ForkingMixIn,
-                  wsgiref.simple_server.WSGIServer,
-              ):
+        class server_cls(SocketServer.ForkingMixIn, server_cls):
 
             pass
 
-    else:
-        server_cls = wsgiref.simple_server.WSGIServer
-
     return wsgiref.simple_server.make_server(
         host=host, port=port, app=rump.wsgi.app, server_class=server_cls,
     )
@@ -353,6 +428,27 @@ def check_command(args):
     return 0
 
 
+def compile_parser(commands, parents):
+    command = commands.add_parser(
+        'compile',
+        parents=parents,
+        description='Compile rules so loading settings skips parsing them.',
+    )
+    command.add_argument(
+        '-o', '--output',
+        metavar='FILE',
+        help='file to write to, defaults to compiled from settings',
+    )
+    command.set_defaults(command=compile_command, auto_load_settings=False)
+    return command
+
+
+def compile_command(args):
+    artifact = compile_rules(args.conf_file, args.output)
+    print artifact.path
+    return 0
+
+
 def watch_parser(commands, parents):
     command = commands.add_parser(
         'watch',
@@ -403,6 +499,17 @@ def upstream_parser(commands, parents):
         default='-',
         help='HTTP requests FILE, or - to read from stdin',
     )
+    command.add_argument(
+        '-t', '--trace',
+        metavar='FILE',
+        help='append selection traces, as JSON lines, to FILE',
+    )
+    command.add_argument(
+        '--trace-rate',
+        type=float,
+        default=1.0,
+        help='fraction (0 - 1) of selections to trace',
+    )
     command.set_defaults(command=eval_command, auto_load_settings=True)
     return command
 
@@ -418,7 +525,96 @@ def eval_command(args):
         if args.requests == '-'
         else open(args.requests, 'r')
     )
-    eval_requests(routers=routers, io=io)
+    tracer = (
+        rump.trace.Tracer(args.trace, rate=args.trace_rate)
+        if args.trace
+        else None
+    )
+    try:
+        eval_requests(routers=routers, io=io, tracer=tracer)
+    finally:
+        if tracer is not None:
+            tracer.stop()
+
+
+def profile_parser(commands, parents):
+    command = commands.add_parser(
+        'profile',
+        parents=parents,
+        description='Profile rule evaluation and field resolution for HTTP requests.',
+    )
+    command.add_argument(
+        'names', nargs='*', help='router names',
+    )
+    command.add_argument(
+        '-r', '--requests',
+        default='-',
+        help='HTTP requests FILE, or - to read from stdin',
+    )
+    command.add_argument(
+        '-n', '--repeat',
+        type=int,
+        default=1,
+        help='evaluate the requests this many times',
+    )
+    command.add_argument(
+        '--limit',
+        type=int,
+        default=None,
+        help='report at most this many rules and fields',
+    )
+    command.set_defaults(command=profile_command, auto_load_settings=True)
+    return command
+
+
+def profile_command(args):
+    routers = (
+        [router_with_name(args.settings.routers, name) for name in args.names]
+        if args.names
+        else args.settings.routers
+    )
+    io = (
+        sys.stdin
+        if args.requests == '-'
+        else open(args.requests, 'r')
+    )
+    profile = profile_requests(routers=routers, io=io, repeat=args.repeat)
+    profile.report(sys.stdout, limit=args.limit)
+
+
+def analyze_parser(commands, parents):
+    command = commands.add_parser(
+        'analyze',
+        parents=parents,
+        description='Report rule hits, never hit and shadowed rules for HTTP requests.',
+    )
+    command.add_argument(
+        'name', help='router name',
+    )
+    command.add_argument(
+        '-r', '--requests',
+        default='-',
+        help='HTTP requests FILE, or - to read from stdin',
+    )
+    command.add_argument(
+        '-a', '--all-hosts',
+        action='store_true',
+        default=False,
+        help="evaluate all requests, not just those matching the router's hosts",
+    )
+    command.set_defaults(command=analyze_command, auto_load_settings=True)
+    return command
+
+
+def analyze_command(args):
+    router = router_with_name(args.settings.routers, args.name)
+    io = (
+        sys.stdin
+        if args.requests == '-'
+        else open(args.requests, 'r')
+    )
+    analysis = analyze_requests(router, io, all_hosts=args.all_hosts)
+    analysis.report(sys.stdout)
 
 
 def serve_parser(commands, parents):
@@ -442,6 +638,31 @@ def serve_parser(commands, parents):
     command.add_argument(
         '-t', '--threading', action='store_true', default=False,
     )
+    command.add_argument(
+        '-e', '--evented',
+        action='store_true',
+        default=False,
+        help='serve keep-alive connections from an event loop.',
+    )
+    command.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=0,
+        metavar='N',
+        help='pre-fork N worker processes, 0 to serve from this process.',
+    )
+    command.add_argument(
+        '--reuse-port',
+        action='store_true',
+        default=False,
+        help='have each worker bind its own socket w/ SO_REUSEPORT.',
+    )
+    command.add_argument(
+        '--publish-reloads',
+        action='store_true',
+        default=False,
+        help='publish reloads to workers rather than recycling them.',
+    )
     command.set_defaults(command=serve_command, auto_load_settings=False)
     return command
 
@@ -449,14 +670,39 @@ def serve_parser(commands, parents):
 def serve_command(args):
     if args.conf_file is not None:
         rump.wsgi.app.settings.from_file(args.conf_file)
-    rump.wsgi.app.setup()
 
     mode = None
     if args.forking:
         mode = 'fork'
-    if args.forking:
+    if args.threading:
         mode = 'thread'
-    server = server_for(host=args.host, port=args.port, mode=mode,)
+    if args.evented:
+        mode = 'evented'
+
+    if args.workers:
+        master = rump.prefork.Master(
+            server_factory=lambda: server_for(
+                host=args.host,
+                port=args.port,
+                mode=mode,
+                reuse_port=args.reuse_port,
+            ),
+            workers=args.workers,
+            reuse_port=args.reuse_port,
+            app=rump.wsgi.app,
+            publish_reloads=args.publish_reloads,
+        )
+        logger.info(
+            'serving on %s:%s w/ %s worker(s) ...',
+            args.host, args.port, master.workers,
+        )
+        master.run()
+        return
+
+    rump.wsgi.app.setup()
+    server = server_for(
+        host=args.host, port=args.port, mode=mode, reuse_port=args.reuse_port,
+    )
     logger.info('serving on {0}:{1} ...'.format(*server.server_address))
     try:
         server.serve_forever()
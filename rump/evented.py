@@ -0,0 +1,357 @@
+"""
+Event-loop HTTP/1.1 server for upstream selection. Unlike the ``wsgiref``
+servers this:
+
+- handles many concurrent connections from a single thread,
+- keeps connections alive (e.g. nginx ``keepalive`` upstreams) and
+- builds WSGI environments directly from parsed request headers
+
+and then calls the same WSGI application (i.e. ``rump.wsgi.app``) so
+selection behaves exactly as it does for ``rump serve``. Use it like:
+
+.. code:: bash
+
+    $ rump serve -e
+
+or embedded:
+
+.. code:: python
+
+    server = rump.evented.Server(('127.0.0.1', 4114), rump.wsgi.app)
+    server.serve_forever()
+
+"""
+import asynchat
+import asyncore
+import logging
+import socket
+import StringIO
+import sys
+import time
+import urllib
+
+
+__all__ = [
+    'Server',
+    'Connection',
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+class Server(asyncore.dispatcher):
+    """
+    Listening socket dispatching accepted connections to `connection_type`.
+
+    `server_address`
+        Host, port pair to bind to.
+
+    `app`
+        WSGI application to call for each request.
+
+    `backlog`
+        Listen backlog.
+
+    `idle_timeout`
+        Seconds an idle keep-alive connection is held open.
+
+    `reuse_port`
+        Flag determining whether to bind w/ ``SO_REUSEPORT``.
+    """
+
+    connection_type = None
+
+    def __init__(self,
+                 server_address,
+                 app,
+                 backlog=1024,
+                 idle_timeout=60.0,
+                 reuse_port=False,
+        ):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.app = app
+        self.idle_timeout = idle_timeout
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.bind(server_address)
+        self.listen(backlog)
+        self.server_address = self.socket.getsockname()[:2]
+        self.server_name = socket.getfqdn(self.server_address[0])
+        self.base_environ = {
+            'SERVER_NAME': self.server_name,
+            'SERVER_PORT': str(self.server_address[1]),
+            'SCRIPT_NAME': '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        self._swept_at = time.time()
+
+    @property
+    def connections(self):
+        return [
+            dispatcher for dispatcher in self.map.itervalues()
+            if dispatcher is not self
+        ]
+
+    def serve_once(self, timeout=0.5):
+        """
+        Runs one iteration of the event loop, waiting at most `timeout`
+        seconds for activity.
+        """
+        asyncore.loop(timeout=timeout, use_poll=True, map=self.map, count=1)
+        now = time.time()
+        if now - self._swept_at >= 1.0:
+            self._swept_at = now
+            self.sweep(now)
+
+    def serve_forever(self, poll_interval=0.5):
+        self._serving = True
+        while self._serving:
+            self.serve_once(poll_interval)
+
+    def shutdown(self):
+        self._serving = False
+
+    def server_close(self):
+        for connection in self.connections:
+            connection.close()
+        self.close()
+
+    def sweep(self, now=None):
+        """
+        Closes connections idle for longer than `idle_timeout`.
+        """
+        if not self.idle_timeout:
+            return
+        now = time.time() if now is None else now
+        for connection in self.connections:
+            if connection.idle and now - connection.active_at > self.idle_timeout:
+                logger.debug('closing idle connection %s', connection.addr)
+                connection.close()
+
+    # asyncore.dispatcher
+
+    #: Maximum number of connections accepted per readable event.
+    accepts_per_event = 64
+
+    def handle_accept(self):
+        for _ in xrange(self.accepts_per_event):
+            pair = self.accept()
+            if pair is None:
+                break
+            sock, addr = pair
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connection_type(sock, addr, self)
+
+    def handle_error(self):
+        logger.exception('server error')
+
+    _serving = False
+
+
+class Connection(asynchat.async_chat):
+    """
+    One HTTP/1.x connection. Requests are read, dispatched to the WSGI
+    application and responded to in order.
+    """
+
+    #: Maximum size of request line plus headers.
+    max_header_size = 64 * 1024
+
+    ac_in_buffer_size = 16 * 1024
+
+    ac_out_buffer_size = 16 * 1024
+
+    def __init__(self, sock, addr, server):
+        asynchat.async_chat.__init__(self, sock, map=server.map)
+        self.addr = addr
+        self.server = server
+        self.active_at = time.time()
+        #: Whether an error was responded, after which input is discarded.
+        self.errored = False
+        self._reset()
+
+    @property
+    def idle(self):
+        return not self._buffer and self._environ is None
+
+    def _reset(self):
+        self._buffer = []
+        self._buffered = 0
+        self._environ = None
+        self.set_terminator('\r\n\r\n')
+
+    # asynchat.async_chat
+
+    def readable(self):
+        return not self.errored and asynchat.async_chat.readable(self)
+
+    def collect_incoming_data(self, data):
+        if self.errored:
+            return
+        self.active_at = time.time()
+        self._buffered += len(data)
+        if self._environ is None and self._buffered > self.max_header_size:
+            self._error('431 Request Header Fields Too Large')
+            return
+        self._buffer.append(data)
+
+    def found_terminator(self):
+        data = ''.join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        if self._environ is None:
+            if not data.strip():
+                # NOTE: tolerate stray CRLFs between requests.
+                return
+            environ = self._parse(data)
+            if environ is None:
+                return
+            length = environ.get('CONTENT_LENGTH')
+            if length:
+                try:
+                    length = int(length)
+                except ValueError:
+                    self._error('400 Bad Request')
+                    return
+                if length > 0:
+                    self._environ = environ
+                    self.set_terminator(length)
+                    return
+            body = ''
+        else:
+            environ, body = self._environ, data
+        environ['wsgi.input'] = StringIO.StringIO(body)
+        self._respond(environ)
+
+    def handle_error(self):
+        logger.exception('connection %s error', self.addr)
+        self.close()
+
+    # internals
+
+    def _parse(self, data):
+        lines = data.split('\r\n')
+        try:
+            method, uri, protocol = lines[0].split(' ', 2)
+        except ValueError:
+            self._error('400 Bad Request')
+            return
+        if not protocol.startswith('HTTP/'):
+            self._error('400 Bad Request')
+            return
+        path, _, query = uri.partition('?')
+        if '://' in path:
+            path = '/' + path.split('://', 1)[1].partition('/')[2]
+        environ = self.server.base_environ.copy()
+        environ.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': urllib.unquote(path),
+            'QUERY_STRING': query,
+            'SERVER_PROTOCOL': protocol,
+            'REMOTE_ADDR': self.addr[0],
+            'REMOTE_PORT': str(self.addr[1]),
+        })
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                continue
+            name = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            key = 'HTTP_' + name
+            if key in environ:
+                environ[key] += ',' + value
+            else:
+                environ[key] = value
+        return environ
+
+    def _keep_alive(self, environ):
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if environ['SERVER_PROTOCOL'] == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def _respond(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            response['status'], response['headers'] = status, headers
+
+        try:
+            result = self.server.app(environ, start_response)
+            try:
+                body = ''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except Exception, ex:
+            logger.exception(ex)
+            self._error(
+                '500 Internal Server Error', environ['REQUEST_METHOD'] == 'HEAD',
+            )
+            return
+
+        keep_alive = self._keep_alive(environ)
+        lines = ['{0} {1}'.format(environ['SERVER_PROTOCOL'], response['status'])]
+        has_length = False
+        for name, value in response['headers']:
+            if name.lower() == 'content-length':
+                has_length = True
+            lines.append('{0}: {1}'.format(name, value))
+        if not has_length:
+            lines.append('Content-Length: {0}'.format(len(body)))
+        if not keep_alive:
+            lines.append('Connection: close')
+        elif environ['SERVER_PROTOCOL'] == 'HTTP/1.0':
+            lines.append('Connection: keep-alive')
+        lines.append('')
+        # NOTE: HEAD responses keep the Content-Length of the body they omit
+        lines.append(body if environ['REQUEST_METHOD'] != 'HEAD' else '')
+        self.push('\r\n'.join(lines))
+        self.active_at = time.time()
+        self._reset()
+        if not keep_alive:
+            self.close_when_done()
+
+    def _error(self, status, head=False):
+        body = status
+        self.push(
+            'HTTP/1.1 {0}\r\n'
+            'Content-Type: text/plain\r\n'
+            'Content-Length: {1}\r\n'
+            'Connection: close\r\n'
+            '\r\n'
+            '{2}'.format(status, len(body), body if not head else '')
+        )
+        # NOTE: stop reading, and discard anything already read, so only
+        # this response is sent before closing
+        self.errored = True
+        self._buffer, self._buffered = [], 0
+        self.set_terminator(None)
+        self.close_when_done()
+
+    # NOTE: silence asyncore's default per-event logging.
+
+    def log(self, message):
+        logger.debug(message)
+
+    def log_info(self, message, type='info'):
+        logger.debug(message)
+
+
+Server.connection_type = Connection
+
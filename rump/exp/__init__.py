@@ -531,7 +531,7 @@ class FieldMatch(FieldOp):
     def compile(self, symbols):
         field_key = symbols.field(self.field)
         literal_key = symbols.literal(self.literal)
-        return '{inv}(request[{field}] is not None and request[{field}].match({literal}))'.format(
+        return '{inv}(request[{field}] is not None and {literal}.match(request[{field}]) is not None)'.format(
             inv='not ' if self.inv else '',
             field=field_key,
             literal=literal_key,
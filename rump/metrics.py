@@ -0,0 +1,295 @@
+"""
+Low overhead counters and histograms exposed in the Prometheus text format.
+Each thread updates its own values so recording never takes a lock, values
+are only aggregated across threads when collected:
+
+.. code:: python
+
+    metrics = rump.metrics.Metrics()
+    hits = metrics.counter('hits_total', 'Number of hits.', ['router'])
+    hits.inc(('my-router',))
+    print metrics.dumps()
+
+Selections are instrumented by passing `SelectionMetrics` to
+``rump.Router.match_upstream`` (as ``rump.wsgi`` does, see its ``metrics``
+and ``metrics_path`` settings):
+
+.. code:: python
+
+    metrics = rump.metrics.SelectionMetrics()
+    upstream = router.match_upstream(request, metrics)
+    print metrics.dumps()
+
+"""
+import bisect
+import StringIO
+import thread
+import time
+
+
+__all__ = [
+    'Metrics',
+    'Counter',
+    'Histogram',
+    'SelectionMetrics',
+    'timer',
+]
+
+
+#: Clock used to time things.
+timer = time.time
+
+
+class Family(object):
+    """
+    Base for a named family of samples with the same `labels` names. Values
+    are kept per thread and label values.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._shards = {}
+
+    def values(self):
+        """
+        Aggregates values across threads.
+
+        :return: Dict of values keyed by label values.
+        """
+        raise NotImplementedError
+
+    def samples(self):
+        """
+        :return: List of ``(name, labels, value)`` samples where `labels` is a
+                 list of ``(name, value)`` pairs.
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        self._shards = {}
+
+    # internals
+
+    def _shard(self):
+        ident = thread.get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            # NOTE: thread idents are reused so shards only grow w/ the number
+            # of concurrent threads.
+            shard = self._shards.setdefault(ident, {})
+        return shard
+
+    def _labels(self, values, extra=()):
+        return zip(self.labels, values) + list(extra)
+
+
+class Counter(Family):
+    """
+    Monotonically increasing value.
+    """
+
+    type = 'counter'
+
+    def inc(self, labels=(), value=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + value
+
+    def values(self):
+        values = {}
+        for shard in self._shards.values():
+            for labels, value in shard.items():
+                values[labels] = values.get(labels, 0) + value
+        return values
+
+    def samples(self):
+        return [
+            (self.name, self._labels(labels), value)
+            for labels, value in sorted(self.values().iteritems())
+        ]
+
+
+class Histogram(Family):
+    """
+    Distribution of observed values across `buckets` (upper bounds).
+    """
+
+    type = 'histogram'
+
+    #: Default buckets in seconds, suitable for selection latencies.
+    buckets = (
+        0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+        0.05, 0.1, 0.25, 0.5, 1.0,
+    )
+
+    def __init__(self, name, help, labels=(), buckets=None):
+        super(Histogram, self).__init__(name, help, labels)
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # NOTE: per-bucket counts, then +Inf, then sum.
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def values(self):
+        values = {}
+        for shard in self._shards.values():
+            for labels, counts in shard.items():
+                total = values.get(labels)
+                if total is None:
+                    values[labels] = list(counts)
+                else:
+                    for i, count in enumerate(counts):
+                        total[i] += count
+        return values
+
+    def samples(self):
+        samples = []
+        for labels, counts in sorted(self.values().iteritems()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append((
+                    self.name + '_bucket',
+                    self._labels(labels, [('le', str(bound))]),
+                    cumulative,
+                ))
+            samples.append((self.name + '_count', self._labels(labels), cumulative))
+            samples.append((self.name + '_sum', self._labels(labels), counts[-1]))
+        return samples
+
+
+class Metrics(object):
+    """
+    Registry of metric families.
+    """
+
+    def __init__(self):
+        self.families = []
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=None):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def register(self, family):
+        if any(other.name == family.name for other in self.families):
+            raise ValueError('{0} already registered'.format(family.name))
+        self.families.append(family)
+        return family
+
+    def reset(self):
+        for family in self.families:
+            family.reset()
+
+    def dump(self, io):
+        """
+        Writes all families in the Prometheus text exposition format.
+        """
+        for family in self.families:
+            io.write('# HELP {0} {1}\n'.format(family.name, family.help))
+            io.write('# TYPE {0} {1}\n'.format(family.name, family.type))
+            for name, labels, value in family.samples():
+                if labels:
+                    name += '{' + ','.join(
+                        '{0}="{1}"'.format(label, _escape(label_value))
+                        for label, label_value in labels
+                    ) + '}'
+                io.write('{0} {1}\n'.format(name, _format(value)))
+
+    def dumps(self):
+        io = StringIO.StringIO()
+        self.dump(io)
+        return io.getvalue()
+
+
+class SelectionMetrics(Metrics):
+    """
+    Metrics for upstream selection, per:
+
+    - router: requests, errors, requests w/o an upstream and selection
+      latency,
+    - rule (by index within a router's rules or overrides): hits and seconds
+      spent matching up to and including the hit and
+    - server: selections
+
+    plus requests w/o a router.
+    """
+
+    def __init__(self):
+        super(SelectionMetrics, self).__init__()
+        self.requests = self.counter(
+            'rump_requests_total',
+            'Selection requests by router.',
+            ['router'],
+        )
+        self.no_router = self.counter(
+            'rump_no_router_total',
+            'Selection requests matching no router.',
+        )
+        self.no_upstream = self.counter(
+            'rump_no_upstream_total',
+            'Selection requests matching no upstream by router.',
+            ['router'],
+        )
+        self.errors = self.counter(
+            'rump_errors_total',
+            'Selection requests failed by router.',
+            ['router'],
+        )
+        self.latency = self.histogram(
+            'rump_selection_seconds',
+            'Selection latency by router.',
+            ['router'],
+        )
+        self.rule_hits = self.counter(
+            'rump_rule_hits_total',
+            'Requests matched by rule.',
+            ['router', 'rules', 'index'],
+        )
+        self.rule_seconds = self.counter(
+            'rump_rule_match_seconds_total',
+            'Seconds spent matching requests up to and including the matched '
+            'rule by rule.',
+            ['router', 'rules', 'index'],
+        )
+        self.selections = self.counter(
+            'rump_server_selections_total',
+            'Selections by router and server.',
+            ['router', 'protocol', 'location'],
+        )
+
+    def rule_matched(self, router, rules, index, seconds):
+        labels = (router.name, rules, index)
+        self.rule_hits.inc(labels)
+        self.rule_seconds.inc(labels, seconds)
+
+    def selected(self, router, server, seconds):
+        self.selections.inc((router.name, server.protocol, server.location))
+        self.latency.observe(seconds, (router.name,))
+
+
+# internals
+
+def _escape(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\n', '\\n')
+        .replace('"', '\\"')
+    )
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
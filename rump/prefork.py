@@ -0,0 +1,512 @@
+"""
+Pre-fork server used to scale upstream selection across cores. A master
+process:
+
+- loads settings and compiles rules **once**,
+- forks workers that inherit those routers and share the listening socket (or
+  each bind their own with ``SO_REUSEPORT``),
+- restarts workers that die and
+- recycles workers when a dynamic router, or a settings file (see
+  ``rump.wsgi.Settings.reload_files``), changes so they pick up the reload.
+
+Typically used via:
+
+.. code:: bash
+
+    $ rump serve -w 4
+
+or, to have workers load reloads published by the master rather than be
+recycled (see `Reloads`):
+
+.. code:: bash
+
+    $ rump serve -w 4 --publish-reloads
+
+"""
+import cPickle as pickle
+import errno
+import logging
+import mmap
+import os
+import select
+import shutil
+import signal
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from . import snapshot
+
+
+__all__ = [
+    'Master',
+    'Reloads',
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+class Master(object):
+    """
+    Manages a pool of worker processes each serving requests from a
+    `SocketServer.BaseServer`.
+
+    `server_factory`
+        Callable taking no arguments and returning a bound and activated
+        server (e.g. ``rump.cli.server_for``). If `reuse_port` is set this is
+        called in each worker, otherwise once in the master. Servers with a
+        ``serve_once(timeout)`` method (e.g. ``rump.evented.Server``) are
+        driven by that, otherwise as a ``SocketServer.BaseServer``.
+
+    `workers`
+        Number of worker processes to maintain.
+
+    `reuse_port`
+        Flag determining whether each worker binds its own socket with
+        ``SO_REUSEPORT`` rather than sharing one inherited from the master.
+
+    `app`
+        Optional ``rump.wsgi._Application``. If given the master connects to
+        and watches its dynamic routers (and settings files) and recycles
+        workers on changes.
+
+    `poll`
+        Seconds between checks for dead workers, signals, etc.
+
+    `publish_reloads`
+        Flag determining whether reloads are published to workers via
+        `Reloads` rather than by recycling them.
+    """
+
+    def __init__(self,
+                 server_factory,
+                 workers=None,
+                 reuse_port=False,
+                 app=None,
+                 poll=0.5,
+                 publish_reloads=False,
+        ):
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise ValueError('SO_REUSEPORT not supported on this platform')
+        self.server_factory = server_factory
+        self.workers = workers or cpu_count()
+        self.reuse_port = reuse_port
+        self.app = app
+        self.poll = poll
+        self.server = None
+        self.pids = set()
+        self.stopped = threading.Event()
+        self.recycling = threading.Event()
+        self.reloads = Reloads() if publish_reloads else None
+
+    @property
+    def routers(self):
+        return self.app.settings.routers if self.app is not None else []
+
+    @property
+    def server_address(self):
+        return self.server.server_address if self.server else None
+
+    def start(self):
+        """
+        Binds the shared socket (unless `reuse_port`) and connects to dynamic
+        routers. Call this before `spawn`.
+        """
+        if not self.reuse_port:
+            self.server = self.server_factory()
+        if self.app is not None:
+            self.app.setup(self.changed, self.files_changed)
+
+    def run(self):
+        """
+        Runs the master loop until `stop` is called or the master receives
+        ``SIGINT`` or ``SIGTERM``.
+        """
+        self._install_signals()
+        try:
+            self.start()
+            logger.info('master %s starting %s worker(s)', os.getpid(), self.workers)
+            while not self.stopped.is_set():
+                self.reap()
+                if self.recycling.is_set():
+                    self.recycling.clear()
+                    self.recycle()
+                self.spawn()
+                time.sleep(self.poll)
+        finally:
+            self.kill()
+            if self.app is not None:
+                self.app.teardown()
+            if self.reloads is not None:
+                self.reloads.close()
+            if self.server is not None:
+                self.server.server_close()
+            logger.info('master %s exited', os.getpid())
+
+    def stop(self):
+        self.stopped.set()
+
+    def changed(self, router):
+        """
+        Dynamic router change callback. Reloads `router` in the master and
+        then, unless it was unchanged, publishes it to workers or schedules
+        them to be recycled.
+        """
+        if self.app.changed(router) is False:
+            return
+        self.reloaded()
+
+    def files_changed(self, paths):
+        """
+        Settings files change callback. Reloads routers from `paths` in the
+        master and then, if any were, publishes them to workers or schedules
+        them to be recycled.
+        """
+        if not self.app.files_changed(paths):
+            return False
+        self.reloaded()
+        return True
+
+    def reloaded(self):
+        if self.reloads is not None:
+            self.publish()
+        else:
+            self.recycling.set()
+
+    def publish(self):
+        """
+        Publishes the routers of this master to workers via `reloads`.
+        """
+        self.reloads.publish(self.routers)
+
+    def spawn(self):
+        """
+        Forks workers until there are `workers` of them.
+        """
+        while len(self.pids) < self.workers:
+            pid = os.fork()
+            if pid == 0:
+                self._worker()
+            logger.info('spawned worker %s', pid)
+            self.pids.add(pid)
+
+    def reap(self):
+        """
+        Collects exited workers so they will be re-spawned.
+
+        :return: List of reaped worker pids.
+        """
+        reaped = []
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, ex:
+                if ex.errno != errno.ECHILD:
+                    raise
+                reaped.extend(self.pids)
+                self.pids.clear()
+                break
+            if pid == 0:
+                break
+            if pid in self.pids:
+                logger.warning('worker %s exited w/ status %s', pid, status)
+                self.pids.discard(pid)
+                reaped.append(pid)
+        return reaped
+
+    def recycle(self, timeout=10.0):
+        """
+        Replaces all workers with fresh forks of the master, which is how
+        reloaded routers propagate to workers. New workers are started before
+        old ones are asked to exit, old ones still running after `timeout`
+        seconds are forcibly killed.
+        """
+        logger.info('recycling worker(s) %s', sorted(self.pids))
+        old = set(self.pids)
+        self.pids.clear()
+        self.spawn()
+        self._terminate(old, timeout)
+
+    def kill(self, timeout=10.0):
+        """
+        Asks all workers to exit and waits up to `timeout` seconds before
+        forcibly killing them.
+        """
+        pids, self.pids = set(self.pids), set()
+        self._terminate(pids, timeout)
+
+    # internals
+
+    def _install_signals(self):
+        if threading.current_thread().name != 'MainThread':
+            return
+
+        def _stop(signum, frame):
+            logger.info('master %s received signal %s', os.getpid(), signum)
+            self.stop()
+
+        def _recycle(signum, frame):
+            self.recycling.set()
+
+        signal.signal(signal.SIGINT, _stop)
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGHUP, _recycle)
+
+    def _signal(self, pids, signum):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except OSError, ex:
+                if ex.errno != errno.ESRCH:
+                    raise
+
+    def _terminate(self, pids, timeout):
+        self._signal(pids, signal.SIGTERM)
+        pids = self._wait(pids, timeout)
+        if pids:
+            logger.warning('killing hung worker(s) %s', sorted(pids))
+            self._signal(pids, signal.SIGKILL)
+            self._wait(pids)
+
+    def _wait(self, pids, timeout=None):
+        pids = set(pids)
+        expires_at = time.time() + timeout if timeout is not None else None
+        while pids:
+            for pid in list(pids):
+                try:
+                    waited, _ = os.waitpid(pid, os.WNOHANG)
+                except OSError, ex:
+                    if ex.errno != errno.ECHILD:
+                        raise
+                    waited = pid
+                if waited:
+                    pids.discard(pid)
+            if not pids or (expires_at and expires_at < time.time()):
+                break
+            time.sleep(0.05)
+        return pids
+
+    def _worker(self):
+        status = 0
+        try:
+            # NOTE: threads of the master (e.g. watches, reloaders) may have
+            # held logging locks when it forked
+            reinit_logging()
+            Worker(self).run()
+        except (SystemExit, KeyboardInterrupt):
+            pass
+        except Exception, ex:
+            logger.exception('worker %s failed - %s', os.getpid(), ex)
+            status = 1
+        finally:
+            os._exit(status)
+
+
+def reinit_logging():
+    """
+    Replaces the locks of ``logging`` and its handlers. Call this in a forked
+    child, where a lock held by another thread of the parent when it forked
+    would never be released.
+    """
+    logging._lock = threading.RLock()
+    for ref in logging._handlerList:
+        handler = ref()
+        if handler is not None:
+            handler.createLock()
+
+
+class Worker(object):
+    """
+    A forked worker serving requests, one at a time, until asked to exit via
+    ``SIGTERM``.
+    """
+
+    def __init__(self, master):
+        self.master = master
+        self.stopped = False
+
+    def run(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, self._stop)
+        server = self.master.server
+        if self.master.reuse_port:
+            server = self.master.server_factory()
+        # NOTE: non-blocking so workers that lose the accept race go back to
+        # waiting rather than blocking in accept.
+        server.socket.setblocking(0)
+        logger.info('worker %s serving', os.getpid())
+        serve_once = getattr(server, 'serve_once', None)
+        reloads = self.master.reloads
+        while not self.stopped:
+            if serve_once is not None:
+                serve_once(self.master.poll)
+                if reloads is not None:
+                    reloads.refresh(self.master.routers)
+                continue
+            try:
+                readable, _, _ = select.select(
+                    [server], [], [], self.master.poll
+                )
+            except select.error, ex:
+                if ex.args[0] != errno.EINTR:
+                    raise
+                continue
+            if readable:
+                server._handle_request_noblock()
+            if reloads is not None:
+                reloads.refresh(self.master.routers)
+        logger.info('worker %s exiting', os.getpid())
+
+    def _stop(self, signum, frame):
+        self.stopped = True
+
+
+class Reloads(object):
+    """
+    Router reloads published by a master to its workers as pickles. Each
+    publication is a new generation written to its own file, holding the
+    state (see ``rump.snapshot.router_state``) of every router w/ rules
+    already parsed. The current generation number is kept in an anonymous
+    memory map shared by the master and its forks, so workers notice a new
+    one w/o any system calls. They then unpickle its file and update their
+    routers from it, rather than each connecting to dynamics and parsing
+    rules.
+
+    Workers pick up reloads this way w/o being recycled, including routers
+    added or removed by reloading settings files. Note that only the
+    generation number is shared, each worker holds its own copy of the
+    routers it unpickles.
+
+    `directory`
+        Where generation files are written, defaults to a temporary
+        directory removed by `close`.
+    """
+
+    header = struct.Struct('!Q')
+
+    def __init__(self, directory=None):
+        self._owned = directory is None
+        self.directory = (
+            tempfile.mkdtemp(prefix='rump-reloads-') if directory is None
+            else directory
+        )
+        #: Generation this process has loaded, 0 for none.
+        self.generation = 0
+        self._header = mmap.mmap(-1, self.header.size)
+
+    @property
+    def current(self):
+        """
+        Latest generation published.
+        """
+        return self.header.unpack_from(self._header)[0]
+
+    def path_for(self, generation):
+        return os.path.join(self.directory, '{0:016d}.pickle'.format(generation))
+
+    def publish(self, routers):
+        """
+        Writes `routers` as a new generation and makes it current. Called by
+        the master.
+
+        :return: The new generation.
+        """
+        generation = self.current + 1
+        path = self.path_for(generation)
+        tmp_path = path + '.tmp'
+        # NOTE: of (name, router type, request type, offset), in order
+        index = []
+        with open(tmp_path, 'wb') as fo:
+            for router in routers:
+                offset = fo.tell()
+                snapshot.pickler(fo, router.request_type).dump(
+                    snapshot.router_state(router)
+                )
+                index.append(
+                    (router.name, type(router), router.request_type, offset)
+                )
+            offset = fo.tell()
+            pickle.dump(index, fo, pickle.HIGHEST_PROTOCOL)
+            fo.write(self.header.pack(offset))
+        os.rename(tmp_path, path)
+        self.header.pack_into(self._header, 0, generation)
+        self.generation = generation
+        logger.info(
+            'published %s router(s) as generation %s', len(index), generation,
+        )
+        # NOTE: open unlinked files remain readable, so workers still
+        # updating from the previous generation are unaffected
+        self._unlink(generation - 2)
+        return generation
+
+    def refresh(self, routers):
+        """
+        Loads the current generation, unless already loaded, and updates
+        `routers` from it. Called by workers.
+
+        :param routers: List of routers. Those also in the generation are
+                        updated, those not are removed and those only in it
+                        are added, all by a single slice assignment.
+
+        :return: True if `routers` were updated, otherwise False.
+        """
+        generation = self.current
+        if generation == self.generation:
+            return False
+        path = self.path_for(generation)
+        try:
+            fo = open(path, 'rb')
+        except IOError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            # NOTE: superseded, the next refresh picks up the newer one
+            logger.info('generation %s @ %s gone', generation, path)
+            return False
+        with fo:
+            fo.seek(-self.header.size, os.SEEK_END)
+            offset = self.header.unpack(fo.read(self.header.size))[0]
+            fo.seek(offset)
+            index = pickle.load(fo)
+            existing = dict((router.name, router) for router in routers)
+            refreshed = []
+            for name, router_type, request_type, offset in index:
+                fo.seek(offset)
+                state = snapshot.unpickler(fo, request_type).load()
+                router = existing.get(name)
+                if type(router) is not router_type:
+                    router = None
+                refreshed.append(
+                    snapshot.router_from(router_type, state, path, router)
+                )
+        routers[:] = refreshed
+        self.generation = generation
+        logger.info('worker %s loaded generation %s', os.getpid(), generation)
+        return True
+
+    def close(self):
+        if self._owned:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    # internals
+
+    def _unlink(self, generation):
+        if generation < 1:
+            return
+        try:
+            os.unlink(self.path_for(generation))
+        except OSError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+
+
+def cpu_count():
+    try:
+        import multiprocessing
+
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
@@ -0,0 +1,219 @@
+"""
+Opt-in profiling of upstream selection. When enabled each rule's expression
+evaluation and each request field resolution (i.e. what compiled rules do via
+``rump.exp.Context.Cache.__missing__`` and ``SubField.__get__``, including
+any pilo parsing) are timed separately and aggregated. Fields are timed as
+rules read them, so those never read (e.g. because evaluation short-circuits)
+are not resolved:
+
+.. code:: python
+
+    profile = rump.profiling.Profile()
+    router.profile(profile)
+    for request in requests:
+        router.match_upstream(request)
+    router.profile(None)
+    print profile.reports()
+
+or from the command line:
+
+.. code:: bash
+
+    $ rump profile -r requests.http
+
+Profiling is enabled per ``rump.Rules`` by swapping its matcher so there is
+no cost when it is disabled.
+"""
+import StringIO
+
+from .exp import Context, Expression
+from .metrics import timer
+
+
+__all__ = [
+    'Profile',
+    'Stat',
+]
+
+
+class Stat(object):
+    """
+    Timing aggregate.
+    """
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class RuleStat(Stat):
+
+    __slots__ = ('rule', 'hits')
+
+    def __init__(self, rule):
+        super(RuleStat, self).__init__()
+        self.rule = str(rule)
+        self.hits = 0
+
+
+class Profile(object):
+    """
+    Aggregated rule evaluation and field resolution timings.
+    """
+
+    def __init__(self):
+        #: Rule `RuleStat`s keyed by ``(label, index)``.
+        self.rules = {}
+        #: Field `Stat`s keyed by field path (e.g. "headers.x_sauce").
+        self.fields = {}
+
+    def scope(self, label):
+        """
+        Creates a `Scope` for recording a ``rump.Rules`` timings under
+        `label` (e.g. "my-router.rules").
+        """
+        return Scope(self, label)
+
+    def rule(self, label, index, rule, seconds, matched):
+        key = (label, index)
+        stat = self.rules.get(key)
+        if stat is None or stat.rule != str(rule):
+            stat = self.rules[key] = RuleStat(rule)
+        stat.add(seconds)
+        if matched:
+            stat.hits += 1
+
+    def field(self, field, seconds):
+        path = Expression._field_literal(field)
+        stat = self.fields.get(path)
+        if stat is None:
+            stat = self.fields[path] = Stat()
+        stat.add(seconds)
+
+    def report(self, io, limit=None):
+        """
+        Writes rules and then fields ranked by total time.
+
+        :param io: File-like object to write to.
+        :param limit: Optional maximum number of rules and fields to write.
+        """
+        rules = sorted(
+            self.rules.iteritems(), key=lambda item: item[1].total, reverse=True,
+        )[:limit]
+        io.write('{0:>10} {1:>8} {2:>8} {3:>10} {4:>10}  {5}\n'.format(
+            'total(ms)', 'evals', 'hits', 'mean(us)', 'max(us)', 'rule',
+        ))
+        for (label, index), stat in rules:
+            io.write('{0:>10.3f} {1:>8} {2:>8} {3:>10.2f} {4:>10.2f}  {5}[{6}] {7}\n'.format(
+                stat.total * 1e3, stat.count, stat.hits,
+                stat.mean * 1e6, stat.max * 1e6, label, index, stat.rule,
+            ))
+        io.write('\n')
+        fields = sorted(
+            self.fields.iteritems(), key=lambda item: item[1].total, reverse=True,
+        )[:limit]
+        io.write('{0:>10} {1:>8} {2:>8} {3:>10} {4:>10}  {5}\n'.format(
+            'total(ms)', 'resolves', '', 'mean(us)', 'max(us)', 'field',
+        ))
+        for path, stat in fields:
+            io.write('{0:>10.3f} {1:>8} {2:>8} {3:>10.2f} {4:>10.2f}  {5}\n'.format(
+                stat.total * 1e3, stat.count, '',
+                stat.mean * 1e6, stat.max * 1e6, path,
+            ))
+
+    def reports(self, limit=None):
+        io = StringIO.StringIO()
+        self.report(io, limit)
+        return io.getvalue()
+
+
+class Scope(object):
+    """
+    Records a ``rump.Rules`` timings to a `Profile` under `label`.
+    """
+
+    def __init__(self, profile, label):
+        self.profile = profile
+        self.label = label
+
+    def resolving(self, request, compiled=False):
+        """
+        Wraps `request` so its fields are timed when rules first read them.
+
+        :param request: The request rules are evaluated for.
+        :param compiled: Whether the rules are compiled, in which case the
+                         wrapper is the ``rump.exp.Context.Cache`` to
+                         evaluate them w/.
+
+        :return: The wrapper, whose ``elapsed`` is the total seconds spent
+                 resolving fields.
+        """
+        if compiled:
+            return _ResolvingCache(request, self.profile)
+        return _Resolving(request, self.profile)
+
+    def rule(self, index, rule, seconds, matched):
+        self.profile.rule(self.label, index, rule, seconds, matched)
+
+
+# internals
+
+class _ResolvingCache(Context.Cache):
+
+    def __init__(self, request, profile):
+        super(_ResolvingCache, self).__init__(request)
+        self.profile = profile
+        self.elapsed = 0.0
+
+    def __missing__(self, field):
+        started_at = timer()
+        try:
+            return super(_ResolvingCache, self).__missing__(field)
+        finally:
+            seconds = timer() - started_at
+            self.elapsed += seconds
+            self.profile.field(field, seconds)
+
+
+class _Resolving(object):
+    """
+    Stands in for a request evaluated by **interpreted** rules. Those read
+    fields via pilo's ``Field.__get__``, which treats the request as a
+    mapping of field names to values.
+    """
+
+    def __init__(self, request, profile):
+        self.request = request
+        self.profile = profile
+        self.elapsed = 0.0
+        self._values = {}
+
+    def __contains__(self, name):
+        return True
+
+    def __getitem__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        started_at = timer()
+        try:
+            value = self._values[name] = getattr(self.request, name)
+        finally:
+            seconds = timer() - started_at
+            self.elapsed += seconds
+            self.profile.field(getattr(type(self.request), name), seconds)
+        return value
@@ -0,0 +1,143 @@
+"""
+Reloads dynamic routers off the threads their dynamics notify changes on
+(e.g. a redis pub/sub or kazoo event thread). Change notifications are
+enqueued and a small pool of threads performs the reloads:
+
+.. code:: python
+
+    reloader = rump.reloader.Reloader(lambda router: router.load())
+    reloader.start()
+    router.watch(reloader.enqueue)
+    ...
+    reloader.stop()
+
+Reloads are deduplicated per router, so a burst of notifications for a router
+results in at most one reload in progress and one pending, and no router is
+ever reloaded by more than one thread at a time.
+"""
+import logging
+import threading
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+
+__all__ = [
+    'Reloader',
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+class Reloader(object):
+    """
+    Calls `reload` for enqueued routers from `workers` background threads.
+    """
+
+    def __init__(self, reload, workers=1):
+        #: Callable taking the router to reload.
+        self.reload = reload
+        #: Number of threads performing reloads.
+        self.workers = workers
+        #: Number of notifications coalesced into an already pending reload.
+        self.coalesced = 0
+        self._pending = OrderedDict()
+        self._active = set()
+        self._threads = []
+        self._stopped = False
+        self._cond = threading.Condition()
+
+    def enqueue(self, router):
+        """
+        Schedules a reload of `router`, unless one w/ its name is already
+        pending in which case that is replaced by `router`. Cheap enough to
+        call from a notification thread.
+        """
+        with self._cond:
+            pending = router.name in self._pending
+            # NOTE: the latest router w/ this name, e.g. one that replaced it
+            # when settings files were reloaded
+            self._pending[router.name] = router
+            if pending:
+                self.coalesced += 1
+                return
+            self._cond.notify_all()
+
+    def start(self):
+        with self._cond:
+            self._stopped = False
+            self._threads = [
+                thread for thread in self._threads if thread.is_alive()
+            ]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._run,
+                    name='rump-reload-{0}'.format(len(self._threads)),
+                )
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Stops the reloading threads, discarding any pending reloads.
+        """
+        with self._cond:
+            self._stopped = True
+            self._pending.clear()
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def wait(self, timeout=None):
+        """
+        Waits for pending and in progress reloads to complete.
+
+        :return: True if they completed, False if `timeout` expired.
+        """
+        expires_at = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._pending or self._active:
+                if expires_at is None:
+                    self._cond.wait()
+                    continue
+                remaining = expires_at - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    # internals
+
+    def _next(self):
+        for name, router in self._pending.iteritems():
+            if name not in self._active:
+                del self._pending[name]
+                self._active.add(name)
+                return router
+
+    def _run(self):
+        while True:
+            with self._cond:
+                router = self._next()
+                while router is None and not self._stopped:
+                    self._cond.wait()
+                    router = self._next()
+                if self._stopped:
+                    if router is not None:
+                        self._active.discard(router.name)
+                    return
+            try:
+                self.reload(router)
+            except Exception, ex:
+                logger.exception('%s reload failed - %s', router.name, ex)
+            finally:
+                with self._cond:
+                    self._active.discard(router.name)
+                    self._cond.notify_all()
@@ -5,6 +5,7 @@ import re
 import pilo
 
 from .. import exc, Request, parser, Rule, Rules, Upstream
+from ..metrics import timer
 
 
 logger = logging.getLogger(__name__)
@@ -62,6 +63,9 @@ class Dynamic(pilo.Form):
         Load remote dynamic settings.
 
         :param router: The ``rump.Router`` associated with this dynmaic.
+
+        :return: False if known to be unchanged since the last load,
+                 otherwise True or None.
         """
         raise NotImplementedError
 
@@ -82,6 +86,46 @@ class Dynamic(pilo.Form):
         """
         raise NotImplementedError
 
+    def stamp(self, router):
+        """
+        Identifies what was last loaded (e.g. a version), see
+        ``rump.snapshot``.
+
+        :param router: The ``rump.Router`` associated with this dynmaic.
+
+        :return: A picklable stamp, or None if this dynamic has none.
+        """
+        return None
+
+    def restamp(self, router, stamp):
+        """
+        Marks `stamp` as loaded, so a subsequent load is skipped if it is
+        unchanged. Called after connecting, when `router` has been restored
+        from a snapshot.
+
+        :param router: The ``rump.Router`` associated with this dynmaic.
+        :param stamp: Stamp previously returned by `stamp`.
+        """
+
+    # internals
+
+    @staticmethod
+    def _update(router, src, names=None):
+        """
+        Maps the dynamic fields of `router` from `src` and updates `router`
+        w/ them, or only those in `names` if given. Everything (e.g. rule
+        parsing) is done before the single ``dict.update`` that swaps them in,
+        so concurrent selections see either all or none of the change.
+        """
+        update = type(router)()
+        # NOTE: resolving this while mapping rules from a union source
+        # clobbers its list paths, so resolve it up front
+        update.request_type = router.request_type
+        update.map(src, tags=['dynamic'], error='raise')
+        if names is not None:
+            update = dict((name, update[name]) for name in names)
+        router.update(update)
+
 
 class Router(pilo.Form):
     """
@@ -120,9 +164,18 @@ class Router(pilo.Form):
     #: Whether routing rules should be compiled.
     compile_rules = pilo.fields.Boolean(default=True).tag('dynamic')
 
-    #: Whether to automatically disable failing rules.
+    #: Whether to temporarily disable failing rules, see ``rump.rule.Breaker``.
     auto_disable_rules = pilo.fields.Boolean(default=True).tag('dynamic')
 
+    #: Number of errors within `rule_error_window` that disable a rule.
+    rule_error_threshold = pilo.fields.Integer(default=5).tag('dynamic')
+
+    #: Seconds in which `rule_error_threshold` errors disable a rule.
+    rule_error_window = pilo.fields.Float(default=60.0).tag('dynamic')
+
+    #: Seconds after which a disabled rule is retried.
+    rule_error_retry = pilo.fields.Float(default=30.0).tag('dynamic')
+
     #: Upstream to use when a request matches *no* routing rules.
     default_upstream = pilo.fields.String(default=None).tag('dynamic')
 
@@ -148,28 +201,23 @@ class Router(pilo.Form):
     @rules.field.parse
     def rules(self, path):
         value = path.primitive()
-        if isinstance(value, (Rule, Rule.compiled_type)):
+        if isinstance(value, Rule):
+            return path.value
+        if isinstance(value, Rule.compiled_type):
             value = str(value)
         try:
-            return self.rule_parser(value)
+            return self.parse_rule(value)
         except exc.ParseException, ex:
             self.ctx.errors.invalid(str(ex))
             return pilo.ERROR
 
     @rules.default
     def rules(self):
-        return Rules(
-            auto_disable=self.auto_disable_rules,
-            compile=self.compile_rules,
-        )
+        return self._rules([])
 
     @rules.munge
     def rules(self, value):
-        return Rules(
-            value,
-            auto_disable=self.auto_disable_rules,
-            compile=self.compile_rules,
-        )
+        return self._rules(value)
 
     #: Upstream selection rules.
     overrides = pilo.fields.List(pilo.fields.String(), ignore=None).tag('dynamic')
@@ -180,25 +228,18 @@ class Router(pilo.Form):
         if isinstance(value, Rule):
             return path.value
         try:
-            return self.rule_parser(value)
+            return self.parse_rule(value)
         except exc.ParseException, ex:
             self.ctx.errors.invalid(str(ex))
             return pilo.ERROR
 
     @overrides.default
     def overrides(self):
-        return Rules(
-            auto_disable=self.auto_disable_rules,
-            compile=self.compile_rules,
-        )
+        return self._rules([])
 
     @overrides.munge
     def overrides(self, value):
-        return Rules(
-            value,
-            auto_disable=self.auto_disable_rules,
-            compile=self.compile_rules,
-        )
+        return self._rules(value)
 
     #: Dynamic configuration source.
     dynamic = pilo.fields.PolymorphicSubForm(Dynamic._type_, default=None)
@@ -211,6 +252,29 @@ class Router(pilo.Form):
     def rule_parser(self):
         return parser.for_rule(self.request_type)
 
+    def parse_rule(self, text):
+        """
+        Parses rule `text`, or gets it from the ``rump.artifact.Artifact`` in
+        context (i.e. ``pilo.ctx.artifact``) if there is one, see
+        ``rump.Settings.compiled``.
+        """
+        artifact = getattr(self.ctx, 'artifact', None)
+        if artifact is None:
+            return self.rule_parser(text)
+        return artifact.parse(
+            self.request_type, text, lambda text: self.rule_parser(text),
+        )
+
+    def _rules(self, rules):
+        return Rules(
+            rules,
+            auto_disable=self.auto_disable_rules,
+            compile=self.compile_rules,
+            error_threshold=self.rule_error_threshold,
+            error_window=self.rule_error_window,
+            error_retry=self.rule_error_retry,
+        )
+
     # match
 
     def match_me(self, request):
@@ -226,19 +290,60 @@ class Router(pilo.Form):
             if m:
                 return m
 
-    def match_upstream(self, request):
+    def match_upstream(self, request, metrics=None, trace=None):
         """
         Determines the ``rump.Upstream` for a `request`.
 
         :param request: An instance of `Router.request_type` to evaluate.
+        :param metrics: Optional ``rump.metrics.SelectionMetrics`` to record
+                        rule hits to.
+        :param trace: Optional ``rump.trace.Record`` to record the matched
+                      rule to.
 
         :return: ``rump.Upstream` selected or None if there is none.
         """
-        return (
-            self.overrides.match(request) or
-            self.rules.match(request) or
-            self.default_upstream
-        )
+        if metrics is None and trace is None:
+            return (
+                self.overrides.match(request) or
+                self.rules.match(request) or
+                self.default_upstream
+            )
+        for name, rules in [('overrides', self.overrides), ('rules', self.rules)]:
+            started_at = timer()
+            i, upstream = rules.match_index(request)
+            if upstream:
+                if metrics is not None:
+                    metrics.rule_matched(self, name, i, timer() - started_at)
+                if trace is not None:
+                    trace.matched(name, i)
+                return upstream
+        return self.default_upstream
+
+    def breakers(self):
+        """
+        State of rules that have failed to match.
+
+        :return: List of ``(name, index, rump.rule.Breaker)`` where `name` is
+                 either "overrides" or "rules".
+        """
+        return [
+            (name, i, breaker)
+            for name in ['overrides', 'rules']
+            for i, breaker in getattr(self, name).breakers()
+        ]
+
+    def profile(self, profile):
+        """
+        Enables or disables profiling of rule evaluation and field resolution.
+
+        :param profile: A ``rump.profiling.Profile`` to record timings to, or
+                        None to disable profiling.
+        """
+        for name in ['overrides', 'rules']:
+            getattr(self, name).profile = (
+                None if profile is None
+                else profile.scope('{0}.{1}'.format(self.name, name))
+            )
 
     # dynamic
 
@@ -271,7 +376,7 @@ class Router(pilo.Form):
     def load(self):
         if not self.is_connected:
             raise exc.RouterNotConnected(self)
-        self.dynamic.load(self)
+        return self.dynamic.load(self)
 
     def save(self):
         if not self.is_connected:
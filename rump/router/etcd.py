@@ -1,5 +1,7 @@
 from __future__ import absolute_import
 
+import hashlib
+import json
 import logging
 import threading
 
@@ -7,7 +9,7 @@ import etcd
 import pilo
 import urllib3
 
-from .. import dumps, loads
+from .. import dumps, loads, Rule, Rules
 from . import Dynamic
 
 
@@ -15,6 +17,20 @@ logger = logging.getLogger(__name__)
 
 
 class EtcD(Dynamic):
+    """
+    Stores the dynamic components of a router as a JSON document @ `key`.
+    Watches resume from the last seen index so no change is missed and
+    only changes, not timeouts, trigger a reload.
+
+    Alternatively, w/ the "directory" `layout`, `key` is a directory w/ the
+    settings as a JSON document @ `settings_key` and each rule (e.g. each
+    override) as its own key in an ordered directory (e.g. ``overrides/``).
+    Saves then only write changed keys, and last a digest of all of them to
+    `commit_key`. Watchers, watching `key` recursively, only apply (and
+    parse) the changed ones and only once committed, so never load a save
+    in progress. Directories w/o a `commit_key` (i.e. saved by older
+    versions) are loaded on every change.
+    """
 
     _type_ = pilo.fields.Type.instance('etcd')
 
@@ -34,6 +50,26 @@ class EtcD(Dynamic):
 
     key = pilo.fields.String()
 
+    #: Seconds to back off after a failed watch.
+    watch_retry = pilo.fields.Float(default=1.0)
+
+    #: Either "document" or "directory", see above.
+    layout = pilo.fields.String(
+        choices=['document', 'directory'], default='document',
+    )
+
+    #: The ``modifiedIndex`` of the last loaded value or, w/ the "directory"
+    #: `layout`, a digest of the last loaded keys and values.
+    index = None
+
+    @property
+    def settings_key(self):
+        return self.key + '/settings'
+
+    @property
+    def commit_key(self):
+        return self.key + '/commit'
+
     # Dynamic
 
     def can_connect(self, router):
@@ -48,6 +84,8 @@ class EtcD(Dynamic):
             protocol=self.protocol,
             allow_reconnect=self.allow_reconnect,
         )
+        self.index = self._wait_index = self._pending = None
+        self._children, self._commit, self._parsed = None, None, {}
 
     def is_connected(self, router):
         return self._cli is not None
@@ -61,77 +99,323 @@ class EtcD(Dynamic):
         self._cli = None
 
     def load(self, router):
-        src = self._src(router)
-        update = type(router)()
-        update.map(src, tags=['dynamic'], error='raise')
-        router.update(update)
+        """
+        Loads the value @ `key`, or the one delivered by a watch if there is
+        one, unless its ``modifiedIndex`` has already been loaded.
+
+        :return: True if `router` was updated, otherwise False.
+        """
+        if self.layout == 'directory':
+            return self._load_directory(router)
+        result, self._pending = self._pending, None
+        if result is None:
+            result = self._read()
+        index = result.modifiedIndex if result is not None else None
+        # NOTE: even if unchanged (e.g. restamped) so a watch resumes from
+        # this read rather than from whenever it starts
+        if self._wait_index is None and result is not None:
+            self._wait_index = getattr(result, 'etcd_index', index) + 1
+        if index is not None and index == self.index:
+            logger.info('%s index %s already loaded', self.key, index)
+            return False
+        src = self._src(router, result)
+        self._update(router, src)
+        self.index = index
+        return True
 
     def save(self, router):
-        self._write(router.filter('dynamic'))
+        if self.layout == 'directory':
+            self._write_directory(router)
+        else:
+            self._write(router.filter('dynamic'))
 
     def watch(self, router, callback):
 
+        if self._watch_thd:
+            self._watch_thd.stop()
         logger.info('watching key %s', self.key)
         self._watch_thd = self._WatchThread(
-            cli=self._cli, key=self.key, callback=callback, router=router,
+            dynamic=self, callback=callback, router=router,
         )
         self._watch_thd.daemon = True
         self._watch_thd.start()
 
+    def stamp(self, router):
+        return self.index
+
+    def restamp(self, router, stamp):
+        # NOTE: watches start from the current index, not this one
+        self.index = stamp
+
     # internals
 
     _cli = None
 
     _watch_thd = None
 
+    _wait_index = None
+
+    _pending = None
+
+    _children = None
+
+    _commit = None
+
+    _parsed = None
+
     class _WatchThread(threading.Thread):
 
-        def __init__(self, cli, key, callback, router, timeout=None):
+        def __init__(self, dynamic, callback, router, timeout=None):
             threading.Thread.__init__(self)
-            self.cli = cli
-            self.key = key
+            self.dynamic = dynamic
+            self.cli = dynamic._cli
+            self.key = dynamic.key
             self.callback = callback
             self.router = router
             self.timeout = timeout
+            self._stopped = threading.Event()
 
         def run(self):
             while not self.stopped:
+                index = self.dynamic._wait_index
                 try:
-                    logger.info('watching %s', self.key)
-                    self.cli.watch(self.key, timeout=self.timeout)
+                    logger.info('watching %s from index %s', self.key, index)
+                    result = self.cli.watch(
+                        self.key,
+                        index=index,
+                        timeout=self.timeout,
+                        recursive=self.dynamic.layout == 'directory' or None,
+                    )
                 except urllib3.exceptions.TimeoutError:
+                    # NOTE: nothing changed so just resume
                     logger.debug('watch %s timed out', self.key)
-                logger.info('%s changed')
-                callback = self.callback
-                if callback is not None:
-                    callback(self.router)
+                    continue
+                except etcd.EtcdEventIndexCleared:
+                    # NOTE: missed events so resume from now and reload
+                    logger.info('watch %s index %s cleared', self.key, index)
+                    self.dynamic._wait_index = None
+                    self.dynamic._pend(None)
+                    self._changed()
+                    continue
+                except Exception, ex:
+                    logger.exception('watch %s failed - %s', self.key, ex)
+                    self._stopped.wait(self.dynamic.watch_retry)
+                    continue
+                if self.stopped:
+                    break
+                self.dynamic._wait_index = result.modifiedIndex + 1
+                if result.modifiedIndex == self.dynamic.index:
+                    logger.debug(
+                        '%s index %s already loaded', self.key, result.modifiedIndex,
+                    )
+                    continue
+                if result.action in ('delete', 'expire'):
+                    result.value = None
+                self.dynamic._pend(result)
+                if self.dynamic._committed(result):
+                    self._changed()
             logger.info('stopped watching %s', self.key)
 
+        def _changed(self):
+            logger.info('%s changed', self.key)
+            callback = self.callback
+            if callback is not None:
+                callback(self.router)
+
         @property
         def stopped(self):
             return self.callback is None
 
         def stop(self):
             self.callback = None
+            self._stopped.set()
+
+    def _pend(self, result):
+        if self.layout != 'directory':
+            self._pending = result
+        elif result is None:
+            # NOTE: unknown changes so read all
+            self._pending, self._children = None, None
+        else:
+            self._pending = (self._pending or []) + [result]
+
+    def _committed(self, result):
+        # NOTE: w/ the directory layout only commits are loaded, unless there
+        # are none (i.e. saved by older versions)
+        return (
+            self.layout != 'directory' or
+            self._commit is None or
+            result.key == self.commit_key
+        )
 
-    def _src(self, router):
+    def _src(self, router, result):
         srcs = []
-        value = self._read()
-        if value is not None:
-            srcs.append(pilo.source.DefaultSource(value))
+        if result is not None and result.value is not None:
+            logger.info('read from %s\n%s', self.key, result.value)
+            srcs.append(pilo.source.DefaultSource(loads(result.value)))
         srcs.append(router)
         return pilo.source.union(srcs)
 
-    def _read(self):
+    def _read(self, **kwargs):
         try:
-            text = self._cli.read(self.key).value
-            logger.info('read from %s\n%s', self.key, text)
-        except KeyError:
+            return self._cli.read(self.key, **kwargs)
+        except (KeyError, etcd.EtcdKeyNotFound):
             logger.info('%s does not exist', self.key)
-            return
-        return loads(text)
 
     def _write(self, value):
         text = dumps(value)
         logger.info('writing to %s\n%s', self.key, text)
         self._cli.write(self.key, text)
+
+    # internals - directory layout
+
+    def _rule_fields(self, router):
+        # NOTE: a blank router so assigned but not yet munged values count
+        blank = type(router)()
+        return [
+            field for field in blank.fields
+            if 'dynamic' in field.tags and
+            isinstance(field.__get__(blank), Rules)
+        ]
+
+    def _rule_key(self, field, i):
+        return '{0}/{1}/{2:08d}'.format(self.key, field.name, i)
+
+    def _children_of(self, router):
+        rule_fields = self._rule_fields(router)
+        settings = router.filter('dynamic')
+        children = {}
+        for field in rule_fields:
+            for i, rule in enumerate(settings.pop(field.name)):
+                children[self._rule_key(field, i)] = dumps(rule)
+        children[self.settings_key] = dumps(settings)
+        return children
+
+    def _read_children(self):
+        result = self._read(recursive=True, sorted=True)
+        if result is None:
+            return {}, None, None
+        children, commit = {}, None
+        for leaf in result.leaves:
+            if leaf.dir or leaf.key == self.key:
+                continue
+            if leaf.key == self.commit_key:
+                commit = leaf.value
+            else:
+                children[leaf.key] = leaf.value
+        return children, commit, result.etcd_index
+
+    def _apply(self, children, results, commit):
+        for result in results:
+            if result.key == self.commit_key:
+                commit = result.value
+            elif result.value is None:
+                # NOTE: deleting a directory deletes everything under it
+                prefix = result.key.rstrip('/') + '/'
+                for key in list(children):
+                    if key == result.key or key.startswith(prefix):
+                        del children[key]
+                if self.commit_key.startswith(prefix):
+                    commit = None
+            elif not result.dir:
+                children[result.key] = result.value
+        return commit
+
+    def _load_directory(self, router):
+        pending, self._pending = self._pending, None
+        if pending is not None and self._children is not None:
+            children = dict(self._children)
+            commit = self._apply(children, pending, self._commit)
+            logger.info('applied %s change(s) to %s', len(pending), self.key)
+        else:
+            children, commit, etcd_index = self._read_children()
+            logger.info('read %s key(s) from %s', len(children), self.key)
+            if self._wait_index is None and etcd_index is not None:
+                self._wait_index = etcd_index + 1
+        # NOTE: not the max leaf modifiedIndex, which deleting a key leaves
+        # as is
+        digest = self._digest(children)
+        if commit is not None and commit != digest:
+            # NOTE: a save in progress, kept to apply the rest of to
+            logger.info('%s commit %s not yet written', self.key, digest)
+            self._children, self._commit = children, commit
+            return False
+        if digest == self.index:
+            logger.info('%s digest %s already loaded', self.key, digest)
+            self._children, self._commit = children, commit
+            return False
+        src = self._decode(router, children)
+        # NOTE: settings w/o keys are left as is
+        self._update(
+            router,
+            pilo.source.DefaultSource(src, location=self.key),
+            names=src.keys(),
+        )
+        self._cache_parsed(router, children)
+        self._children, self._commit, self.index = children, commit, digest
+        return True
+
+    @staticmethod
+    def _digest(children):
+        return hashlib.sha1(json.dumps(sorted(children.iteritems()))).hexdigest()
+
+    def _decode(self, router, children):
+        src = {}
+        text = children.get(self.settings_key)
+        if text is not None:
+            src.update(loads(text))
+        for field in self._rule_fields(router):
+            prefix = '{0}/{1}/'.format(self.key, field.name)
+            keys = sorted(key for key in children if key.startswith(prefix))
+            if not keys and text is None:
+                continue
+            items = []
+            for key in keys:
+                parsed = self._parsed.get(key)
+                if parsed is not None and parsed[0] == children[key]:
+                    # NOTE: unchanged so reuse, which skips parsing
+                    items.append(parsed[1])
+                else:
+                    items.append(loads(children[key]))
+            src[field.name] = items
+        return src
+
+    def _cache_parsed(self, router, children):
+        parsed = {}
+        for field in self._rule_fields(router):
+            for i, rule in enumerate(field.__get__(router)):
+                key = self._rule_key(field, i)
+                if key in children:
+                    parsed[key] = (
+                        children[key], Rule(rule.expression, rule.upstream),
+                    )
+        self._parsed = parsed
+
+    def _write_directory(self, router):
+        children = self._children_of(router)
+        remote, commit = self._children, self._commit
+        if remote is None:
+            remote, commit = self._read_children()[:2]
+        changed = sorted(
+            key for key, text in children.iteritems() if remote.get(key) != text
+        )
+        removed = sorted(key for key in remote if key not in children)
+        logger.info(
+            'writing %s and deleting %s key(s) of %s',
+            len(changed), len(removed), self.key,
+        )
+        for key in changed:
+            logger.debug('writing to %s\n%s', key, children[key])
+            self._cli.write(key, children[key])
+        for key in removed:
+            logger.debug('deleting %s', key)
+            try:
+                self._cli.delete(key)
+            except (KeyError, etcd.EtcdKeyNotFound):
+                pass
+        # NOTE: last, so watchers only load once all keys are written
+        digest = self._digest(children)
+        if digest != commit:
+            logger.debug('writing %s %s', self.commit_key, digest)
+            self._cli.write(self.commit_key, digest)
+        self._children, self._commit = children, digest
@@ -1,18 +1,205 @@
 from __future__ import absolute_import
 
+import collections
+import hashlib
+import json
 import logging
+import os
+import socket
+import threading
 
 import pilo
 import redis
 
-from .. import dumps, loads
+from .. import dumps, loads, Rule, Rules
 from . import Dynamic
 
 
 logger = logging.getLogger(__name__)
 
 
+class Connection(object):
+    """
+    A client, pub/sub and pub/sub dispatcher thread for a redis `url` shared
+    by all `Redis` dynamics connected to it, see `acquire`.
+
+    Only the dispatcher thread uses the pub/sub once started, as it is not
+    thread-safe. Subscription changes are queued for it and it is woken to
+    apply them by a message published to its own `control` channel.
+    """
+
+    _connections = {}
+
+    _lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls, url, sleep_time=1.0):
+        """
+        Gets the shared connection for `url`, creating it if needed. Pair
+        each call with one to `release`. The dispatcher waits at most the
+        smallest `sleep_time` of those acquiring it between checks for exit.
+        """
+        with cls._lock:
+            connection = cls._connections.get(url)
+            if connection is None or connection.pid != os.getpid():
+                logger.info('connecting to %s', url)
+                connection = cls._connections[url] = cls(url, sleep_time)
+            connection.sleep_time = min(connection.sleep_time, sleep_time)
+            connection.refs += 1
+            return connection
+
+    def __init__(self, url, sleep_time=1.0):
+        self.url = url
+        self.sleep_time = sleep_time
+        self.pid = os.getpid()
+        self.refs = 0
+        self.cli = redis.Redis.from_url(url)
+        self.pubsub = self.cli.pubsub()
+        self.handlers = collections.defaultdict(list)
+        #: Channel used to wake the dispatcher thread.
+        self.control = 'rump:{0}:{1}:{2}'.format(
+            socket.gethostname(), self.pid, id(self),
+        )
+        self._commands = collections.deque()
+        self._stopped = threading.Event()
+        self._thd = None
+
+    def release(self):
+        with self._lock:
+            self.refs -= 1
+            if self.refs > 0:
+                return
+            if self._connections.get(self.url) is self:
+                del self._connections[self.url]
+        logger.info('disconnecting from %s', self.url)
+        self.close()
+
+    def subscribe(self, channel, handler):
+        """
+        Calls `handler` w/ each message published to `channel` from the
+        shared dispatcher thread.
+        """
+        with self._lock:
+            subscribe = channel not in self.handlers
+            self.handlers[channel].append(handler)
+            if subscribe:
+                logger.info('subscribing to channel %s', channel)
+            if self._start() or not subscribe:
+                return
+            applied = self._command(self.pubsub.subscribe, **{
+                channel: self._dispatch
+            })
+        self._wait(applied)
+
+    def unsubscribe(self, channel, handler):
+        with self._lock:
+            handlers = self.handlers.get(channel, [])
+            if handler in handlers:
+                handlers.remove(handler)
+            if handlers or channel not in self.handlers:
+                return
+            del self.handlers[channel]
+            logger.info('unsubscribing from channel %s', channel)
+            applied = self._command(self.pubsub.unsubscribe, channel)
+        self._wait(applied)
+
+    def close(self):
+        thd, self._thd = self._thd, None
+        self._stopped.set()
+        if thd is not None and thd.is_alive():
+            self._wake()
+            if thd is not threading.current_thread():
+                thd.join()
+        else:
+            self.pubsub.close()
+        self.cli.connection_pool.disconnect()
+
+    # internals
+
+    def _start(self):
+        if self._thd is not None and self._thd.is_alive():
+            return False
+        # NOTE: nothing else uses the pub/sub until the dispatcher starts, so
+        # subscribe to all channels (again, if it died) here
+        while self._commands:
+            self._commands.popleft()[-1].set()
+        channels = dict((channel, self._dispatch) for channel in self.handlers)
+        channels[self.control] = self._apply
+        self.pubsub.subscribe(**channels)
+        self._stopped.clear()
+        self._thd = threading.Thread(target=self._run, name='rump-redis')
+        self._thd.daemon = True
+        self._thd.start()
+        return True
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                self.pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=self.sleep_time,
+                )
+                self._apply()
+        except Exception, ex:
+            logger.exception('dispatching from %s failed - %s', self.url, ex)
+        finally:
+            self.pubsub.close()
+
+    def _command(self, method, *args, **kwargs):
+        applied = threading.Event()
+        self._commands.append((method, args, kwargs, applied))
+        return applied
+
+    def _apply(self, message=None):
+        while True:
+            try:
+                method, args, kwargs, applied = self._commands.popleft()
+            except IndexError:
+                break
+            try:
+                method(*args, **kwargs)
+            finally:
+                applied.set()
+
+    def _wake(self):
+        try:
+            self.cli.publish(self.control, 'wake')
+        except redis.RedisError, ex:
+            logger.warning('waking dispatcher of %s failed - %s', self.url, ex)
+
+    def _wait(self, applied):
+        self._wake()
+        while not applied.is_set():
+            thd = self._thd
+            if thd is None or not thd.is_alive():
+                break
+            applied.wait(self.sleep_time)
+
+    def _dispatch(self, message):
+        for handler in list(self.handlers.get(message['channel'], [])):
+            try:
+                handler(message)
+            except Exception, ex:
+                logger.exception(
+                    'channel %s handler failed - %s', message['channel'], ex,
+                )
+
+
 class Redis(Dynamic):
+    """
+    Stores the dynamic components of a router as a JSON document @ `key`
+    along with its version (a hash of the document) @ `version_key`. Saves
+    publish the version to `channel` so watchers can skip notifications for
+    versions they have already loaded, and bursts of notifications are
+    coalesced into a single callback per `watch_debounce` seconds.
+
+    Alternatively, w/ the "hash" `layout`, each setting and each item of list
+    settings (e.g. each override rule) is an entry of the hash @
+    `entries_key`. Saves then only write changed entries and publish their
+    names so watchers only fetch (and parse) those.
+
+    Dynamics w/ the same `url` share a `Connection`, so there is a single
+    client and pub/sub thread per process for each redis.
+    """
 
     _type_ = pilo.fields.Type.instance('redis')
 
@@ -28,80 +215,331 @@ class Redis(Dynamic):
     #: Number of seconds between each watch.
     watch_timeout = pilo.fields.Float(default=1.0)
 
+    #: Number of seconds to coalesce change notifications over.
+    watch_debounce = pilo.fields.Float(default=0.1)
+
+    #: Either "document" or "hash", see above.
+    layout = pilo.fields.String(choices=['document', 'hash'], default='document')
+
+    @property
+    def version_key(self):
+        return self.key + ':version'
+
+    @property
+    def entries_key(self):
+        return self.key + ':entries'
+
+    #: Version of the last loaded document.
+    version = None
+
     # Dynamic
 
     def can_connect(self, router):
         return True
 
     def connect(self, router):
-        logger.info('connecting to %s', self.url)
-        cli = redis.Redis.from_url(self.url)
-        pubsub = cli.pubsub()
-        self._cli, self._pubsub, self._subthd = cli, pubsub, None
+        self._connection = Connection.acquire(self.url, self.watch_timeout)
+        self._cli = self._connection.cli
+        self.version = None
+        self._remote, self._pending, self._parsed = None, None, {}
 
     def is_connected(self, router):
         return self._cli is not None
 
     def disconnect(self, router):
-        logger.info('disconnecting from %s', self.url)
-        if self._subthd:
-            self._subthd.stop()
-            self._subthd = None
-        if self._pubsub:
-            self._pubsub.close()
-            self._pubsub = None
-        self._cli = None
+        if self._connection is None:
+            return
+        if self._debounce:
+            self._debounce.cancel()
+            self._debounce = None
+        if self._handler:
+            self._connection.unsubscribe(self.channel, self._handler)
+            self._handler = None
+        self._connection.release()
+        self._connection = self._cli = None
 
     def load(self, router):
-        src = self._src(router)
-        update = type(router)()
-        update.map(src, tags=['dynamic'], error='raise')
-        router.update(update)
+        """
+        Loads the document @ `key` unless its version has already been
+        loaded.
+
+        :return: True if `router` was updated, otherwise False.
+        """
+        if self.layout == 'hash':
+            return self._load_entries(router)
+        version = self._cli.get(self.version_key)
+        if version is not None and version == self.version:
+            logger.info('key %s version %s already loaded', self.key, version)
+            return False
+        text, version = self._get()
+        if text is not None and version == self.version:
+            logger.info('key %s version %s already loaded', self.key, version)
+            return False
+        src = self._src(router, text)
+        self._update(router, src)
+        self.version = version
+        return True
 
     def save(self, router):
-        self._set(router)
+        if self.layout == 'hash':
+            self._set_entries(router)
+        else:
+            self._set(router)
 
     def watch(self, router, callback):
-        logger.info('subscribing to channel %s', self.channel)
-        self._pubsub.subscribe(**{
-            self.channel: lambda message: callback(router)
-        })
-        if self._subthd is None or not self._subthd.active():
-            self._subthd = self._pubsub.run_in_thread(
-                sleep_time=self.watch_timeout,
-            )
+        if self._handler:
+            self._connection.unsubscribe(self.channel, self._handler)
+        self._handler = lambda message: self._notified(router, callback, message)
+        self._connection.subscribe(self.channel, self._handler)
+
+    def stamp(self, router):
+        return self.version
+
+    def restamp(self, router, stamp):
+        self.version = stamp
 
     # internals
 
+    _connection = None
+
     _cli = None
 
-    _pubsub = None
+    _handler = None
+
+    _debounce = None
+
+    _remote = None
 
-    _subthd = None
+    _pending = None
 
-    def _src(self, router):
+    _parsed = None
+
+    def _notified(self, router, callback, message):
+        version = message.get('data')
+        if self.layout == 'hash' and version is not None:
+            try:
+                change = json.loads(version)
+                version = change['version']
+            except (ValueError, TypeError, KeyError):
+                logger.warning(
+                    'channel %s message %r invalid', self.channel, version,
+                )
+                change = None
+            self._pend(change)
+        if version is not None and version == self.version:
+            logger.debug('channel %s version %s already loaded', self.channel, version)
+            return
+        if self._debounce is not None and self._debounce.is_alive():
+            # NOTE: coalesced into pending callback
+            return
+
+        def _fire():
+            self._debounce = None
+            callback(router)
+
+        if not self.watch_debounce:
+            _fire()
+            return
+        self._debounce = threading.Timer(self.watch_debounce, _fire)
+        self._debounce.daemon = True
+        self._debounce.start()
+
+    def _src(self, router, text):
         srcs = []
 
         # remote
-        text = self._get(router)
         if text is not None:
-            srcs.append(pilo.source.DefaultSource(text, location=self.key))
+            srcs.append(
+                pilo.source.DefaultSource(loads(text), location=self.key)
+            )
 
         # local
         srcs.append(router)
 
         return pilo.source.union(srcs)
 
-    def _get(self, router):
+    @staticmethod
+    def _version(text):
+        return hashlib.sha1(text).hexdigest()
+
+    def _get(self):
         logger.info('getting key %s', self.key)
-        text = self._cli.get(self.key)
-        return loads(text) if text is not None else None
+        text, version = self._cli.mget([self.key, self.version_key])
+        if text is not None and version is None:
+            # NOTE: saved w/o a version, so derive one
+            version = self._version(text)
+        return text, version
 
     def _set(self, router):
         dynamic = router.filter('dynamic')
         text = dumps(dynamic)
-        logger.info('setting key %s\n%s', self.key, text)
-        self._cli.set(self.key, text)
-
+        version = self._version(text)
+        logger.info('setting key %s version %s', self.key, version)
+        logger.debug('key %s\n%s', self.key, text)
+        pipe = self._cli.pipeline()
+        pipe.mset({self.key: text, self.version_key: version})
         logger.info('publishing to channel %s', self.channel)
-        self._cli.publish(self.channel, text)
+        pipe.publish(self.channel, version)
+        pipe.execute()
+
+    # internals - hash layout
+
+    def _entries(self, router):
+        entries = {}
+        for name, value in router.filter('dynamic').iteritems():
+            if isinstance(value, (list, Rules)):
+                entries[name] = dumps(len(value))
+                for i, item in enumerate(value):
+                    entries['{0}.{1}'.format(name, i)] = dumps(item)
+            else:
+                entries[name] = dumps(value)
+        return entries
+
+    @staticmethod
+    def _entries_version(entries):
+        return hashlib.sha1(json.dumps(sorted(entries.items()))).hexdigest()
+
+    def _pend(self, change):
+        if change is None:
+            # NOTE: unknown changes so fetch all
+            self._pending = False
+        elif self._pending is not False:
+            if self._pending is None:
+                self._pending = (set(), set())
+            self._pending[0].update(change.get('changed', []))
+            self._pending[1].update(change.get('removed', []))
+
+    def _load_entries(self, router):
+        version = self._cli.get(self.version_key)
+        if version is not None and version == self.version:
+            logger.info('key %s version %s already loaded', self.key, version)
+            return False
+        pending, self._pending = self._pending, None
+        entries = None
+        if pending and self._remote is not None:
+            changed, removed = pending
+            entries = self._fetch_entries(changed, removed)
+        if entries is None:
+            logger.info('getting hash %s', self.entries_key)
+            pipe = self._cli.pipeline()
+            pipe.hgetall(self.entries_key)
+            pipe.get(self.version_key)
+            entries, version = pipe.execute()
+            if version is None:
+                version = self._entries_version(entries)
+        else:
+            version = self._entries_version(entries)
+        if version == self.version:
+            logger.info('key %s version %s already loaded', self.key, version)
+            return False
+        src = self._decode(router, entries)
+        # NOTE: fields w/o entries are left as is
+        self._update(
+            router,
+            pilo.source.DefaultSource(src, location=self.entries_key),
+            names=src.keys(),
+        )
+        self._cache_parsed(router, entries)
+        self._remote, self.version = (version, entries), version
+        return True
+
+    def _fetch_entries(self, changed, removed):
+        changed = sorted(changed)
+        logger.info(
+            'getting %s changed entries of hash %s', len(changed), self.entries_key,
+        )
+        pipe = self._cli.pipeline()
+        if changed:
+            pipe.hmget(self.entries_key, changed)
+        pipe.get(self.version_key)
+        results = pipe.execute()
+        values, version = results[0] if changed else [], results[-1]
+        entries = dict(self._remote[1])
+        for name in removed:
+            entries.pop(name, None)
+        for name, value in zip(changed, values):
+            if value is None:
+                entries.pop(name, None)
+            else:
+                entries[name] = value
+        if version is not None and self._entries_version(entries) != version:
+            logger.info('hash %s changes incomplete, getting all', self.entries_key)
+            return None
+        return entries
+
+    def _decode(self, router, entries):
+        src = {}
+        for field in router.fields:
+            if 'dynamic' not in field.tags or field.name not in entries:
+                continue
+            if not isinstance(field, pilo.fields.List):
+                src[field.name] = loads(entries[field.name])
+                continue
+            items = []
+            for i in xrange(loads(entries[field.name])):
+                name = '{0}.{1}'.format(field.name, i)
+                text = entries.get(name)
+                if text is None:
+                    raise ValueError(
+                        'hash {0} missing {1}'.format(self.entries_key, name)
+                    )
+                parsed = self._parsed.get(name)
+                if parsed is not None and parsed[0] == text:
+                    # NOTE: unchanged so reuse, which skips parsing
+                    items.append(parsed[1])
+                else:
+                    items.append(loads(text))
+            src[field.name] = items
+        return src
+
+    def _cache_parsed(self, router, entries):
+        parsed = {}
+        for field in router.fields:
+            if 'dynamic' not in field.tags:
+                continue
+            value = field.__get__(router)
+            if not isinstance(value, Rules):
+                continue
+            for i, rule in enumerate(value):
+                name = '{0}.{1}'.format(field.name, i)
+                if name in entries:
+                    parsed[name] = (
+                        entries[name], Rule(rule.expression, rule.upstream),
+                    )
+        self._parsed = parsed
+
+    def _set_entries(self, router):
+        entries = self._entries(router)
+        version = self._entries_version(entries)
+
+        def _save(pipe):
+            remote_version = pipe.get(self.version_key)
+            if self._remote is not None and self._remote[0] == remote_version:
+                remote = self._remote[1]
+            else:
+                remote = pipe.hgetall(self.entries_key)
+            changed = sorted(
+                name for name, value in entries.iteritems()
+                if remote.get(name) != value
+            )
+            removed = sorted(name for name in remote if name not in entries)
+            logger.info(
+                'setting hash %s version %s - %s changed, %s removed',
+                self.entries_key, version, len(changed), len(removed),
+            )
+            pipe.multi()
+            if changed:
+                pipe.hmset(
+                    self.entries_key,
+                    dict((name, entries[name]) for name in changed),
+                )
+            if removed:
+                pipe.hdel(self.entries_key, *removed)
+            pipe.set(self.version_key, version)
+            logger.info('publishing to channel %s', self.channel)
+            pipe.publish(self.channel, json.dumps({
+                'version': version, 'changed': changed, 'removed': removed,
+            }))
+
+        self._cli.transaction(_save, self.version_key)
+        self._remote = (version, entries)
@@ -5,8 +5,10 @@ import functools
 import logging
 import os
 import StringIO
+import threading
 
 from kazoo.client import KazooClient
+from kazoo.exceptions import NoNodeError
 
 import pilo
 
@@ -18,6 +20,14 @@ logger = logging.getLogger(__name__)
 
 
 class Zookeeper(Dynamic):
+    """
+    Stores the dynamic components of a router as an ini @ ``{root}/config``
+    and overrides, one per line, @ ``{root}/overrides``. Watches deliver the
+    changed node's data which the next `load` uses rather than re-fetching,
+    change notifications are coalesced into a single callback per
+    `watch_debounce` seconds and each node's parsed data is cached by its
+    ``mzxid`` so only changed nodes are re-parsed.
+    """
 
     _type_ = pilo.fields.Type.instance('zookeeper')
 
@@ -30,6 +40,9 @@ class Zookeeper(Dynamic):
     #: Path to root node where dynamic configuration is stored.
     root = pilo.fields.String()
 
+    #: Number of seconds to coalesce change notifications over.
+    watch_debounce = pilo.fields.Float(default=0.1)
+
     # Dynamic
 
     def can_connect(self, router):
@@ -40,20 +53,41 @@ class Zookeeper(Dynamic):
         cli = KazooClient(hosts=','.join(self.hosts))
         cli.start(timeout=self.timeout)
         self._cli = cli
+        self._delivered, self._parsed, self._loaded = {}, {}, None
 
     def is_connected(self, router):
         return self._cli is not None
 
     def disconnect(self, router):
         logger.info('disconnecting from %s ...', self.hosts)
+        if self._debounce:
+            self._debounce.cancel()
+            self._debounce = None
         self._cli.stop()
         self._cli = None
 
     def load(self, router):
-        src = self._src(router)
-        update = type(router)()
-        update.map(src, tags=['dynamic'], error='raise')
-        router.update(update)
+        """
+        Loads the config and overrides nodes, using the data delivered by
+        watches if any, unless neither has changed since the last load.
+
+        :return: True if `router` was updated, otherwise False.
+        """
+        nodes = dict(
+            (path, self._get(path))
+            for path in [self._config_path, self._overrides_path]
+        )
+        loaded = dict(
+            (path, stat.mzxid if stat is not None else None)
+            for path, (_, stat) in nodes.iteritems()
+        )
+        if loaded == self._loaded:
+            logger.info('%s unchanged', self.root)
+            return False
+        src = self._src(router, nodes)
+        self._update(router, src)
+        self._loaded = loaded
+        return True
 
     def save(self, router):
         self._set_overrides(router)
@@ -61,35 +95,96 @@ class Zookeeper(Dynamic):
 
     def watch(self, router, callback):
 
-        def _intercept(watch, data, stat):
-            watch._func = _relay
+        def _intercept(path, watch, data, stat, event=None):
+            self._delivered[path] = (data, stat)
+            watch._func = functools.partial(_relay, path)
 
-        def _relay(data, stat):
-            return callback(router)
+        def _relay(path, data, stat, event=None):
+            self._delivered[path] = (data, stat)
+            self._notified(router, callback, path, stat)
 
         for path in [self._config_path, self._overrides_path]:
             self._cli.ensure_path(path)
             logger.info('watching %s ...', path)
             watch = self._cli.DataWatch(path)
             # NOTE: replaces _intercept w/ _relay
-            watch(functools.partial(_intercept, watch))
+            watch(functools.partial(_intercept, path, watch))
+
+    def stamp(self, router):
+        return self._loaded
+
+    def restamp(self, router, stamp):
+        self._loaded = stamp
 
     # internals
 
     _cli = None
 
-    def _src(self, router):
+    _debounce = None
+
+    _delivered = None
+
+    _parsed = None
+
+    _loaded = None
+
+    def _notified(self, router, callback, path, stat):
+        mzxid = stat.mzxid if stat is not None else None
+        if self._loaded is not None and self._loaded.get(path) == mzxid:
+            logger.debug('%s mzxid %s already loaded', path, mzxid)
+            return
+        if self._debounce is not None and self._debounce.is_alive():
+            # NOTE: coalesced into pending callback
+            return
+
+        def _fire():
+            self._debounce = None
+            callback(router)
+
+        if not self.watch_debounce:
+            _fire()
+            return
+        self._debounce = threading.Timer(self.watch_debounce, _fire)
+        self._debounce.daemon = True
+        self._debounce.start()
+
+    def _get(self, path):
+        delivered = self._delivered.pop(path, None)
+        if delivered is not None:
+            return delivered
+        try:
+            return self._cli.get(path)
+        except NoNodeError:
+            return None, None
+
+    def _parse(self, path, data, stat, parse):
+        if stat is None or data is None:
+            return None
+        cached = self._parsed.get(path)
+        if cached is not None and cached[0] == stat.mzxid:
+            return cached[1]
+        parsed = parse(data)
+        self._parsed[path] = (stat.mzxid, parsed)
+        return parsed
+
+    def _src(self, router, nodes):
         srcs = []
 
         # settings
-        config = self._get_config(router)
-        if config is not None:
+        config = self._parse(
+            self._config_path, *nodes[self._config_path], parse=self._parse_config
+        )
+        if config is not None and config.has_section(router.name):
             srcs.append(pilo.source.ConfigSource(
                 config, section=router.name, location=self._config_path
             ))
 
         # overrides
-        raw = self._get_overrides()
+        raw = self._parse(
+            self._overrides_path,
+            *nodes[self._overrides_path],
+            parse=self._parse_overrides
+        )
         if raw is not None:
             srcs.append({'overrides': raw})
 
@@ -102,14 +197,10 @@ class Zookeeper(Dynamic):
     def _config_path(self):
         return os.path.join(self.root, 'config')
 
-    def _get_config(self, router):
-        if not self._cli.exists(self._config_path):
-            return
-        raw, stat = self._cli.get(self._config_path)
+    @staticmethod
+    def _parse_config(raw):
         config = ConfigParser.ConfigParser()
         config.readfp(StringIO.StringIO(raw))
-        if not config.has_section(router.name):
-            return
         return config
 
     def _encode_config(self, value):
@@ -142,10 +233,8 @@ class Zookeeper(Dynamic):
     def _overrides_path(self):
         return os.path.join(self.root, 'overrides')
 
-    def _get_overrides(self):
-        if not self._cli.exists(self._overrides_path):
-            return
-        raw, stat = self._cli.get(self._overrides_path)
+    @staticmethod
+    def _parse_overrides(raw):
         return raw.splitlines() or None
 
     def _set_overrides(self, router):
@@ -1,8 +1,10 @@
 import collections
 import logging
 import StringIO
+import threading
 
 from . import exc, Request, Expression
+from .metrics import timer
 
 
 logger = logging.getLogger(__name__)
@@ -149,6 +151,137 @@ class Rule(object):
         return not self.__eq__(other)
 
 
+class Breaker(object):
+    """
+    Circuit breaker for a rule that fails (i.e. raises) when matching. It is:
+
+    `closed`
+        The rule is evaluated. Once `threshold` errors happen within `window`
+        seconds it opens.
+
+    `open`
+        The rule is disabled for `retry` seconds after which it is half-open.
+
+    `half-open`
+        The rule is evaluated again. If it fails within `window` seconds it
+        opens again, otherwise it is closed.
+
+    Failures are logged at most once per `window` seconds, noting how many
+    were suppressed in between. Failures may be recorded from many threads.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, window=60.0, retry=30.0):
+        self.threshold = threshold
+        self.window = window
+        self.retry = retry
+        #: Total number of errors.
+        self.errors = 0
+        #: Number of times opened.
+        self.trips = 0
+        #: Most recent error.
+        self.last_error = None
+        self.opened_at = None
+        self.half_opened_at = None
+        self._count = 0
+        self._window_at = None
+        self._logged_at = None
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is not None:
+            return self.OPEN
+        if (self.half_opened_at is not None and
+                timer() - self.half_opened_at < self.window):
+            return self.HALF_OPEN
+        return self.CLOSED
+
+    @property
+    def retry_at(self):
+        """
+        When an open breaker becomes half-open, otherwise None.
+        """
+        if self.opened_at is None:
+            return None
+        return self.opened_at + self.retry
+
+    def failed(self, ex, now=None, trip=True):
+        """
+        Records a failure.
+
+        :param ex: The error.
+        :param now: Optional time of failure, defaults to now.
+        :param trip: Flag determining whether this failure can open the
+                     breaker.
+
+        :return: True if this failure opened the breaker, otherwise False.
+        """
+        now = timer() if now is None else now
+        with self._lock:
+            self.errors += 1
+            self.last_error = ex
+            # NOTE: already open, e.g. failed concurrently w/ the one that
+            # opened it
+            if not trip or self.opened_at is not None:
+                return False
+            if (self.half_opened_at is not None and
+                    now - self.half_opened_at < self.window):
+                self._count = self.threshold
+            else:
+                self.half_opened_at = None
+                if self._window_at is None or now - self._window_at >= self.window:
+                    self._window_at, self._count = now, 0
+                self._count += 1
+            if self._count < self.threshold:
+                return False
+            self.opened_at = now
+            self.half_opened_at = None
+            self._window_at, self._count = None, 0
+            self.trips += 1
+            return True
+
+    def half_open(self, now=None):
+        with self._lock:
+            self.opened_at = None
+            self.half_opened_at = timer() if now is None else now
+
+    def close(self):
+        with self._lock:
+            self.opened_at = self.half_opened_at = None
+            self._window_at, self._count = None, 0
+
+    def should_log(self, now=None):
+        """
+        Rate limits logging of failures.
+
+        :return: Tuple of whether to log this failure and the number of
+                 failures suppressed since the last one logged.
+        """
+        now = timer() if now is None else now
+        with self._lock:
+            if self._logged_at is not None and now - self._logged_at < self.window:
+                self._suppressed += 1
+                return False, self._suppressed
+            suppressed, self._suppressed, self._logged_at = self._suppressed, 0, now
+            return True, suppressed
+
+    def as_dict(self):
+        return {
+            'state': self.state,
+            'errors': self.errors,
+            'trips': self.trips,
+            'last_error': (
+                None if self.last_error is None else str(self.last_error)
+            ),
+            'retry_at': self.retry_at,
+        }
+
+
 class Rules(collections.MutableSequence):
     """
     A collection of "routing" rules used to match requests to an upstream.
@@ -164,15 +297,25 @@ class Rules(collections.MutableSequence):
         Flag determining whether added rules are compiled.
 
     `auto_disable`
-        Flag determining whether to auto disable a rule that generates and
-        error when attempting to match a request.
+        Flag determining whether to temporarily disable a rule that
+        repeatedly generates errors when attempting to match a request, see
+        `Breaker`.
+
+    `error_threshold`, `error_window`, `error_retry`
+        `Breaker` parameters.
     """
 
     def __init__(self, *rules, **options):
         self._parse_rule = None
         self.symbols = None
         self._compile = False
+        self._profile = None
+        self._matcher = self._match
         self.disabled = set()
+        self._breakers = {}
+        self._retry_at = None
+        # NOTE: guards breakers, disabled and retry at
+        self._lock = threading.Lock()
 
         self._rules = []
         if len(rules) == 1 and isinstance(rules[0], list):
@@ -185,6 +328,9 @@ class Rules(collections.MutableSequence):
         self.compile = options.pop('compile', False)
         self.strict = options.pop('strict', True)
         self.auto_disable = options.pop('auto_disable', False)
+        self.error_threshold = options.pop('error_threshold', 5)
+        self.error_window = options.pop('error_window', 60.0)
+        self.error_retry = options.pop('error_retry', 30.0)
         if options:
             raise TypeError(
                 'Unexpected keyword argument {0}'.format(options.keys()[0])
@@ -209,6 +355,20 @@ class Rules(collections.MutableSequence):
             self.symbols = None
             for i in xrange(len(self)):
                 self[i] = Rule(self[i].expression, self[i].upstream)
+        self._matcher = self._matcher_for()
+
+    @property
+    def profile(self):
+        """
+        Optional ``rump.profiling.Scope`` to record rule evaluation and field
+        resolution timings to.
+        """
+        return self._profile
+
+    @profile.setter
+    def profile(self, value):
+        self._profile = value
+        self._matcher = self._matcher_for()
 
     @property
     def parse_rule(self):
@@ -258,19 +418,59 @@ class Rules(collections.MutableSequence):
         self.disabled = set(self)
 
     def enable(self, i):
-        self.disabled.remove(self[i])
+        with self._lock:
+            self.disabled.remove(self[i])
+            breaker = self._breakers.get(self[i])
+        if breaker is not None:
+            breaker.close()
 
     def enable_all(self):
-        self.disabled.clear()
+        with self._lock:
+            self.disabled.clear()
+            breakers = self._breakers.values()
+            self._retry_at = None
+        for breaker in breakers:
+            breaker.close()
+
+    def breaker(self, i):
+        """
+        The `Breaker` for the rule at index `i`, or None if it has never
+        failed.
+        """
+        return self._breakers.get(self[i])
+
+    def breakers(self):
+        """
+        :return: List of ``(index, Breaker)`` for rules that have failed.
+        """
+        return [
+            (i, self._breakers[rule])
+            for i, rule in enumerate(self)
+            if rule in self._breakers
+        ]
 
     def match(self, request, error=None):
+        return self.match_index(request, error)[1]
+
+    def match_index(self, request, error=None):
+        """
+        Like `match` but also identifies the matching rule.
+
+        :return: Tuple of the index of the matching rule and its upstream, or
+                 ``(None, None)`` if no rule matched.
+        """
         if error is None:
             error = 'suppress' if self.auto_disable is False else 'disable'
         if error not in ('raise', 'disable', 'suppress'):
             raise ValueError('error={0} invalid'.format(error))
-        return (
-            self._match_compiled if self.compile else self._match
-        )(request, error)
+        if self._retry_at is not None and timer() >= self._retry_at:
+            self._half_open()
+        return self._matcher(request, error)
+
+    def _matcher_for(self):
+        if self._profile is not None:
+            return self._match_profiled
+        return self._match_compiled if self.compile else self._match
 
     def _match_compiled(self, request, error):
         i, count, request_ctx = 0, len(self), request.context(self.symbols)
@@ -280,7 +480,7 @@ class Rules(collections.MutableSequence):
                     if self[i] not in self.disabled:
                         upstream = self[i].match_context(request_ctx)
                         if upstream:
-                            return upstream
+                            return i, upstream
                     i += 1
                 break
             except StandardError:
@@ -288,10 +488,9 @@ class Rules(collections.MutableSequence):
             except Exception as ex:
                 if error == 'raise':
                     raise
-                logger.exception('[%s] %s match failed - %s\n', i, self[i], ex)
-                if error == 'disable':
-                    self.disabled.add(self[i])
+                self._failed(i, ex, error)
                 i += 1
+        return None, None
 
     def _match(self, request, error):
         i, count = 0, len(self)
@@ -301,7 +500,45 @@ class Rules(collections.MutableSequence):
                     if self[i] not in self.disabled:
                         upstream = self[i].match(request)
                         if upstream:
-                            return upstream
+                            return i, upstream
+                    i += 1
+                break
+            except StandardError:
+                raise
+            except Exception as ex:
+                if error == 'raise':
+                    raise
+                self._failed(i, ex, error)
+                i += 1
+        return None, None
+
+    def _match_profiled(self, request, error):
+        profile = self._profile
+        if self.compile:
+            request_ctx = request.context(self.symbols)
+            resolving = request_ctx['request'] = profile.resolving(
+                request, compiled=True,
+            )
+            evaluate = lambda rule: rule.match_context(request_ctx)
+        else:
+            resolving = profile.resolving(request)
+            evaluate = lambda rule: rule.match(resolving)
+        i, count = 0, len(self)
+        while True:
+            try:
+                while i != count:
+                    rule = self[i]
+                    if rule not in self.disabled:
+                        # NOTE: fields are timed as they are read, so exclude
+                        # that from the rule's time
+                        started_at, resolved = timer(), resolving.elapsed
+                        upstream = evaluate(rule)
+                        seconds = (
+                            timer() - started_at - (resolving.elapsed - resolved)
+                        )
+                        profile.rule(i, rule, seconds, bool(upstream))
+                        if upstream:
+                            return i, upstream
                     i += 1
                 break
             except StandardError:
@@ -309,10 +546,66 @@ class Rules(collections.MutableSequence):
             except Exception as ex:
                 if error == 'raise':
                     raise
-                logger.exception('[%s] %s match failed - %s\n', self[i], i, ex)
-                if error == 'disable':
-                    self.disabled.add(self[i])
+                self._failed(i, ex, error)
                 i += 1
+        return None, None
+
+    def _failed(self, i, ex, error):
+        rule = self[i]
+        breaker = self._breakers.get(rule)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(rule)
+                if breaker is None:
+                    breaker = self._breakers[rule] = Breaker(
+                        self.error_threshold, self.error_window, self.error_retry,
+                    )
+        now = timer()
+        log, suppressed = breaker.should_log(now)
+        if log:
+            logger.exception(
+                '[%s] %s match failed%s - %s\n', i, rule,
+                ' ({0} more suppressed)'.format(suppressed) if suppressed else '',
+                ex,
+            )
+        if breaker.failed(ex, now, trip=error == 'disable'):
+            logger.warning(
+                '[%s] %s disabled after %s error(s) within %ss, retrying in %ss',
+                i, rule, breaker.threshold, breaker.window, breaker.retry,
+            )
+            with self._lock:
+                self.disabled.add(rule)
+                retry_at = breaker.retry_at
+                if self._retry_at is None or retry_at < self._retry_at:
+                    self._retry_at = retry_at
+
+    def _half_open(self):
+        now = timer()
+        with self._lock:
+            # NOTE: another thread may have just done this
+            if self._retry_at is None or now < self._retry_at:
+                return
+            self._retry_at = None
+            for rule, breaker in self._breakers.items():
+                retry_at = breaker.retry_at
+                if retry_at is None:
+                    continue
+                if retry_at <= now:
+                    logger.info('%s half-open, retrying', rule)
+                    breaker.half_open(now)
+                    self.disabled.discard(rule)
+                elif self._retry_at is None or retry_at < self._retry_at:
+                    self._retry_at = retry_at
+
+    def _forget(self, rules):
+        # NOTE: breakers of rules no longer in these, e.g. replaced by edits
+        if not self._breakers and not self.disabled:
+            return
+        with self._lock:
+            for rule in rules:
+                if rule not in self._rules:
+                    self._breakers.pop(rule, None)
+                    self.disabled.discard(rule)
 
     def __str__(self):
         return str(self._rules)
@@ -344,11 +637,14 @@ class Rules(collections.MutableSequence):
             )
         if self.compile:
             rule = rule.compile(self.symbols)
+        replaced = self._rules[key]
         self._rules[key] = rule
+        self._forget([replaced])
 
     def __delitem__(self, key):
-        self.disabled.difference_update(self.__getitem__(key))
+        removed = self._rules[key]
         self._rules.__delitem__(key)
+        self._forget(removed if isinstance(key, slice) else [removed])
 
     def __len__(self):
         return len(self._rules)
@@ -1,11 +1,15 @@
 import ConfigParser
 import glob
+import hashlib
 import logging
+import multiprocessing
 import os
+import threading
 
 import pilo
 
 from . import Router, Dynamic
+from .artifact import Artifact
 
 
 logger = logging.getLogger(__name__)
@@ -69,15 +73,66 @@ class Settings(pilo.Form):
             [self.ctx.src_path.location] if self.ctx.src_path.location else []
         )
 
+    #: Optional path to rules compiled by ``rump compile``, see
+    #: ``rump.artifact``. It and its directory must only be writable by
+    #: trusted users.
+    compiled = pilo.fields.String(default=None)
+
+    @compiled.munge
+    def compiled(self, value):
+        if not self.ctx.src_path.location:
+            return value
+        return os.path.normpath(os.path.join(
+            os.path.dirname(os.path.abspath(self.ctx.src_path.location)),
+            os.path.expanduser(value),
+        ))
+
+    #: Optional directory in which to cache the rules parsed from each
+    #: included file, keyed by its path, modification time and size. Only
+    #: files changed since they were last loaded are then parsed. Must only
+    #: be writable by trusted users, cached rules that could have been
+    #: written by another are parsed again.
+    cache_dir = pilo.fields.String(default=None)
+
+    @cache_dir.munge
+    def cache_dir(self, value):
+        if not self.ctx.src_path.location:
+            return value
+        return os.path.normpath(os.path.join(
+            os.path.dirname(os.path.abspath(self.ctx.src_path.location)),
+            os.path.expanduser(value),
+        ))
+
+    #: Number of processes in which to parse the rules of included files, 1
+    #: parses them all in this one. Only used when loading from the main
+    #: thread.
+    parse_workers = pilo.fields.Integer(default=1, min_value=1)
+
     #: Routers loaded from globed includes.
     routers = pilo.fields.List(pilo.Field())
 
     @routers.compute
     def routers(self):
+        file_paths = self.files()
+        artifact = getattr(self.ctx, 'artifact', None)
+        if artifact is None and self.compiled:
+            artifact = Artifact.load(self.compiled)
+        if artifact is None and (self.cache_dir or self.parse_workers > 1):
+            artifact = self._precompile(file_paths)
         names = getattr(self.ctx, 'names', None)
         main = getattr(self.ctx, 'main', None)
         routers = []
-        globed = set()
+        with pilo.ctx(artifact=artifact):
+            for file_path in file_paths:
+                routers.extend(load_routers(file_path, names=names, main=main))
+        return sorted(routers, key=lambda router: router.name)
+
+    def files(self):
+        """
+        Paths of the files `includes` globs match, in the order they are
+        loaded.
+        """
+        file_paths = []
         for include in self.includes:
             logger.debug('globing for %s', include)
             for file_path in glob.iglob(include):
@@ -85,27 +140,83 @@ class Settings(pilo.Form):
                 if os.path.isdir(file_path):
                     logger.debug('skipping directory %s', file_path)
                     continue
-                if file_path in globed:
+                if file_path in file_paths:
                     logger.debug('skipping duplicate glob %s', file_path)
                     continue
-                globed.add(file_path)
-                logger.info('loading router(s) from %s', file_path)
-                config_parser = ConfigParser.ConfigParser()
-                config_parser.read(file_path)
-                for section in config_parser.sections():
-                    if ':' in section:
-                        continue
-                    if main and main == section:
-                        continue
-                    if names and section not in names:
-                        logger.debug(
-                            'skipping router %s from %s', section, file_path
-                        )
-                        continue
-                    with self.ctx.reset():
-                        router = load_router(config_parser, section, file_path)
-                    routers.append(router)
-        return sorted(routers, key=lambda router: router.name)
+                file_paths.append(file_path)
+        return file_paths
+
+    def _precompile(self, file_paths):
+        """
+        Gets the rules of `file_paths` from `cache_dir` or, for those not
+        cached, by parsing them in `parse_workers` processes.
+
+        :return: ``rump.artifact.Artifact`` w/ the rules of all `file_paths`.
+        """
+        names = getattr(self.ctx, 'names', None)
+        main = getattr(self.ctx, 'main', None)
+        if self.cache_dir:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, 0o700)
+            # NOTE: cache all routers in a file, not just those named
+            names = None
+        artifact = Artifact()
+        missed = []
+        for file_path in file_paths:
+            cached = None
+            if self.cache_dir:
+                cached = Artifact.load(
+                    self._cache_path(file_path), key=self._cache_key(file_path),
+                )
+            if cached is None:
+                missed.append(file_path)
+            else:
+                artifact.merge(cached)
+        logger.info(
+            'parsing rules of %s of %s file(s)', len(missed), len(file_paths),
+        )
+        if not missed:
+            return artifact
+        jobs = [(file_path, names, main) for file_path in missed]
+        workers = min(self.parse_workers, len(missed))
+        if workers > 1 and threading.current_thread().name != 'MainThread':
+            # NOTE: forking w/ other threads running risks children
+            # inheriting locks they hold, e.g. when reloaded by a watch
+            logger.info('parsing in this process, not from the main thread')
+            workers = 1
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.map(_precompile, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(_precompile, jobs)
+        for file_path, result in zip(missed, results):
+            if result is None:
+                # NOTE: parsed (again) when loading, which reports the error
+                continue
+            key, dumped = result
+            compiled = Artifact.loads(dumped)
+            if self.cache_dir:
+                compiled.save(self._cache_path(file_path), key=key)
+            artifact.merge(compiled)
+        return artifact
+
+    def _cache_path(self, file_path):
+        return os.path.join(
+            self.cache_dir,
+            hashlib.sha1(file_path).hexdigest() + '.compiled',
+        )
+
+    @staticmethod
+    def _cache_key(file_path):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return (file_path, stat.st_mtime, stat.st_size)
 
     @classmethod
     def from_file(cls, file_path, section=None, names=None):
@@ -132,6 +243,53 @@ class Settings(pilo.Form):
             ))
 
 
+def load_routers(file_path, names=None, main=None):
+    """
+    Loads routers from an ini-style configuration file.
+
+    :param file_path: Location of ini-style configuration file.
+    :param names: Optional names of the routers to load, otherwise all are
+                  loaded.
+    :param main: Optional section that is *not* a router (e.g. "rump").
+
+    :return: List of routers (typically instances of ``rump.Router``).
+    """
+    logger.info('loading router(s) from %s', file_path)
+    config_parser = ConfigParser.ConfigParser()
+    config_parser.read(file_path)
+    routers = []
+    for section in router_sections(config_parser, main):
+        if names and section not in names:
+            logger.debug('skipping router %s from %s', section, file_path)
+            continue
+        with pilo.ctx.reset():
+            router = load_router(config_parser, section, file_path)
+        routers.append(router)
+    return routers
+
+
+def router_names(file_path, main=None):
+    """
+    Names of the routers in an ini-style configuration file, without loading
+    them.
+
+    :param file_path: Location of ini-style configuration file.
+    :param main: Optional section that is *not* a router (e.g. "rump").
+
+    :return: List of router names, empty if the file is missing.
+    """
+    config_parser = ConfigParser.ConfigParser()
+    config_parser.read(file_path)
+    return router_sections(config_parser, main)
+
+
+def router_sections(config_parser, main=None):
+    return [
+        section for section in config_parser.sections()
+        if ':' not in section and section != main
+    ]
+
+
 def load_router(config_parser, section, file_path=None):
     """
     Loads one router from an ini-style configuration file(s).
@@ -185,3 +343,29 @@ def load_router(config_parser, section, file_path=None):
     src = pilo.source.union(srcs)
 
     return probe.class_(src)
+
+
+# internals
+
+def _precompile(job):
+    """
+    Parses the rules of the routers in a file, typically in a worker process,
+    see ``Settings.parse_workers``.
+
+    :param job: Tuple of ``(file_path, names, main)``, see `load_routers`.
+
+    :return: Tuple of the ``Settings`` cache key of the file, as it was before
+             parsing it, and the ``rump.artifact.Artifact`` of its rules
+             dumped to a string. None if it could not be loaded.
+    """
+    file_path, names, main = job
+    key = Settings._cache_key(file_path)
+    artifact = Artifact(record=True)
+    try:
+        with pilo.ctx.reset():
+            with pilo.ctx(artifact=artifact):
+                load_routers(file_path, names=names, main=main)
+    except Exception, ex:
+        logger.warning('unable to parse rules of %s - %s', file_path, ex)
+        return None
+    return key, artifact.dumps()
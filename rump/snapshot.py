@@ -0,0 +1,328 @@
+"""
+Local on-disk snapshots of the dynamic state of routers so they can be
+served from immediately on startup, rather than after connecting to and
+loading from their dynamic (e.g. redis), and then reconciled in the
+background:
+
+.. code:: python
+
+    snapshot = rump.snapshot.Snapshot.for_router('/var/lib/rump', router)
+    stamps = snapshot.restore(router)  # None if missing or stale
+    router.connect()
+    if stamps is not None:
+        router.dynamic.restamp(router, stamps['stamp'])
+    router.load()  # skipped if unchanged since the snapshot
+    snapshot.save(router)
+
+Rules are stored already parsed (pickled w/ request fields by reference) so
+restoring them skips parsing. Each snapshot is stamped w/ its format, the
+rump version, the router's request type and dynamic settings, when it was
+taken and the dynamic's own stamp (see ``rump.Dynamic.stamp``) for what it
+had loaded. A snapshot whose stamps do not match is stale and ignored.
+
+Restoring a snapshot unpickles it, which can run arbitrary code, so its
+directory must only be writable by trusted users. Snapshots that could have
+been written by another user are ignored, see `check_trusted`.
+
+``rump.wsgi`` snapshots when ``snapshot_dir`` is set.
+"""
+import cPickle as pickle
+import errno
+import hashlib
+import logging
+import os
+import stat
+import StringIO
+import tempfile
+import time
+
+import pilo
+
+from . import __version__, dumps, loads, Dynamic, Rule, Rules, Upstream
+
+
+__all__ = [
+    'Snapshot',
+    'Stale',
+    'Untrusted',
+    'dynamic_state',
+    'update',
+    'router_state',
+    'router_from',
+    'pickler',
+    'unpickler',
+    'check_trusted',
+    'qualified',
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Version of the snapshot format.
+FORMAT = 1
+
+
+class Stale(Exception):
+    """
+    Raised when a snapshot's stamps do not match the router restoring it.
+    """
+
+
+class Untrusted(Exception):
+    """
+    Raised when a file to unpickle could have been written by another user,
+    see `check_trusted`.
+    """
+
+
+class Snapshot(object):
+    """
+    A snapshot of a router's dynamic state stored @ `path`.
+    """
+
+    @classmethod
+    def for_router(cls, directory, router):
+        return cls(os.path.join(directory, '{0}.snapshot'.format(router.name)))
+
+    def __init__(self, path):
+        self.path = path
+
+    def save(self, router):
+        """
+        Atomically (over)writes this snapshot w/ the dynamic state of
+        `router`.
+        """
+        io = StringIO.StringIO()
+        dumper = pickler(io, router.request_type)
+        dumper.dump(self._stamps(router))
+        dumper.dump(dynamic_state(router))
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            os.makedirs(directory)
+        except OSError, ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        fd, tmp_path = tempfile.mkstemp(
+            dir=directory, prefix='.' + os.path.basename(self.path),
+        )
+        try:
+            with os.fdopen(fd, 'wb') as fo:
+                fo.write(io.getvalue())
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        logger.info('saved %s snapshot to %s', router.name, self.path)
+
+    def restore(self, router, max_age=None):
+        """
+        Updates `router` from this snapshot unless it is missing or stale.
+
+        :param max_age: Seconds after which a snapshot is stale, or None.
+
+        :return: The stamps recorded in the snapshot if restored, otherwise
+                 None. The dynamic's own is "stamp", see
+                 ``rump.Dynamic.restamp``.
+        """
+        try:
+            with open(self.path, 'rb') as fo:
+                check_trusted(fo)
+                loader = unpickler(fo, router.request_type)
+                stamps = loader.load()
+                self._check(router, stamps, max_age)
+                state = loader.load()
+        except IOError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            logger.info('no %s snapshot @ %s', router.name, self.path)
+            return None
+        except Stale, ex:
+            logger.info('%s snapshot @ %s is stale - %s', router.name, self.path, ex)
+            return None
+        except Untrusted, ex:
+            logger.warning(
+                'ignoring %s snapshot @ %s - %s', router.name, self.path, ex,
+            )
+            return None
+        update(router, state, self.path)
+        logger.info(
+            'restored %s from snapshot @ %s taken %.1fs ago',
+            router.name, self.path, time.time() - stamps['at'],
+        )
+        return stamps
+
+    # internals
+
+    def _stamps(self, router):
+        return {
+            'format': FORMAT,
+            'rump': __version__,
+            'router': router.name,
+            'request_type': qualified(router.request_type),
+            'dynamic': _digest(router.dynamic),
+            'stamp': router.dynamic.stamp(router),
+            'at': time.time(),
+        }
+
+    def _check(self, router, stamps, max_age):
+        if not isinstance(stamps, dict) or stamps.get('format') != FORMAT:
+            raise Stale('format {0!r} != {1}'.format(
+                stamps.get('format') if isinstance(stamps, dict) else None, FORMAT,
+            ))
+        expected = self._stamps(router)
+        for name in ['rump', 'router', 'request_type', 'dynamic']:
+            if stamps[name] != expected[name]:
+                raise Stale('{0} {1!r} != {2!r}'.format(
+                    name, stamps[name], expected[name],
+                ))
+        age = time.time() - stamps['at']
+        if max_age is not None and age > max_age:
+            raise Stale('{0:.1f}s old > {1}s'.format(age, max_age))
+
+
+def dynamic_state(router):
+    """
+    Gets the dynamic fields of `router` as a mapping that can be pickled by
+    a `pickler`. Rules are parsed but **not** compiled, compiling is cheap.
+    """
+    state = {}
+    for field in router.fields:
+        if 'dynamic' not in field.tags:
+            continue
+        state[field.name] = _state(getattr(router, field.name))
+    return state
+
+
+def router_state(router):
+    """
+    Like `dynamic_state` but gets all fields of `router` other than its
+    dynamic, so a router can be recreated from it by `router_from`.
+    """
+    state = {}
+    for field in router.fields:
+        if field.name == 'dynamic':
+            continue
+        value = getattr(router, field.name)
+        if field.name == 'request_type':
+            # NOTE: pickled by reference
+            state[field.name] = value
+        else:
+            state[field.name] = _state(value)
+    return state
+
+
+def router_from(router_type, state, location=None, router=None):
+    """
+    Creates a router of `router_type` from `state`, see `router_state`.
+
+    :param router: Optional router to update instead. Its fields are swapped
+                   in by a single ``dict.update``, like ``Dynamic._update``.
+
+    :return: The router.
+    """
+    update = router_type()
+    update.request_type = state['request_type']
+    update.map(
+        pilo.source.DefaultSource(state, location=location), error='raise',
+    )
+    if router is None:
+        return update
+    router.update(dict((name, update[name]) for name in state))
+    return router
+
+
+def update(router, state, location=None):
+    """
+    Updates `router` w/ dynamic fields `state`, see `dynamic_state`.
+    """
+    Dynamic._update(
+        router,
+        pilo.source.DefaultSource(state, location=location),
+        names=state.keys(),
+    )
+
+
+def pickler(io, request_type):
+    """
+    Creates a pickler writing to `io` that pickles the fields of
+    `request_type` (e.g. those in rule expressions) by reference.
+    """
+    dumper = pickle.Pickler(io, pickle.HIGHEST_PROTOCOL)
+    dumper.persistent_id = _field_id(request_type)
+    return dumper
+
+
+def unpickler(io, request_type):
+    """
+    Creates an unpickler reading from `io` what a `pickler` for
+    `request_type` wrote.
+    """
+    loader = pickle.Unpickler(io)
+    loader.persistent_load = _field_load(request_type)
+    return loader
+
+
+def check_trusted(fo):
+    """
+    Checks that open file `fo`, e.g. to unpickle, could only have been
+    written by this user. That is it is owned by this user (or root) and is
+    not group or world writable.
+
+    :raises Untrusted: If it could have been written by another user.
+    """
+    st = os.fstat(fo.fileno())
+    if st.st_uid not in (os.getuid(), 0):
+        raise Untrusted('owned by uid {0} not {1}'.format(st.st_uid, os.getuid()))
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise Untrusted('group or world writable (mode {0:o})'.format(
+            stat.S_IMODE(st.st_mode),
+        ))
+
+
+def qualified(obj):
+    return '{0}:{1}'.format(obj.__module__, obj.__name__)
+
+
+# internals
+
+
+def _state(value):
+    if isinstance(value, Rules):
+        return [Rule(rule.expression, rule.upstream) for rule in value]
+    if isinstance(value, Upstream):
+        # NOTE: already parsed and str locations, so keep as is
+        return value
+    return loads(dumps(value))
+
+
+def _digest(dynamic):
+    return hashlib.sha1(dumps(dynamic)).hexdigest()
+
+
+def _field_id(request_type):
+    # NOTE: request fields (and their inverses, e.g. "not has_content") are
+    # pickled by reference to `request_type`
+
+    def _persistent_id(obj):
+        if not isinstance(obj, pilo.Field):
+            return None
+        inv = vars(obj).get('inv', False)
+        field = getattr(request_type, obj.name, None)
+        if field is not obj and not (inv and isinstance(field, type(obj))):
+            raise pickle.PicklingError(
+                '{0!r} is not a field of {1}'.format(obj, qualified(request_type))
+            )
+        return obj.name, inv
+
+    return _persistent_id
+
+
+def _field_load(request_type):
+
+    def _persistent_load(pid):
+        name, inv = pid
+        field = getattr(request_type, name)
+        return ~field if inv else field
+
+    return _persistent_load
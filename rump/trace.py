@@ -0,0 +1,265 @@
+"""
+Structured selection traces. A sample of selections are each recorded as a
+`Record` (router, matched rule, fields read w/ their values, timing, etc) to
+a bounded in-memory ring buffer that a background thread flushes, as JSON
+lines, to a file:
+
+.. code:: python
+
+    tracer = rump.trace.Tracer('/var/log/rump/trace.log', rate=0.01)
+    tracer.start()
+    ...
+    record = tracer.begin(request)
+    upstream = router.match_upstream(request, trace=record)
+    tracer.end(record, router, request, upstream)
+    ...
+    tracer.stop()
+
+The request thread only collects references (e.g. to the request and the
+rules it was matched against), fields are gathered and everything formatted
+and written by the flushing thread. If that falls behind the oldest records
+are dropped (see `Tracer.dropped`) rather than blocking selection.
+
+``rump.wsgi`` traces when ``trace_file`` is set and ``rump eval`` when
+``--trace`` is given.
+"""
+import collections
+import json
+import logging
+import os
+import random
+import threading
+import weakref
+
+from .exp import Expression, FieldOp, SubField
+from .metrics import timer
+
+
+__all__ = [
+    'Record',
+    'Tracer',
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+class Record(dict):
+    """
+    A traced selection. Keys are:
+
+    - ``at``: when selection started (epoch seconds)
+    - ``pid``: the selecting process
+    - ``id``: the request id, if any
+    - ``router``: name of the router, if any
+    - ``rules``: "overrides" or "rules" if a rule matched
+    - ``index``: the index of matched rule in ``rules``
+    - ``fields``: field paths read while matching and their values
+    - ``upstream``: the matched upstream, if any
+    - ``server``: the selected server, if any
+    - ``seconds``: time spent selecting
+    - ``error``: the error, if selection failed
+
+    ``fields`` is only added when the record is flushed, see `Tracer.flush`.
+    """
+
+    #: ``(overrides, rules, request)`` the selection was matched against,
+    #: used to gather ``fields`` when flushed.
+    evaluated = None
+
+    def matched(self, rules, index):
+        """
+        Called by ``rump.Router.match_upstream`` when a rule matches.
+        """
+        self['rules'] = rules
+        self['index'] = index
+
+
+class Tracer(object):
+    """
+    Samples selections as `Record`s and flushes them to `path`.
+    """
+
+    def __init__(self, path=None, rate=1.0, size=4096, interval=1.0):
+        #: Path of file to append JSON lines to, or None to only buffer.
+        self.path = path
+        #: Fraction (0 - 1) of selections to trace.
+        self.rate = rate
+        #: Seconds between flushes.
+        self.interval = interval
+        #: Number of records dropped because the buffer was full.
+        self.dropped = 0
+        self.records = collections.deque(maxlen=size)
+        self._flusher = None
+        self._pid = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._fields_for = weakref.WeakKeyDictionary()
+
+    def sample(self):
+        """
+        :return: True if a selection should be traced, otherwise False.
+        """
+        return self.rate >= 1.0 or random.random() < self.rate
+
+    def begin(self, request):
+        """
+        Starts tracing a selection of `request` if it is sampled.
+
+        :return: A `Record` to pass to `end`, or None if not sampled.
+        """
+        if not self.sample():
+            return None
+        return Record(at=timer(), pid=os.getpid(), id=getattr(request, 'id', None))
+
+    def end(self, record, router, request, upstream=None, server=None, error=None):
+        """
+        Completes and buffers a `record` created by `begin`. If `record` is
+        None this does nothing.
+        """
+        if record is None:
+            return
+        record['seconds'] = timer() - record['at']
+        record['router'] = router.name if router is not None else None
+        record['upstream'] = upstream
+        record['server'] = server
+        record['error'] = error
+        if router is not None:
+            # NOTE: references only, fields are gathered by `flush`
+            record.evaluated = (router.overrides, router.rules, request)
+        self.append(record)
+
+    def append(self, record):
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(record)
+        if self.path is not None and self._stale:
+            self.start()
+
+    def start(self):
+        """
+        Starts the thread flushing records to `path`. It is restarted as
+        needed, e.g. in forked children.
+        """
+        with self._lock:
+            if not self._stale:
+                return
+            self._stopped.clear()
+            self._pid = os.getpid()
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name='rump-trace',
+            )
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the flushing thread, flushing any remaining records.
+        """
+        self._stopped.set()
+        flusher, self._flusher = self._flusher, None
+        if flusher is not None and flusher.is_alive() and self._pid == os.getpid():
+            flusher.join(timeout)
+        if self.path is not None:
+            self.flush()
+
+    def flush(self, io=None):
+        """
+        Writes buffered records, as JSON lines, to `io` or `path`.
+
+        :return: Number of records written.
+        """
+        if not self.records:
+            return 0
+        if io is None:
+            with open(self.path, 'a') as fo:
+                return self.flush(fo)
+        count = 0
+        while True:
+            try:
+                record = self.records.popleft()
+            except IndexError:
+                break
+            if record.evaluated is not None:
+                record['fields'] = self._fields(record, *record.evaluated)
+                record.evaluated = None
+            server = record.get('server')
+            if server is not None:
+                record['server'] = '{0}://{1}'.format(server.protocol, server.location)
+            io.write(json.dumps(record, default=_default, sort_keys=True))
+            io.write('\n')
+            count += 1
+        return count
+
+    # internals
+
+    @property
+    def _stale(self):
+        return (
+            self._flusher is None or
+            self._pid != os.getpid() or
+            not self._flusher.is_alive()
+        )
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._stopped.wait(self.interval)
+            try:
+                self.flush()
+            except Exception, ex:
+                logger.exception('trace flush to %s failed - %s', self.path, ex)
+
+    def _fields(self, record, overrides, rules, request):
+        # NOTE: only report fields already resolved (i.e. read while
+        # matching) so tracing never resolves anything itself.
+        evaluated = []
+        if record.get('rules') == 'overrides':
+            evaluated.extend(overrides[:record['index'] + 1])
+        else:
+            evaluated.extend(overrides)
+            if record.get('rules') == 'rules':
+                evaluated.extend(rules[:record['index'] + 1])
+            else:
+                evaluated.extend(rules)
+        fields = {}
+        for rule in evaluated:
+            for field in self._fields_of(rule.expression):
+                path = Expression._field_literal(field)
+                if path in fields:
+                    continue
+                resolved, value = _resolved(request, field)
+                if resolved:
+                    fields[path] = value
+        return fields
+
+    def _fields_of(self, expression):
+        # NOTE: weakly keyed so expressions of reloaded rules are dropped
+        fields = self._fields_for.get(expression)
+        if fields is None:
+            fields = []
+
+            def _visit(op):
+                field = op.field if isinstance(op, FieldOp) else op
+                if all(field is not other for other in fields):
+                    fields.append(field)
+
+            expression.traverse(field_op=_visit)
+            self._fields_for[expression] = fields
+        return fields
+
+
+def _resolved(request, field):
+    if isinstance(field, SubField):
+        resolved, value = _resolved(request, field.field)
+        if not resolved or value is None:
+            return resolved, value
+        return True, getattr(value, field.name, None)
+    if field.name not in request:
+        return False, None
+    return True, request[field.name]
+
+
+def _default(obj):
+    if isinstance(obj, Exception):
+        return '{0}: {1}'.format(type(obj).__name__, obj)
+    return str(obj)
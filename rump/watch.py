@@ -0,0 +1,256 @@
+"""
+Watches files for changes (e.g. created, written, removed, renamed over)
+from a background thread. On Linux this uses inotify (via ``ctypes``, so no
+extension modules are needed) otherwise the files are polled by ``os.stat``:
+
+.. code:: python
+
+    def changed(paths):
+        print 'changed', paths
+
+    watch = rump.watch.watch(['/etc/rump/health'], changed)
+    ...
+    watch.stop()
+
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+
+
+__all__ = [
+    'watch',
+    'Watch',
+    'PollWatch',
+    'INotifyWatch',
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+def watch(paths, callback, poll=1.0):
+    """
+    Starts watching `paths`, preferring `INotifyWatch` and falling back to
+    `PollWatch`.
+
+    :param paths: Paths of files to watch. They need not exist.
+    :param callback: Called with a list of changed paths.
+    :param poll: Seconds between checks for changes (`PollWatch`) or stop
+                 requests (`INotifyWatch`).
+
+    :return: The started `Watch`.
+    """
+    watch_type = INotifyWatch if INotifyWatch.available() else PollWatch
+    try:
+        watch = watch_type(paths, callback, poll)
+    except (OSError, IOError), ex:
+        if watch_type is PollWatch:
+            raise
+        logger.warning('inotify unavailable, polling - %s', ex)
+        watch = PollWatch(paths, callback, poll)
+    watch.start()
+    return watch
+
+
+class Watch(threading.Thread):
+    """
+    Base for threads watching `paths` and calling `callback` with a list of
+    those that changed.
+    """
+
+    def __init__(self, paths, callback, poll=1.0):
+        super(Watch, self).__init__(name='rump-watch')
+        self.daemon = True
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.callback = callback
+        self.poll = poll
+        self._stopped = threading.Event()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if not self.is_alive():
+            # NOTE: never started or lost in a fork so release it here.
+            self.close()
+        elif threading.current_thread() is not self:
+            self.join(timeout)
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def changes(self):
+        """
+        Waits at most `poll` seconds for changes.
+
+        :return: List of changed paths, which may be empty.
+        """
+        raise NotImplementedError
+
+    # threading.Thread
+
+    def run(self):
+        try:
+            while not self.stopped:
+                changed = self.changes()
+                if not changed or self.stopped:
+                    continue
+                try:
+                    self.callback(changed)
+                except Exception, ex:
+                    logger.exception('watch callback failed - %s', ex)
+        finally:
+            self.close()
+
+    # internals
+
+    def close(self):
+        pass
+
+
+class PollWatch(Watch):
+    """
+    Detects changes by comparing ``os.stat`` of each path every `poll`
+    seconds.
+    """
+
+    def __init__(self, paths, callback, poll=1.0):
+        super(PollWatch, self).__init__(paths, callback, poll)
+        self._stats = dict((path, self._stat(path)) for path in self.paths)
+
+    def changes(self):
+        self._stopped.wait(self.poll)
+        changed = []
+        for path in self.paths:
+            stat = self._stat(path)
+            if stat != self._stats[path]:
+                self._stats[path] = stat
+                changed.append(path)
+        return changed
+
+    # internals
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+        except OSError, ex:
+            if ex.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+class INotifyWatch(Watch):
+    """
+    Detects changes using inotify. The parent directory of each path is
+    watched so files that are created, removed or renamed over (e.g. atomic
+    writes) are detected.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_NONBLOCK = 0x00000800
+    IN_CLOEXEC = 0x00080000
+
+    mask = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+        IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    )
+
+    event = struct.Struct('iIII')
+
+    _libc = None
+
+    @classmethod
+    def available(cls):
+        if cls._libc is None:
+            cls._libc = False
+            name = ctypes.util.find_library('c')
+            if name:
+                libc = ctypes.CDLL(name, use_errno=True)
+                if hasattr(libc, 'inotify_init1'):
+                    cls._libc = libc
+        return bool(cls._libc)
+
+    def __init__(self, paths, callback, poll=1.0):
+        if not self.available():
+            raise OSError(errno.ENOSYS, 'inotify not available')
+        super(INotifyWatch, self).__init__(paths, callback, poll)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise self._error()
+        self._dirs = {}
+        try:
+            for path in self.paths:
+                directory, name = os.path.split(path)
+                if directory in self._dirs.values():
+                    continue
+                wd = self._libc.inotify_add_watch(self._fd, directory, self.mask)
+                if wd < 0:
+                    raise self._error(directory)
+                self._dirs[wd] = directory
+        except Exception:
+            self.close()
+            raise
+
+    def changes(self):
+        try:
+            readable, _, _ = select.select([self._fd], [], [], self.poll)
+        except select.error, ex:
+            if ex.args[0] != errno.EINTR:
+                raise
+            return []
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError, ex:
+            if ex.errno not in (errno.EAGAIN, errno.EINTR):
+                raise
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.event.unpack_from(data, offset)
+            offset += self.event.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            if name:
+                path = os.path.join(directory, name)
+                if path in self.paths and path not in changed:
+                    changed.append(path)
+            else:
+                # NOTE: directory itself changed, assume all its files did.
+                for path in self.paths:
+                    if os.path.dirname(path) == directory and path not in changed:
+                        changed.append(path)
+        return changed
+
+    # internals
+
+    def close(self):
+        fd, self._fd = getattr(self, '_fd', None), None
+        if fd is not None and fd >= 0:
+            os.close(fd)
+
+    def _error(self, path=None):
+        code = ctypes.get_errno()
+        if path is None:
+            return OSError(code, os.strerror(code))
+        return OSError(code, os.strerror(code), path)
@@ -15,7 +15,6 @@ import errno
 import logging
 import netaddr
 import os
-import pprint
 import socket
 import StringIO
 import threading
@@ -38,21 +37,90 @@ logger = logging.getLogger(__name__)
 tracer = ohmr.Tracer(coid.Id(prefix='ohm-', encoding='base58'))
 
 
-class Request(pilo.Form):
+class Request(rump.Request):
+    """
+    WSGI request used for routing and communicating a selection. It **is** a
+    ``rump.Request`` so fields it shares with a router's request type (e.g.
+    `host`, `path`) are only resolved once, see `Request.for_router`.
+    """
 
-    def __init__(self, environ, id_header):
-        super(Request, self).__init__()
+    def __init__(self, environ, id_header, router=None):
+        super(Request, self).__init__(environ, router)
         self.environ = environ
-        self.src = pilo.source.DefaultSource(environ)
+        self.id_header_name = id_header
         self.id_header = 'HTTP_' + id_header.upper().replace('-', '_')
 
-    host = pilo.fields.String('HTTP_HOST')
+    _layered = {}
+
+    @classmethod
+    def layer(cls, request_type):
+        """
+        Creates a type with these fields layered over those of `request_type`.
+        If any of these fields conflict (by name) with those of
+        `request_type` then `request_type` itself is returned.
+
+        :param request_type: Request type (e.g. ``Router.request_type``).
+
+        :return: The (cached) layered type.
+        """
+        key = (cls, request_type)
+        layered = cls._layered.get(key)
+        if layered is None:
+            names = set(field.name for field in cls.fields).difference(
+                field.name for field in rump.Request.fields
+            )
+            conflicts = names.intersection(
+                field.name for field in request_type.fields
+            )
+            if conflicts:
+                logger.warning(
+                    '%s fields %s conflict with %s, not layering',
+                    request_type, sorted(conflicts), cls,
+                )
+                layered = request_type
+            else:
+                layered = type(request_type.__name__, (cls, request_type), {})
+            cls._layered[key] = layered
+        return layered
+
+    @property
+    def request_line(self):
+        """
+        Short description of this request (e.g. "GET example.com/a?b=c") for
+        messages. It is taken directly from the environment so no fields are
+        resolved.
+        """
+        line = '{0} {1}{2}'.format(
+            self.environ.get('REQUEST_METHOD', ''),
+            self.environ.get('HTTP_HOST', ''),
+            self.environ.get('PATH_INFO', ''),
+        )
+        if self.environ.get('QUERY_STRING'):
+            line += '?' + self.environ['QUERY_STRING']
+        return line
 
-    method = pilo.fields.String('REQUEST_METHOD')
+    def for_router(self, router):
+        """
+        Gets this request as an instance of `router`'s request type, sharing
+        any already resolved fields. If this request already is one it is
+        returned as is.
 
-    path = pilo.fields.String('PATH_INFO')
+        :param router: The ``rump.Router`` that will evaluate the request.
 
-    query_string = pilo.fields.String('QUERY_STRING')
+        :return: Instance of ``Router.request_type``.
+        """
+        if isinstance(self, router.request_type):
+            self.router = router
+            return self
+        request_type = self.layer(router.request_type)
+        if issubclass(request_type, Request):
+            request = request_type(self.environ, self.id_header_name, router)
+        else:
+            request = request_type(self.environ, router)
+        for name, value in self.iteritems():
+            if getattr(request_type, name, None) is getattr(type(self), name):
+                request[name] = value
+        return request
 
     id = pilo.fields.String(default=lambda: tracer.id)
 
@@ -126,9 +194,15 @@ class Settings(pilo.Form):
 
     def from_file(self, path):
         logger.info('loading settings from %s', path)
+        path = os.path.abspath(path)
+        settings = rump.Settings.from_file(path, 'rump')
         src = pilo.source.union([
             pilo.source.ConfigSource.from_file(path, 'rump:wsgi'),
-            {'routers': rump.Settings.from_file(path, 'rump').routers},
+            {
+                'routers': settings.routers,
+                'file_path': path,
+                'files': settings.files(),
+            },
             self,
         ])
         settings = type(self)(src)
@@ -157,6 +231,56 @@ class Settings(pilo.Form):
     #: Path to health file.
     health_file = pilo.fields.String(default=None)
 
+    #: Whether selections respond w/ only the headers needed by the proxy
+    #: (i.e. X-Accel-Redirect and X-Rump-Redir-*). The id header is only
+    #: included if the request has one.
+    lean = pilo.fields.Boolean(default=False)
+
+    #: Path readiness is exposed @ (e.g. /ready), see `ready`. None to not
+    #: expose it, so requests for it are selected like any other.
+    ready_path = pilo.fields.String(default=None)
+
+    #: Whether to record selection metrics, see `metrics_path`.
+    metrics = pilo.fields.Boolean(default=False)
+
+    #: Path selection metrics are exposed @ (e.g. /metrics), see `metrics`.
+    #: None to not expose them, so requests for it are selected like any
+    #: other.
+    metrics_path = pilo.fields.String(default=None)
+
+    #: Path to file selection traces are appended to, see ``rump.trace``.
+    trace_file = pilo.fields.String(default=None)
+
+    #: Fraction (0 - 1) of selections to trace.
+    trace_rate = pilo.fields.Float(default=1.0)
+
+    #: Maximum number of selection traces buffered before dropping them.
+    trace_size = pilo.fields.Integer(default=4096)
+
+    #: Number of threads reloading changed dynamic routers.
+    reload_workers = pilo.fields.Integer(default=1, min_value=1)
+
+    #: Whether to log a full dump of each reloaded router.
+    dump_reloads = pilo.fields.Boolean(default=False)
+
+    #: Directory dynamic routers are snapshotted to after loading and
+    #: restored from on setup, see ``rump.snapshot``. None disables snapshots.
+    #: Must only be writable by trusted users.
+    snapshot_dir = pilo.fields.String(default=None)
+
+    #: Seconds after which a snapshot is too old to restore, or None.
+    snapshot_max_age = pilo.fields.Float(default=None)
+
+    #: Whether to reload routers when the settings file, or a file it
+    #: includes, changes. See ``_Application.files_changed``.
+    reload_files = pilo.fields.Boolean(default=False)
+
+    #: Path of the settings file these were loaded from, see `from_file`.
+    file_path = pilo.fields.String(default=None)
+
+    #: Paths of the files routers were loaded from, see `from_file`.
+    files = pilo.fields.List(pilo.fields.String(), default=list)
+
     #: List of routers.
     routers = pilo.fields.List(pilo.fields.SubForm(rump.Router), default=list)
 
@@ -177,56 +301,433 @@ class Settings(pilo.Form):
         return netaddr.IPNetwork(value)
 
 
-class _Application(threading.local):
+class Health(object):
+    """
+    Cached health file status. The file is read once and then re-read only
+    when a `rump.watch.Watch` sees it change so probes never touch the disk.
+    """
 
-    #: Global name of this host.
-    host = socket.gethostname()
+    def __init__(self, poll=1.0):
+        self.poll = poll
+        self.path = None
+        #: Cached ``(status, body)``.
+        self.response = ('200 OK', '')
+        self._watch = None
+        self._lock = threading.Lock()
 
-    #: Global settings.
-    settings = Settings()
+    def __call__(self, path):
+        """
+        Gets cached ``(status, body)`` for health file `path`, (re)starting
+        the watch if `path` changed or the watch died (e.g. after a fork).
+        """
+        if self._stale(path):
+            with self._lock:
+                if self._stale(path):
+                    self._restart(path)
+        return self.response
+
+    def watch(self, path):
+        with self._lock:
+            self._restart(path)
+
+    def stop(self):
+        watch, self._watch = self._watch, None
+        if watch is not None:
+            watch.stop()
+
+    def refresh(self):
+        if not self.path:
+            self.response = ('200 OK', '')
+            return
+        try:
+            with open(self.path, 'r') as fo:
+                body = fo.read()
+            status = '200 OK'
+        except IOError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            body = 'down'
+            status = '503 Service Unavailable'
+        logger.info('health %s is %s', self.path, status)
+        self.response = (status, body)
+
+    # internals
+
+    def _stale(self, path):
+        watch = self._watch
+        return path != self.path or (watch is not None and not watch.is_alive())
+
+    def _restart(self, path):
+        self.stop()
+        self.path = path
+        if path:
+            self._watch = rump.watch.watch(
+                [path], lambda paths: self.refresh(), self.poll,
+            )
+        self.refresh()
 
-    #: Local WSGI environment for request being handled now.
-    environ = None
 
-    #: Local wrapper for request being handled now.
-    request = None
+class _Application(object):
+    """
+    The WSGI application. It holds no per-request state, instead each request
+    is represented by a `Request` explicitly passed to the handlers (e.g.
+    `select`), so it can be called from threads, processes or an event loop.
+    """
+
+    #: Maximum number of servers to cache response headers for.
+    server_headers_limit = 1024
+
+    #: Seconds teardown waits for restored routers to finish reconciling.
+    reconcile_timeout = 5.0
+
+    #: Seconds between checks for changed settings files, see
+    #: `Settings.reload_files`.
+    files_poll = 1.0
+
+    def __init__(self, settings=None, host=None):
+        #: Global settings.
+        self.settings = Settings() if settings is None else settings
+        #: Global name of this host.
+        self.host = socket.gethostname() if host is None else host
+        #: Cached health file status.
+        self.health = Health()
+        #: Names of dynamic routers loaded from their dynamic.
+        self.loaded = set()
+        #: Selection metrics, see `Settings.metrics`.
+        self.metrics = rump.metrics.SelectionMetrics()
+        #: Reloads changed dynamic routers, see `setup`.
+        self.reloader = None
+        #: Snapshot stamps of dynamic routers restored but not yet connected.
+        self.restored = {}
+        self._reconciler = None
+        self._files_watch = None
+        self._files_callback = None
+        self._files_lock = threading.Lock()
+        #: Settings file paths to the names of the routers in them.
+        self._sources = {}
+        self._server_headers = {}
+        self._tracer = None
+
+    def setup(self, callback=None, files_callback=None):
+        """
+        Connects, loads and watches dynamic routers. Changes are reloaded by
+        `callback` (`changed` by default) from `reloader` threads rather
+        than the dynamic's notification thread.
 
-    def setup(self):
+        If `Settings.snapshot_dir` is set dynamic routers are restored from
+        their snapshots instead, and then connected, reconciled and watched
+        in the background.
+
+        If `Settings.reload_files` is set the settings files are watched and
+        changes handled by `files_callback` (`files_changed` by default).
+        """
         logger.info('setup')
+        self.health.watch(self.settings.health_file)
+        self.reloader = rump.reloader.Reloader(
+            callback or self.changed, self.settings.reload_workers,
+        )
+        self.reloader.start()
+        if self.settings.reload_files and self.settings.file_path:
+            self.watch_files(files_callback)
+        restored = []
         for router in self.settings.routers:
-            if router.is_dynamic:
-                logger.info('connecting %s', router.name)
-                router.connect()
-                router.watch(self.changed)
+            if not router.is_dynamic:
+                continue
+            if self.restore(router):
+                restored.append(router)
+                continue
+            logger.info('connecting %s', router.name)
+            router.connect()
+            try:
+                self.load(router)
+            except Exception, ex:
+                logger.exception('%s load failed - %s', router.name, ex)
+            router.watch(self.reloader.enqueue)
+        if restored:
+            self._reconciler = threading.Thread(
+                target=self._reconcile, args=(restored,), name='rump-reconcile',
+            )
+            self._reconciler.daemon = True
+            self._reconciler.start()
 
     def teardown(self):
         logger.info('teardown')
+        reconciler, self._reconciler = self._reconciler, None
+        if reconciler is not None:
+            reconciler.join(self.reconcile_timeout)
+        self.restored.clear()
+        self.health.stop()
+        files_watch, self._files_watch = self._files_watch, None
+        if files_watch is not None:
+            files_watch.stop()
+        if self.reloader is not None:
+            self.reloader.stop()
+            self.reloader = None
+        if self._tracer is not None:
+            self._tracer.stop()
+            self._tracer = None
         for router in self.settings.routers:
             if router.is_connected:
                 logger.info('disconnecting %s', router.name)
                 router.disconnect()
+            self.loaded.discard(router.name)
 
     def changed(self, router):
         logger.info('%s changed, reloading ...', router.name)
-        router.load()
-        logger.info('%s', rump.dumps(router))
+        if self.load(router) is False:
+            logger.info('%s unchanged', router.name)
+            return False
+        if self.settings.dump_reloads:
+            logger.info('%s reloaded\n%s', router.name, rump.dumps(router))
+        else:
+            logger.info('%s reloaded', router.name)
+        return True
+
+    def watch_files(self, callback=None):
+        """
+        (Re)starts watching `Settings.file_path` and the files it includes
+        for changes.
+
+        :param callback: Called w/ the changed paths, `files_changed` by
+                         default. Should call `files_changed`.
+        """
+        self._files_callback = callback or self.files_changed
+        paths = [self.settings.file_path] + [
+            path for path in self.settings.files
+            if path != self.settings.file_path
+        ]
+        self._sources = dict(
+            (path, rump.settings.router_names(path, main='rump'))
+            for path in paths
+        )
+        if self._files_watch is not None:
+            self._files_watch.stop()
+        logger.info('watching %s', paths)
+        self._files_watch = rump.watch.watch(
+            paths, self._files_callback, self.files_poll,
+        )
+
+    def files_changed(self, paths):
+        """
+        Reloads routers from settings files `paths` that changed. Only the
+        routers in those files are rebuilt, unless `Settings.file_path` is
+        one of them in which case all are, and then swapped in at once. If
+        rebuilding fails (e.g. a rule does not parse) the current routers are
+        kept.
 
-    def router_for(self, request=None):
-        request = self.request if request is None else request
+        Files should be replaced atomically (e.g. written elsewhere and then
+        renamed over) otherwise a partially written one may be loaded. Note
+        that only routers are reloaded, other settings (e.g. `Settings.lean`)
+        still require a restart.
+
+        :param paths: Paths of changed settings files.
+
+        :return: True if routers were swapped in, otherwise False.
+        """
+        with self._files_lock:
+            file_path = self.settings.file_path
+            names = None
+            if file_path not in paths:
+                # NOTE: those it had and those it has
+                names = set()
+                for path in paths:
+                    names.update(self._sources.get(path, []))
+                    names.update(rump.settings.router_names(path, main='rump'))
+                if not names:
+                    logger.info('no routers in changed %s', paths)
+                    return False
+            logger.info(
+                '%s changed, reloading %s ...',
+                paths, 'all routers' if names is None else sorted(names),
+            )
+            try:
+                settings = rump.Settings.from_file(
+                    file_path, 'rump', names=None if names is None else sorted(names),
+                )
+                routers, files = settings.routers, settings.files()
+                self._connect(routers)
+            except Exception, ex:
+                logger.exception(
+                    'reloading %s failed, keeping current routers - %s',
+                    paths, ex,
+                )
+                return False
+            current = self.settings.routers
+            if names is None:
+                names = set(router.name for router in current)
+            kept = [router for router in current if router.name not in names]
+            self.settings.routers = sorted(
+                kept + routers, key=lambda router: router.name
+            )
+            rewatch = set(files) != set(self.settings.files)
+            self.settings.files = files
+            for path in paths:
+                self._sources[path] = rump.settings.router_names(
+                    path, main='rump',
+                )
+            reloaded = set(router.name for router in routers)
+            for router in current:
+                if router.name not in names:
+                    continue
+                if router.is_connected:
+                    logger.info('disconnecting %s', router.name)
+                    router.disconnect()
+                if router.name not in reloaded:
+                    self.loaded.discard(router.name)
+            logger.info('reloaded %s', sorted(reloaded))
+        if rewatch and self._files_watch is not None:
+            # NOTE: e.g. an include glob now matches another file
+            self.watch_files(self._files_callback)
+        return True
+
+    def _connect(self, routers):
+        connected = []
+        try:
+            for router in routers:
+                if not router.is_dynamic:
+                    continue
+                logger.info('connecting %s', router.name)
+                router.connect()
+                connected.append(router)
+                try:
+                    self.load(router)
+                except Exception, ex:
+                    logger.exception('%s load failed - %s', router.name, ex)
+                if self.reloader is not None:
+                    router.watch(self.reloader.enqueue)
+        except Exception:
+            for router in connected:
+                router.disconnect()
+            raise
+
+    def load(self, router):
+        loaded = router.load()
+        self.loaded.add(router.name)
+        if loaded is not False and self.settings.snapshot_dir:
+            try:
+                self.snapshot(router).save(router)
+            except Exception, ex:
+                logger.exception('%s snapshot failed - %s', router.name, ex)
+        return loaded
+
+    def snapshot(self, router):
+        return rump.snapshot.Snapshot.for_router(self.settings.snapshot_dir, router)
+
+    def restore(self, router):
+        """
+        Restores `router` from its snapshot, if `Settings.snapshot_dir` is set
+        and it has a fresh one.
+
+        :return: True if restored, otherwise False.
+        """
+        if not self.settings.snapshot_dir:
+            return False
+        try:
+            stamps = self.snapshot(router).restore(
+                router, self.settings.snapshot_max_age,
+            )
+        except Exception, ex:
+            logger.exception('%s restore failed - %s', router.name, ex)
+            return False
+        if stamps is None:
+            return False
+        self.restored[router.name] = stamps['stamp']
+        self.loaded.add(router.name)
+        return True
+
+    def _reconcile(self, routers):
+        for router in routers:
+            if self._reconciler is not threading.current_thread():
+                break
+            try:
+                logger.info('connecting %s', router.name)
+                router.connect()
+                router.dynamic.restamp(router, self.restored.pop(router.name, None))
+                # NOTE: watch first so changes made while loading are not
+                # missed, then load, but only if changed since the snapshot
+                router.watch(self.reloader.enqueue)
+                self.reloader.enqueue(router)
+            except Exception, ex:
+                logger.exception('%s reconcile failed - %s', router.name, ex)
+
+    def unready(self):
+        """
+        Reasons this instance is not ready to serve selections, i.e. dynamic
+        routers that are disconnected or have not loaded. Only in-memory
+        state is consulted.
+
+        :return: List of reasons, empty if ready.
+        """
+        if not self.settings.routers:
+            return ['no routers']
+        reasons = []
+        for router in self.settings.routers:
+            if router.dynamic is None:
+                continue
+            if not router.is_connected and router.name not in self.restored:
+                reasons.append('{0} disconnected'.format(router.name))
+            elif router.name not in self.loaded:
+                reasons.append('{0} not loaded'.format(router.name))
+        return reasons
+
+    @property
+    def tracer(self):
+        """
+        The ``rump.trace.Tracer`` for `Settings.trace_file`, or None if
+        selections are not traced.
+        """
+        path = self.settings.trace_file
+        if path is None:
+            return None
+        tracer = self._tracer
+        if tracer is None or tracer.path != path:
+            if tracer is not None:
+                tracer.stop()
+            tracer = self._tracer = rump.trace.Tracer(
+                path, self.settings.trace_rate, self.settings.trace_size,
+            )
+        return tracer
+
+    def server_headers(self, server):
+        """
+        Headers identifying the selected `server` to the proxy. These are
+        cached per server.
+        """
+        headers = self._server_headers.get(server)
+        if headers is None:
+            if len(self._server_headers) >= self.server_headers_limit:
+                self._server_headers.clear()
+            headers = (
+                ('X-Rump-Redir-Proto', server.protocol),
+                ('X-Rump-Redir-Host', server.location),
+            )
+            self._server_headers[server] = headers
+        return headers
+
+    def router_for(self, request):
         for router in self.settings.routers:
             if router.match_me(request):
                 return router
 
+    def request_for(self, environ):
+        """
+        Creates the `Request` used to handle `environ`.
+        """
+        return Request(environ, self.settings.id_header)
+
     def __call__(self, environ, start_response):
-        self.environ = environ
-        self.request = Request(environ, self.settings.id_header)
+        request = self.request_for(environ)
         try:
-            if self.request.path == '/health':
-                status, headers, body = health()
-            elif self.request.path == '/boom':
-                status, headers, body = boom()
+            if request.path == '/health':
+                status, headers, body = health(self, request)
+            elif request.path == self.settings.ready_path:
+                status, headers, body = ready(self, request)
+            elif request.path == self.settings.metrics_path:
+                status, headers, body = metrics(self, request)
+            elif request.path == '/boom':
+                status, headers, body = boom(self, request)
             else:
-                status, headers, body = select()
+                status, headers, body = select(self, request)
         except (SystemExit, KeyboardInterrupt):
             raise
         except Exception, ex:
@@ -237,85 +738,131 @@ class _Application(threading.local):
                 ('Content-Type', 'text/plain'),
                 ('Content-Length', str(len(body))),
             ]
-        headers.append((self.settings.id_header, self.request.id.encode('utf-8')))
-        headers.append(('X-Rump-Version', rump.__version__))
+        if not self.settings.lean:
+            headers.append((self.settings.id_header, request.id.encode('utf-8')))
+            headers.append(('X-Rump-Version', rump.__version__))
+        elif request.id_header in environ:
+            headers.append((self.settings.id_header, environ[request.id_header]))
         start_response(status, headers)
-        self.request = None
         return body
 
 
 app = _Application()
 
 
-def health():
+def health(app, request):
     """
     Indicates whether this instance is up (status 200) not (status 503).
     """
+    status, body = app.health(app.settings.health_file)
     headers = [
         ('Content-Type', 'text/plain'),
+        ('Content-Length', str(len(body))),
     ]
-    if app.settings.health_file:
-        try:
-            with open(app.settings.health_file, 'r') as fo:
-                body = fo.read()
-            status = '200 OK'
-        except IOError, ex:
-            if ex.errno != errno.ENOENT:
-                raise
-            body = 'down'
-            status = '503 Service Unavailable'
+    return status, headers, [body]
+
+
+def ready(app, request):
+    """
+    Indicates whether this instance is ready (status 200) to select, i.e. its
+    dynamic routers are connected and loaded, or not (status 503).
+    """
+    reasons = app.unready()
+    if reasons:
+        status = '503 Service Unavailable'
+        body = '\n'.join(reasons)
     else:
         status = '200 OK'
-        body = ''
-    headers.append(('Content-Length', str(len(body))))
+        body = 'ready'
+    headers = [
+        ('Content-Type', 'text/plain'),
+        ('Content-Length', str(len(body))),
+    ]
     return status, headers, [body]
 
 
-def boom():
+def metrics(app, request):
+    """
+    Exposes selection metrics in the Prometheus text format.
+    """
+    body = app.metrics.dumps()
+    headers = [
+        ('Content-Type', 'text/plain; version=0.0.4'),
+        ('Content-Length', str(len(body))),
+    ]
+    return '200 OK', headers, [body]
+
+
+def boom(app, request):
     """
     Used to test error/exception side-effects (e.g. logging, alerting, etc).
     """
     raise NameError("name 'ka' is not defined")
 
 
-def select():
+def select(app, request):
     """
     Selects upstream.
     """
+    metrics = app.metrics if app.settings.metrics else None
+    tracer = app.tracer
+    record = tracer.begin(request) if tracer is not None else None
+    started_at = rump.metrics.timer()
+
     # select server
-    router = app.router_for(app.request)
+    router = app.router_for(request)
     if not router:
-        raise Exception(
-            'No router for request:\n{0}'
-            .format(pprint.pformat(app.environ))
-        )
-    request = router.request_type(app.environ, router)
-    upstream = router.match_upstream(request)
-    if upstream is None:
-        upstream = app.request.default_upstream or router.default_upstream
-    server = upstream() if upstream else None
+        if metrics is not None:
+            metrics.no_router.inc()
+        if record is not None:
+            tracer.end(record, None, request, error='no router')
+        raise Exception('No router for request {0}'.format(request.request_line))
+    if metrics is not None:
+        metrics.requests.inc((router.name,))
+    routed, upstream = request, None
+    try:
+        routed = request.for_router(router)
+        upstream = router.match_upstream(routed, metrics, record)
+        if upstream is None:
+            upstream = request.default_upstream or router.default_upstream
+        server = upstream() if upstream else None
+    except Exception, ex:
+        if metrics is not None:
+            metrics.errors.inc((router.name,))
+        if record is not None:
+            tracer.end(record, router, routed, upstream, error=ex)
+        raise
     if not server:
+        if metrics is not None:
+            metrics.no_upstream.inc((router.name,))
+        if record is not None:
+            tracer.end(record, router, routed, upstream, error='no upstream')
         raise Exception(
-            'No upstream for request:\n{0}\nand router:\n{1}'
-            .format(pprint.pformat(app.environ), pprint.pformat(router))
+            'No upstream for request {0} and router {1}'
+            .format(request.request_line, router.name)
         )
+    if metrics is not None:
+        metrics.selected(router, server, rump.metrics.timer() - started_at)
+    if record is not None:
+        tracer.end(record, router, routed, upstream, server)
 
     # communicate selection
-    status, headers, body = x_accel(server)
+    status, headers, body = x_accel(app, request, server)
+    headers.extend(app.server_headers(server))
+    if app.settings.lean:
+        return status, headers, body
 
     # x-forward-for
     forwards = '{0}://{1}'.format(server.protocol, server.location)
-    if app.request.forwards:
-        forwards = app.request.forwards + ', ' + forwards
+    if request.forwards:
+        forwards = request.forwards + ', ' + forwards
 
     # x-rump-host
     hosts = app.host
-    if app.request.hosts:
-        hosts = app.request.hosts + ', ' + hosts
+    if request.hosts:
+        hosts = request.hosts + ', ' + hosts
 
     headers.extend([
-       ('X-Rump-Redir-Proto', server.protocol),
-       ('X-Rump-Redir-Host', server.location),
        ('X-Rump-Forward', forwards),
        ('X-Rump-Host', hosts),
     ])
@@ -323,19 +870,19 @@ def select():
     return status, headers, body
 
 
-def x_accel(server):
+def x_accel(app, request, server):
     """
     Constructs X-Accel internal-redirect response for the selected server.
     """
     status = '200 OK'
     headers = []
-    path = app.request.path
+    path = request.path
     if not path.startswith('/'):
         path = '/' + path
-    if app.request.query_string:
-        path += '?' + app.request.query_string
-    redirect = app.request.redirect_prefix + path
-    if not app.request.echo:
+    if request.query_string:
+        path += '?' + request.query_string
+    redirect = request.redirect_prefix + path
+    if not request.echo:
         headers.append(('X-Accel-Redirect', redirect))
         body = []
     else:
@@ -0,0 +1,82 @@
+import pytest
+
+from rump import analysis, parser, Router, Request
+
+
+@pytest.fixture
+def parse_match():
+    return parser.for_match(Request)
+
+
+def test_implies(parse_match):
+    cases = [
+        ('path startswith "/a/b"', 'path startswith "/a"', True),
+        ('path startswith "/a"', 'path startswith "/a/b"', False),
+        ('path = "/a/b"', 'path startswith "/a"', True),
+        ('path endswith ".json"', 'path endswith "json"', True),
+        ('method in ["GET", "HEAD"]', 'method in ["GET", "HEAD", "POST"]', True),
+        ('method in ["GET", "PUT"]', 'method in ["GET", "HEAD", "POST"]', False),
+        ('method = "GET"', 'method in ["GET", "HEAD"]', True),
+        ('method = "GET"', 'method != "POST"', True),
+        ('content_length > 10', 'content_length >= 5', True),
+        ('content_length >= 10', 'content_length > 10', False),
+        ('content_length < 5', 'content_length <= 10', True),
+        ('path startswith "/a" and method = "GET"', 'path startswith "/a"', True),
+        ('path startswith "/a"', 'path startswith "/a" and method = "GET"', False),
+        ('path startswith "/a" or path startswith "/ab"', 'path startswith "/a"', True),
+        ('path startswith "/a"', 'path startswith "/b" or path startswith "/a"', True),
+        ('path startswith "/a"', 'query_string startswith "/a"', False),
+        ('not path startswith "/a/b"', 'path startswith "/a"', False),
+    ]
+    for expression, other, expected in cases:
+        assert analysis.implies(
+            parse_match(expression), parse_match(other)
+        ) is expected, (expression, other)
+
+
+def test_shadowed():
+    router = Router(
+        name='one',
+        rules=[
+            'path startswith "/a" => http://a',
+            'method in ["GET", "POST", "PUT"] => http://b',
+            'path startswith "/a/b" => http://ab',
+            'method in ["GET", "POST"] and path = "/c" => http://c',
+            'path startswith "/d" => http://d',
+        ],
+    )
+    assert analysis.shadowed(router.rules) == [(2, 0), (3, 1)]
+
+
+def test_analysis():
+    router = Router(
+        name='one',
+        default_upstream='http://default',
+        rules=[
+            'path startswith "/a" => http://a',
+            'path startswith "/a/b" => http://ab',
+            'method = POST => http://post',
+        ],
+    )
+    a = analysis.Analysis(router)
+    for environ in [
+            {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/a/b'},
+            {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/a'},
+            {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/c'},
+        ]:
+        a.evaluate(Request(environ))
+    assert a.requests == 3
+    assert a.misses == 1
+    assert a.hits('rules') == [2, 0, 0]
+    assert a.hits('overrides') == []
+    assert a.reports().splitlines() == [
+        'router one - 3 request(s), 1 matched no rule',
+        '',
+        '    hits  rules',
+        '       2  [0] path startswith "/a" => http://a,1',
+        '       0  [1] path startswith "/a/b" => http://ab,1  '
+        '# never hit, shadowed by [0]',
+        '       0  [2] method = "POST" => http://post,1  # never hit',
+        '',
+        '2 never hit, 1 shadowed',
+    ]
@@ -115,6 +115,46 @@ def test_eval(capsys, tmpdir, parser, requests_path):
     ])
 
 
+def test_profile(capsys, tmpdir, parser, requests_path):
+    requests = tmpdir.join('requests.http')
+    for request_path in requests_path.listdir():
+        requests.write(request_path.read(), ensure=True)
+    args = parser.parse_args(['profile', '-r', str(requests), '-n', '3'])
+    cli.setup(args)
+    args.command(args)
+    out, _ = capsys.readouterr()
+    lines = out.splitlines()
+    assert lines[0].split() == [
+        'total(ms)', 'evals', 'hits', 'mean(us)', 'max(us)', 'rule'
+    ]
+    assert lines[1].split()[1:3] == ['3', '3']
+    assert lines[1].endswith(
+        'router3.rules[0] google in host => http://dev.google.com,1'
+    )
+    assert lines[-1].split()[1] == '3'
+    assert lines[-1].endswith('host')
+
+
+def test_analyze(capsys, tmpdir, parser, requests_path):
+    requests = tmpdir.join('requests.http')
+    for request_path in requests_path.listdir():
+        requests.write(request_path.read(), ensure=True)
+    args = parser.parse_args(['analyze', 'router3', '-r', str(requests)])
+    cli.setup(args)
+    args.command(args)
+    out, _ = capsys.readouterr()
+    assert out.splitlines() == [
+        'router router3 - 1 request(s), 0 matched no rule',
+        '',
+        '    hits  rules',
+        '       1  [0] google in host => http://dev.google.com,1',
+        '       0  [1] yahoo in host => http://dev.yahoo.com,1  # never hit',
+        '       0  [2] bing in host => http://dev.bing.com,1  # never hit',
+        '',
+        '2 never hit, 0 shadowed',
+    ]
+
+
 def test_serve(parser, settings):
 
     def _serve():
@@ -167,3 +207,32 @@ def test_serve(parser, settings):
     finally:
         server.shutdown()
         thd.join()
+
+
+def test_eval_trace(capsys, tmpdir, parser, requests_path):
+    requests = tmpdir.join('requests.http')
+    for request_path in requests_path.listdir():
+        requests.write(request_path.read(), ensure=True)
+    trace = tmpdir.join('trace.log')
+    args = parser.parse_args(['eval', '-r', str(requests), '-t', str(trace)])
+    cli.setup(args)
+    args.command(args)
+    records = [json.loads(line) for line in trace.readlines()]
+    assert [record['server'] for record in records] == [
+        'https://www.google.com',
+        'https://www.yahoo.com',
+        'http://dev.google.com',
+    ]
+    assert (records[-1]['rules'], records[-1]['index']) == ('rules', 0)
+    assert records[-1]['fields'] == {'host': 'dev.google.com'}
+
+
+def test_compile(capsys, tmpdir, parser):
+    path = tmpdir.join('rump.compiled')
+    args = parser.parse_args(['compile', '-o', str(path)])
+    cli.setup(args)
+    rc = args.command(args)
+    assert rc == 0
+    out, err = capsys.readouterr()
+    assert out == str(path) + '\n'
+    assert path.check(file=1)
@@ -0,0 +1,415 @@
+import threading
+import time
+
+import etcd
+import mock
+import pytest
+import urllib3
+
+from rump import dumps, Router
+
+
+class FakeServer(object):
+    """
+    In-memory stand-in for an etcd server. Keys are stored flat, directories
+    are implied by their keys.
+    """
+
+    def __init__(self, history=100):
+        self.nodes = {}
+        self.events = []
+        self.history = history
+        self.index = 1
+        self.commands = []
+        self.changed = threading.Condition()
+
+    def result(self, action, node):
+        result = etcd.EtcdResult(action=action, node=dict(node))
+        result.etcd_index = self.index
+        return result
+
+    def tree(self, key):
+        prefix = key.rstrip('/') + '/'
+        nodes = {}
+        for name, node in self.nodes.iteritems():
+            if not name.startswith(prefix):
+                continue
+            child = name[len(prefix):].split('/', 1)[0]
+            nodes[prefix + child] = (
+                node if name == prefix + child else self.tree(prefix + child)
+            )
+        return {
+            'key': key,
+            'dir': True,
+            'nodes': [nodes[name] for name in sorted(nodes)],
+        }
+
+    def read(self, key, recursive=False):
+        self.commands.append(('read', key))
+        with self.changed:
+            node = self.nodes.get(key)
+            if node is None:
+                node = self.tree(key)
+                if not node['nodes']:
+                    raise etcd.EtcdKeyNotFound('Key not found : {0}'.format(key))
+                if not recursive:
+                    node['nodes'] = [
+                        dict(child, nodes=[]) for child in node['nodes']
+                    ]
+            return self.result('get', node)
+
+    def event(self, action, node):
+        self.events.append((action, node))
+        del self.events[:-self.history]
+        self.changed.notify_all()
+        return self.result(action, node)
+
+    def write(self, key, value):
+        self.commands.append(('write', key))
+        with self.changed:
+            self.index += 1
+            node = self.nodes[key] = {
+                'key': key, 'value': value, 'modifiedIndex': self.index,
+            }
+            return self.event('set', node)
+
+    def delete(self, key):
+        self.commands.append(('delete', key))
+        with self.changed:
+            if key not in self.nodes:
+                raise etcd.EtcdKeyNotFound('Key not found : {0}'.format(key))
+            self.index += 1
+            del self.nodes[key]
+            return self.event(
+                'delete', {'key': key, 'modifiedIndex': self.index},
+            )
+
+    def watch(self, key, index=None, timeout=None, recursive=False):
+        self.commands.append(('watch', key, index))
+        expires_at = time.time() + (timeout or 0.05)
+        prefix = key.rstrip('/') + '/'
+        with self.changed:
+            if index is None:
+                index = self.index + 1
+            if self.events and index < self.events[0][1]['modifiedIndex']:
+                raise etcd.EtcdEventIndexCleared('The event in requested index is outdated and cleared')
+            while True:
+                for action, node in self.events:
+                    if node['modifiedIndex'] < index:
+                        continue
+                    if (node['key'] == key or
+                            recursive and node['key'].startswith(prefix)):
+                        return self.result(action, node)
+                remaining = expires_at - time.time()
+                if remaining <= 0:
+                    raise urllib3.exceptions.ReadTimeoutError(None, None, 'Read timed out.')
+                self.changed.wait(remaining)
+
+
+class FakeClient(object):
+
+    def __init__(self, server, **kwargs):
+        self.server = server
+
+    def read(self, key, recursive=False, **kwargs):
+        return self.server.read(key, recursive)
+
+    def write(self, key, value, **kwargs):
+        return self.server.write(key, value)
+
+    def delete(self, key, **kwargs):
+        return self.server.delete(key)
+
+    def watch(self, key, index=None, timeout=None, recursive=None):
+        return self.server.watch(key, index, timeout, recursive)
+
+
+@pytest.fixture
+def server(request):
+    server = FakeServer()
+    patch = mock.patch(
+        'etcd.Client', lambda **kwargs: FakeClient(server, **kwargs),
+    )
+    patch.start()
+    request.addfinalizer(patch.stop)
+    return server
+
+
+def router(**dynamic):
+    return Router(
+        name='test',
+        compile_rules=True,
+        default_upstream='http://me',
+        dynamic=dict({
+            '_type_': 'etcd',
+            'key': '/rump/test',
+            'watch_retry': 0.01,
+        }, **dynamic),
+        rules=[
+            'client_ip4 in 1.2.3.4/32 => prod',
+        ],
+    )
+
+
+def watched(request, callback, **dynamic):
+    watcher = router(**dynamic)
+    watcher.connect()
+    request.addfinalizer(watcher.disconnect)
+    watcher.load()
+    watcher.watch(callback)
+    return watcher
+
+
+def test_load_unchanged(server):
+    saver = router()
+    with saver.connect():
+        saver.compile_rules = False
+        saver.save()
+
+    loader = router()
+    with loader.connect():
+        assert loader.load() is True
+        assert not loader.compile_rules
+        assert loader.dynamic.index == server.index
+        assert loader.load() is False
+
+
+def test_restamp_watch(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.load())
+
+    saver = router()
+    saver.connect()
+    request.addfinalizer(saver.disconnect)
+    saver.save()
+
+    restored = router()
+    restored.connect()
+    request.addfinalizer(restored.disconnect)
+    restored.dynamic.restamp(restored, server.index)
+    assert restored.load() is False
+    # NOTE: between the read and the watch
+    saver.default_upstream = 'http://other'
+    saver.save()
+    restored.watch(_notify)
+    time.sleep(0.2)
+    assert notifications == [True]
+    assert str(restored.default_upstream) == 'http://other,1'
+
+
+def test_watch_timeout(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.load())
+
+    saver = router()
+    with saver.connect():
+        saver.save()
+    watcher = watched(request, _notify)
+    time.sleep(0.3)
+    assert notifications == []
+    assert server.commands.count(('read', '/rump/test')) == 1
+
+    with saver.connect():
+        saver.default_upstream = 'http://other'
+        saver.save()
+    time.sleep(0.2)
+    assert notifications == [True]
+    assert str(watcher.default_upstream) == 'http://other,1'
+    # NOTE: value from the watch response, not a read
+    assert server.commands.count(('read', '/rump/test')) == 1
+    assert ('watch', '/rump/test', server.index + 1) in server.commands
+
+
+def test_watch_resume(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.load())
+
+    saver = router()
+    with saver.connect():
+        saver.save()
+        watcher = watched(request, _notify)
+        watcher.dynamic._watch_thd.stop()
+        time.sleep(0.1)
+        for i in xrange(3):
+            saver.default_upstream = 'http://other-{0}'.format(i)
+            saver.save()
+    watcher.watch(_notify)
+    time.sleep(0.2)
+    # NOTE: resumed from where it left off, so saw each
+    assert notifications == [True, True, True]
+    assert str(watcher.default_upstream) == 'http://other-2,1'
+
+
+def test_watch_index_cleared(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.load())
+
+    server.history = 2
+    saver = router()
+    with saver.connect():
+        saver.save()
+        watcher = watched(request, _notify)
+        watcher.dynamic._watch_thd.stop()
+        time.sleep(0.1)
+        for i in xrange(3):
+            saver.default_upstream = 'http://other-{0}'.format(i)
+            saver.save()
+    watcher.watch(_notify)
+    time.sleep(0.2)
+    assert notifications == [True]
+    assert str(watcher.default_upstream) == 'http://other-2,1'
+
+
+def test_directory_layout(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.load())
+
+    saver = router(layout='directory')
+    saver.connect()
+    request.addfinalizer(saver.disconnect)
+    saver.overrides = ['path = "/{0}" => http://{0},1'.format(i) for i in xrange(10)]
+    saver.save()
+    assert sorted(server.nodes) == ['/rump/test/commit'] + ['/rump/test/overrides/{0:08d}'.format(i) for i in xrange(10)] + ['/rump/test/settings']
+    assert server.nodes['/rump/test/overrides/00000003']['value'] == '"path = \\"/3\\" => http://3,1"'
+
+    watcher = watched(request, _notify, layout='directory')
+    assert map(str, watcher.overrides) == saver.overrides
+    unchanged = watcher.overrides[0]
+
+    # partial save
+    del server.commands[:]
+    saver.overrides[3] = 'path = "/three" => http://3,1'
+    saver.save()
+    assert [command for command in server.commands if command[0] != 'watch'] == [
+        ('write', '/rump/test/overrides/00000003'),
+        ('write', '/rump/test/commit'),
+    ]
+
+    # partial load
+    time.sleep(0.2)
+    assert notifications == [True]
+    assert ('read', '/rump/test') not in server.commands
+    assert map(str, watcher.overrides) == saver.overrides
+    assert watcher.overrides[0].expression is unchanged.expression
+
+    # settings
+    saver.compile_rules = False
+    saver.save()
+    time.sleep(0.2)
+    assert notifications == [True, True]
+    assert not watcher.compile_rules
+
+    # removal
+    del server.commands[:]
+    del saver.overrides[5:]
+    saver.save()
+    time.sleep(0.2)
+    assert notifications == [True] * 3
+    assert [command for command in server.commands if command[0] != 'watch'] == [
+        ('delete', '/rump/test/overrides/{0:08d}'.format(i)) for i in xrange(5, 10)
+    ] + [('write', '/rump/test/commit')]
+    assert map(str, watcher.overrides) == saver.overrides
+
+
+def test_directory_layout_index_cleared(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.load())
+
+    server.history = 2
+    saver = router(layout='directory')
+    with saver.connect():
+        saver.overrides = ['path = "/a" => http://a,1']
+        saver.save()
+        watcher = watched(request, _notify, layout='directory')
+        watcher.dynamic._watch_thd.stop()
+        time.sleep(0.1)
+        for i in xrange(3):
+            saver.overrides.append('path = "/{0}" => http://{0},1'.format(i))
+            saver.save()
+    watcher.watch(_notify)
+    time.sleep(0.2)
+    assert notifications == [True]
+    assert map(str, watcher.overrides) == saver.overrides
+
+
+def test_directory_layout_deleted(request, server):
+    saver = router(layout='directory')
+    saver.connect()
+    request.addfinalizer(saver.disconnect)
+    saver.overrides = ['path = "/{0}" => http://{0},1'.format(i) for i in xrange(3)]
+    saver.save()
+    loader = router(layout='directory')
+    with loader.connect():
+        assert loader.load() is True
+        stamp = loader.dynamic.stamp(loader)
+
+    del saver.overrides[2:]
+    saver.save()
+    assert ('delete', '/rump/test/overrides/00000002') in server.commands
+
+    restored = router(layout='directory')
+    with restored.connect():
+        restored.dynamic.restamp(restored, stamp)
+        assert restored.load() is True
+        assert map(str, restored.overrides) == saver.overrides
+        assert restored.load() is False
+
+
+def test_directory_layout_uncommitted(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.load())
+
+    saver = router(layout='directory')
+    saver.connect()
+    request.addfinalizer(saver.disconnect)
+    saver.overrides = ['path = "/{0}" => http://{0},1'.format(i) for i in xrange(3)]
+    saver.save()
+    watcher = watched(request, _notify, layout='directory')
+
+    # NOTE: as if a save is in progress
+    rule = 'path = "/3" => http://3,1'
+    server.write('/rump/test/overrides/00000003', dumps(rule))
+    time.sleep(0.2)
+    assert notifications == []
+    assert watcher.load() is False
+    assert len(watcher.overrides) == 3
+    other = router(layout='directory')
+    with other.connect():
+        assert other.load() is False
+
+    saver.overrides.append(rule)
+    saver.save()
+    time.sleep(0.2)
+    assert notifications == [True]
+    assert map(str, watcher.overrides) == saver.overrides
+
+
+def test_directory_layout_legacy(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.load())
+
+    server.write('/rump/test/settings', dumps({'compile_rules': False}))
+    watcher = watched(request, _notify, layout='directory')
+    assert not watcher.compile_rules
+    server.write(
+        '/rump/test/overrides/00000000', dumps('path = "/a" => http://a,1'),
+    )
+    time.sleep(0.2)
+    assert notifications == [True]
+    assert map(str, watcher.overrides) == ['path = "/a" => http://a,1']
@@ -0,0 +1,151 @@
+import socket
+import threading
+
+import mock
+import pytest
+import requests
+
+from rump import evented, wsgi
+
+
+@pytest.fixture
+def settings():
+    return {
+        'routers': [
+            {
+                'name': 'one',
+                'hosts': ['one\.me\.com'],
+                'rules': [
+                    'method = GET => http://cache.one.internal.com',
+                    'method = POST => https://post.one.internal.com',
+                ]
+            },
+        ],
+    }
+
+
+@pytest.fixture
+def server(request, settings):
+    wsgi.app.settings.map(settings)
+    server = evented.Server(('localhost', 0), wsgi.app, idle_timeout=5)
+    thd = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thd.daemon = True
+    thd.start()
+
+    def _stop():
+        server.shutdown()
+        thd.join()
+        server.server_close()
+
+    request.addfinalizer(_stop)
+    return server
+
+
+def exchange(server, raw, responses=1):
+    sock = socket.create_connection(server.server_address)
+    try:
+        sock.sendall(raw)
+        data = ''
+        while data.count('HTTP/1.') < responses or not data.endswith('\r\n\r\n'):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        return data
+    finally:
+        sock.close()
+
+
+def test_select(server):
+    root = 'http://{0}:{1}'.format(*server.server_address)
+    resp = requests.get(root + '/a/b?c=d', headers={'Host': 'one.me.com'})
+    assert resp.status_code == 200
+    assert resp.headers['x-accel-redirect'] == '/rump/a/b?c=d'
+    assert resp.headers['x-rump-redir-proto'] == 'http'
+    assert resp.headers['x-rump-redir-host'] == 'cache.one.internal.com'
+    assert resp.headers['content-length'] == '0'
+
+
+def test_select_body(server):
+    root = 'http://{0}:{1}'.format(*server.server_address)
+    resp = requests.post(
+        root + '/a/b', data='{"hi": "there"}', headers={'Host': 'one.me.com'},
+    )
+    assert resp.status_code == 200
+    assert resp.headers['x-rump-redir-host'] == 'post.one.internal.com'
+
+
+def test_keep_alive(server):
+    session = requests.Session()
+    root = 'http://{0}:{1}'.format(*server.server_address)
+    for _ in range(5):
+        resp = session.get(root + '/a', headers={'Host': 'one.me.com'})
+        assert resp.status_code == 200
+    assert len(server.connections) == 1
+
+
+def test_pipelined(server):
+    request = 'GET /a HTTP/1.1\r\nHost: one.me.com\r\n\r\n'
+    data = exchange(server, request * 3, responses=3)
+    assert data.count('HTTP/1.1 200 OK') == 3
+    assert data.count('X-Accel-Redirect: /rump/a') == 3
+
+
+def test_http_1_0_close(server):
+    data = exchange(server, 'GET /a HTTP/1.0\r\nHost: one.me.com\r\n\r\n')
+    assert data.startswith('HTTP/1.0 200 OK\r\n')
+    assert 'Connection: close\r\n' in data
+
+
+def test_bad_request(server):
+    data = exchange(server, 'garbage\r\n\r\n')
+    assert data.startswith('HTTP/1.1 400 Bad Request\r\n')
+
+
+def test_sweep(server):
+    session = requests.Session()
+    root = 'http://{0}:{1}'.format(*server.server_address)
+    session.get(root + '/a', headers={'Host': 'one.me.com'})
+    assert len(server.connections) == 1
+    server.sweep(now=server.connections[0].active_at + 10)
+    assert len(server.connections) == 0
+
+
+@pytest.fixture
+def connection(request):
+    sock, peer = socket.socketpair()
+    request.addfinalizer(peer.close)
+    server = mock.Mock(map={}, base_environ={})
+    connection = evented.Connection(sock, ('127.0.0.1', 1234), server)
+    request.addfinalizer(connection.close)
+    connection.pushed = []
+    connection.push = connection.pushed.append
+    return connection
+
+
+def test_header_too_large(connection):
+    connection.collect_incoming_data('GET /a HTTP/1.1\r\nX-Big: ')
+    for _ in range(10):
+        connection.collect_incoming_data('a' * connection.max_header_size)
+    assert len(connection.pushed) == 1
+    assert connection.pushed[0].startswith(
+        'HTTP/1.1 431 Request Header Fields Too Large\r\n'
+    )
+    assert connection.errored
+    assert not connection.readable()
+    assert connection._buffer == []
+
+
+def test_head(connection):
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return ['hello']
+
+    connection.server.app = app
+    for method in ['GET', 'HEAD']:
+        connection.collect_incoming_data('{0} /a HTTP/1.1'.format(method))
+        connection.found_terminator()
+    get, head = connection.pushed
+    assert get.endswith('Content-Length: 5\r\n\r\nhello')
+    assert head.endswith('Content-Length: 5\r\n\r\n')
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+import rump
+
+
+def imported(*statements):
+    """
+    Names of modules imported by a fresh interpreter after `statements`.
+    """
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(rump.__file__))),
+    )
+    out = subprocess.check_output([
+        sys.executable, '-c',
+        '; '.join(statements + ('import sys', 'print " ".join(sys.modules)')),
+    ], env=env)
+    return set(out.split())
+
+
+def test_lazy():
+    modules = imported('import rump', 'rump.Rules', 'rump.Request')
+    assert 'rump.rule' in modules
+    for name in [
+            'rump.parser', 'rump.router', 'rump.settings', 'rump.cli',
+            'rump.wsgi', 'redis', 'kazoo', 'etcd', 'coid', 'ohmr', 'wsgiref',
+        ]:
+        assert name not in modules
+
+
+def test_lazy_access():
+    modules = imported(
+        'import rump', 'rump.Settings', 'rump.wsgi.app', 'from rump import cli',
+    )
+    for name in ['rump.router', 'rump.settings', 'rump.wsgi', 'rump.cli']:
+        assert name in modules
+    assert set(dir(rump)).issuperset(rump.__all__)
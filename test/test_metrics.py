@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from rump import metrics, Router, Request
+
+
+@pytest.fixture
+def router():
+    return Router(
+        name='one',
+        hosts=['one\.me\.com'],
+        default_upstream='http://default',
+        rules=[
+            'method = GET => http://get',
+            'method = POST => http://post',
+        ],
+        overrides=[
+            'path startswith "/override" => http://override',
+        ],
+    )
+
+
+def test_counter():
+    registry = metrics.Metrics()
+    counter = registry.counter('hits_total', 'Hits.', ['router'])
+    counter.inc(('a',))
+    counter.inc(('a',), 2)
+    counter.inc(('b',))
+    assert counter.values() == {('a',): 3, ('b',): 1}
+
+
+def test_counter_threads():
+    registry = metrics.Metrics()
+    counter = registry.counter('hits_total', 'Hits.')
+
+    def _inc():
+        for _ in xrange(1000):
+            counter.inc()
+
+    thds = [threading.Thread(target=_inc) for _ in range(4)]
+    for thd in thds:
+        thd.start()
+    for thd in thds:
+        thd.join()
+    _inc()
+    assert counter.values() == {(): 5000}
+
+
+def test_histogram():
+    registry = metrics.Metrics()
+    histogram = registry.histogram('took_seconds', 'Took.', buckets=[0.1, 1.0])
+    for value in [0.05, 0.1, 0.5, 5.0]:
+        histogram.observe(value)
+    assert histogram.samples() == [
+        ('took_seconds_bucket', [('le', '0.1')], 2),
+        ('took_seconds_bucket', [('le', '1.0')], 3),
+        ('took_seconds_bucket', [('le', '+Inf')], 4),
+        ('took_seconds_count', [], 4),
+        ('took_seconds_sum', [], 5.65),
+    ]
+
+
+def test_register_duplicate():
+    registry = metrics.Metrics()
+    registry.counter('hits_total', 'Hits.')
+    with pytest.raises(ValueError):
+        registry.counter('hits_total', 'Hits.')
+
+
+def test_dumps():
+    registry = metrics.Metrics()
+    counter = registry.counter('hits_total', 'Hits.', ['router'])
+    counter.inc(('a"b',))
+    histogram = registry.histogram('took_seconds', 'Took.', buckets=[1.0])
+    histogram.observe(0.5)
+    assert registry.dumps() == '\n'.join([
+        '# HELP hits_total Hits.',
+        '# TYPE hits_total counter',
+        'hits_total{router="a\\"b"} 1',
+        '# HELP took_seconds Took.',
+        '# TYPE took_seconds histogram',
+        'took_seconds_bucket{le="1.0"} 1',
+        'took_seconds_bucket{le="+Inf"} 1',
+        'took_seconds_count 1',
+        'took_seconds_sum 0.5',
+        '',
+    ])
+    registry.reset()
+    assert 'hits_total{' not in registry.dumps()
+
+
+def test_match_upstream(router):
+    selection = metrics.SelectionMetrics()
+    cases = [
+        ({'REQUEST_METHOD': 'POST', 'PATH_INFO': '/a'}, 'http://post,1'),
+        ({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/override'}, 'http://override,1'),
+        ({'REQUEST_METHOD': 'PUT', 'PATH_INFO': '/a'}, 'http://default,1'),
+    ]
+    for environ, expected in cases:
+        upstream = router.match_upstream(Request(environ), selection)
+        assert str(upstream) == expected
+    assert selection.rule_hits.values() == {
+        ('one', 'rules', 1): 1,
+        ('one', 'overrides', 0): 1,
+    }
+    assert (
+        sorted(selection.rule_seconds.values()) ==
+        sorted(selection.rule_hits.values())
+    )
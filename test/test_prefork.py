@@ -0,0 +1,276 @@
+import logging
+import os
+import signal
+import threading
+import time
+
+import pytest
+import requests
+
+from rump import cli, prefork, wsgi, Router
+
+
+@pytest.fixture
+def settings():
+    return {
+        'routers': [
+            {
+                'name': 'one',
+                'hosts': ['one\.me\.com'],
+                'rules': [
+                    'method = GET => http://cache.one.internal.com',
+                ]
+            },
+        ],
+    }
+
+
+@pytest.fixture
+def master(request, settings):
+    wsgi.app.settings.map(settings)
+    master = prefork.Master(
+        server_factory=lambda: cli.server_for(host='localhost', port=0),
+        workers=2,
+        poll=0.1,
+    )
+    master.start()
+    request.addfinalizer(master.server.server_close)
+    request.addfinalizer(master.kill)
+    return master
+
+
+def select(master, host='cache.one.internal.com'):
+    resp = requests.get(
+        'http://{0}:{1}/a/b'.format(*master.server_address),
+        headers={'Host': 'one.me.com'},
+    )
+    assert resp.status_code == 200
+    assert resp.headers['x-rump-redir-host'] == host
+
+
+def test_spawn(master):
+    master.spawn()
+    assert len(master.pids) == 2
+    for _ in range(10):
+        select(master)
+
+
+def test_respawn(master):
+    master.spawn()
+    pid = sorted(master.pids)[0]
+    os.kill(pid, signal.SIGKILL)
+    time.sleep(0.2)
+    assert master.reap() == [pid]
+    assert pid not in master.pids
+    master.spawn()
+    assert len(master.pids) == 2
+    select(master)
+
+
+def test_recycle(master):
+    master.spawn()
+    old = set(master.pids)
+    master.recycle()
+    assert len(master.pids) == 2
+    assert not old & master.pids
+    select(master)
+
+
+def test_recycle_hung(master):
+    master.spawn()
+    old = set(master.pids)
+    for pid in old:
+        os.kill(pid, signal.SIGSTOP)
+    started_at = time.time()
+    master.recycle(timeout=0.2)
+    assert time.time() - started_at < 5
+    assert len(master.pids) == 2
+    for pid in old:
+        with pytest.raises(OSError):
+            os.waitpid(pid, os.WNOHANG)
+    select(master)
+
+
+def test_kill(master):
+    master.spawn()
+    pids = set(master.pids)
+    master.kill()
+    assert master.pids == set()
+    for pid in pids:
+        with pytest.raises(OSError):
+            os.waitpid(pid, os.WNOHANG)
+
+
+def test_reinit_logging():
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    logger = logging.getLogger('test-reinit-logging')
+    logger.addHandler(handler)
+    held, release = threading.Event(), threading.Event()
+
+    def _hold():
+        with handler.lock:
+            logging._acquireLock()
+            try:
+                held.set()
+                release.wait()
+            finally:
+                logging._releaseLock()
+
+    thread = threading.Thread(target=_hold)
+    thread.start()
+    try:
+        held.wait()
+        pid = os.fork()
+        if pid == 0:
+            prefork.reinit_logging()
+            logger.warning('forked')
+            logging.getLogger('test-reinit-logging.child')
+            os._exit(0)
+        for _ in range(100):
+            waited, status = os.waitpid(pid, os.WNOHANG)
+            if waited:
+                break
+            time.sleep(0.02)
+        else:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            pytest.fail('forked child deadlocked')
+        assert status == 0
+    finally:
+        release.set()
+        thread.join()
+        logger.removeHandler(handler)
+
+@pytest.fixture
+def publishing_master(request, settings):
+    wsgi.app.settings.map(settings)
+    master = prefork.Master(
+        server_factory=lambda: cli.server_for(host='localhost', port=0),
+        workers=2,
+        app=wsgi.app,
+        poll=0.1,
+        publish_reloads=True,
+    )
+    master.start()
+    request.addfinalizer(master.reloads.close)
+    request.addfinalizer(master.server.server_close)
+    request.addfinalizer(wsgi.app.teardown)
+    request.addfinalizer(master.kill)
+    return master
+
+
+def test_reloads(tmpdir):
+    reloads = prefork.Reloads(str(tmpdir))
+    publisher = Router(name='one', compile_rules=False)
+    publisher.overrides.append('method = GET => http://a.internal.com,1')
+    assert reloads.publish([publisher]) == 1
+    subscriber = Router(name='one')
+    assert reloads.refresh([subscriber]) is False
+
+    reloads.generation = 0
+    assert reloads.refresh([subscriber]) is True
+    assert not subscriber.compile_rules
+    assert map(str, subscriber.overrides) == map(str, publisher.overrides)
+    assert reloads.publish([publisher]) == 2
+    assert reloads.publish([publisher]) == 3
+    assert sorted(os.listdir(str(tmpdir))) == [
+        os.path.basename(reloads.path_for(2)), os.path.basename(reloads.path_for(3)),
+    ]
+
+
+def test_reloads_added_removed(tmpdir):
+    reloads = prefork.Reloads(str(tmpdir))
+    one = Router(name='one', hosts=['one\.me\.com'])
+    two = Router(name='two', rules=['method = GET => http://two.internal.com'])
+    reloads.publish([one, two])
+    subscriber = Router(name='one')
+    routers = [subscriber, Router(name='gone')]
+    reloads.generation = 0
+    assert reloads.refresh(routers) is True
+    assert [router.name for router in routers] == ['one', 'two']
+    assert routers[0] is subscriber
+    assert [host.pattern for host in subscriber.hosts] == ['one\.me\.com']
+    assert map(str, routers[1].rules) == map(str, two.rules)
+
+
+@pytest.fixture(params=[False, True])
+def files_master(request, tmpdir):
+    path = tmpdir.join('rump.conf')
+    path.write(
+        '[rump]\n'
+        'includes = ./*.conf\n'
+        '\n'
+        '[rump:wsgi]\n'
+        'reload_files = true\n'
+        '\n'
+        '[one]\n'
+        'hosts = one\.me\.com\n'
+        'rules =\n'
+        '    method = GET => http://cache.one.internal.com\n'
+    )
+    settings, wsgi.app.settings = wsgi.app.settings, wsgi.Settings()
+    wsgi.app.settings.from_file(str(path))
+    wsgi.app.files_poll = 0.05
+    master = prefork.Master(
+        server_factory=lambda: cli.server_for(host='localhost', port=0),
+        workers=2,
+        app=wsgi.app,
+        poll=0.1,
+        publish_reloads=request.param,
+    )
+    master.start()
+
+    def _reset():
+        del wsgi.app.files_poll
+        wsgi.app.settings = settings
+
+    request.addfinalizer(_reset)
+    if master.reloads is not None:
+        request.addfinalizer(master.reloads.close)
+    request.addfinalizer(master.server.server_close)
+    request.addfinalizer(wsgi.app.teardown)
+    request.addfinalizer(master.kill)
+    return master
+
+
+def test_files_reloaded(tmpdir, files_master):
+    files_master.spawn()
+    select(files_master)
+
+    tmpdir.join('rump.tmp').write(
+        tmpdir.join('rump.conf').read().replace('cache.one', 'fresh.one') +
+        '\n'
+        '[two]\n'
+        'hosts = two\.me\.com\n'
+        'default_upstream = http://two.internal.com\n'
+    )
+    tmpdir.join('rump.tmp').rename(tmpdir.join('rump.conf'))
+    for _ in range(50):
+        if files_master.recycling.is_set():
+            files_master.recycling.clear()
+            files_master.recycle()
+        if len(wsgi.app.settings.routers) == 2:
+            break
+        time.sleep(0.05)
+    time.sleep(0.3)
+    for _ in range(10):
+        select(files_master, 'fresh.one.internal.com')
+    resp = requests.get(
+        'http://{0}:{1}/a/b'.format(*files_master.server_address),
+        headers={'Host': 'two.me.com'},
+    )
+    assert resp.headers['x-rump-redir-host'] == 'two.internal.com'
+
+
+def test_publish(publishing_master):
+    publishing_master.spawn()
+    pids = set(publishing_master.pids)
+    select(publishing_master)
+
+    router = wsgi.app.settings.routers[0]
+    router.overrides.append('method = GET => http://fresh.internal.com')
+    publishing_master.publish()
+    time.sleep(0.3)
+    for _ in range(10):
+        select(publishing_master, 'fresh.internal.com')
+    assert publishing_master.pids == pids
@@ -0,0 +1,68 @@
+import pytest
+
+from rump import profiling, Router, Request
+
+
+@pytest.fixture(params=[True, False])
+def router(request):
+    return Router(
+        name='one',
+        compile_rules=request.param,
+        default_upstream='http://default',
+        rules=[
+            'method = GET and path startswith "/a" => http://a',
+            'method = GET and query.b = "b" => http://b',
+            'method = POST => http://post',
+        ],
+    )
+
+
+def test_profile(router):
+    profile = profiling.Profile()
+    router.profile(profile)
+    for environ in [
+            {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/a', 'QUERY_STRING': ''},
+            {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/b', 'QUERY_STRING': 'b=b'},
+            {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/c', 'QUERY_STRING': ''},
+        ]:
+        router.match_upstream(Request(environ))
+    assert dict(
+        (key, (stat.count, stat.hits)) for key, stat in profile.rules.items()
+    ) == {
+        ('one.rules', 0): (3, 1),
+        ('one.rules', 1): (2, 1),
+        ('one.rules', 2): (1, 1),
+    }
+    # NOTE: only those read, e.g. not path for POST, and interpreted rules
+    # resolve query.b via query
+    query = 'query.b' if router.compile_rules else 'query'
+    assert dict(
+        (path, stat.count) for path, stat in profile.fields.items()
+    ) == {
+        'method': 3,
+        'path': 2,
+        query: 1,
+    }
+    report = profile.reports()
+    assert 'one.rules[1] method = "GET" and query.b = "b" => http://b,1' in report
+    assert query in report
+    assert len(profile.reports(limit=1).splitlines()) == 5
+
+
+def test_profile_disable(router):
+    profile = profiling.Profile()
+    router.profile(profile)
+    assert router.rules.profile is not None
+    router.profile(None)
+    assert router.rules.profile is None
+    router.match_upstream(Request({'REQUEST_METHOD': 'POST'}))
+    assert profile.rules == {}
+
+
+def test_profile_lazy(router):
+    profile = profiling.Profile()
+    router.profile(profile)
+    request = Request({'REQUEST_METHOD': 'POST', 'PATH_INFO': '/c'})
+    assert str(router.match_upstream(request)) == 'http://post,1'
+    assert 'path' not in request
+    assert sorted(profile.fields) == ['method']
@@ -0,0 +1,414 @@
+import collections
+import Queue
+import threading
+import time
+
+import mock
+import pytest
+
+from rump import Router, dumps
+from rump.router import redis
+
+
+class FakeServer(object):
+    """
+    In-memory stand-in for a redis server.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.channels = collections.defaultdict(list)
+        self.commands = []
+        self.clients = []
+        self.pubsubs = []
+        self.disconnects = 0
+        self.lock = threading.Lock()
+
+
+class FakeRedis(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.connection_pool = FakePool(server)
+        server.clients.append(self)
+
+    @classmethod
+    def from_url(cls, server, url):
+        return cls(server)
+
+    def get(self, key):
+        self.server.commands.append(('get', key))
+        return self.server.data.get(key)
+
+    def mget(self, keys):
+        self.server.commands.append(('mget',) + tuple(keys))
+        return [self.server.data.get(key) for key in keys]
+
+    def set(self, key, value):
+        self.server.commands.append(('set', key))
+        self.server.data[key] = value
+
+    def mset(self, mapping):
+        self.server.commands.append(('mset',) + tuple(sorted(mapping)))
+        self.server.data.update(mapping)
+
+    def hgetall(self, key):
+        self.server.commands.append(('hgetall', key))
+        return dict(self.server.data.get(key, {}))
+
+    def hmget(self, key, fields):
+        self.server.commands.append(('hmget', key) + tuple(fields))
+        value = self.server.data.get(key, {})
+        return [value.get(field) for field in fields]
+
+    def hmset(self, key, mapping):
+        self.server.commands.append(('hmset', key) + tuple(sorted(mapping)))
+        self.server.data.setdefault(key, {}).update(mapping)
+
+    def hdel(self, key, *fields):
+        self.server.commands.append(('hdel', key) + fields)
+        value = self.server.data.get(key, {})
+        for field in fields:
+            value.pop(field, None)
+
+    def publish(self, channel, message):
+        self.server.commands.append(('publish', channel))
+        for pubsub in list(self.server.channels[channel]):
+            pubsub.messages.put({
+                'type': 'message', 'channel': channel, 'data': message,
+            })
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def transaction(self, func, *watches):
+        pipe = FakePipeline(self)
+        pipe.watch(*watches)
+        func(pipe)
+        return pipe.execute()
+
+    def pubsub(self):
+        return FakePubSub(self.server)
+
+
+class FakePool(object):
+
+    def __init__(self, server):
+        self.server = server
+
+    def disconnect(self):
+        self.server.disconnects += 1
+
+
+class FakePipeline(object):
+
+    def __init__(self, cli):
+        self.cli = cli
+        self.calls = []
+        self.immediate = False
+
+    def watch(self, *keys):
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    def __getattr__(self, name):
+        method = getattr(self.cli, name)
+        if self.immediate:
+            return method
+
+        def _queue(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            return self
+
+        return _queue
+
+    def execute(self):
+        with self.cli.server.lock:
+            return [method(*args, **kwargs) for method, args, kwargs in self.calls]
+
+
+class FakePubSub(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.handlers = {}
+        self.messages = Queue.Queue()
+        #: Names of the threads that subscribed.
+        self.subscribers = []
+        server.pubsubs.append(self)
+
+    def subscribe(self, **handlers):
+        self.subscribers.append(threading.current_thread().name)
+        for channel, handler in handlers.items():
+            self.handlers[channel] = handler
+            self.server.channels[channel].append(self)
+
+    def unsubscribe(self, *channels):
+        for channel in channels:
+            self.handlers.pop(channel)
+            self.server.channels[channel].remove(self)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0):
+        try:
+            message = self.messages.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+        handler = self.handlers.get(message['channel'])
+        if handler is None:
+            return message
+        handler(message)
+
+    def close(self):
+        self.unsubscribe(*self.handlers.keys())
+
+
+@pytest.fixture
+def server(request):
+    server = FakeServer()
+    patch = mock.patch(
+        'redis.Redis.from_url',
+        staticmethod(lambda url: FakeRedis.from_url(server, url)),
+    )
+    patch.start()
+
+    def _cleanup():
+        patch.stop()
+        assert redis.Connection._connections == {}
+
+    request.addfinalizer(_cleanup)
+    return server
+
+
+def router(name='test', **dynamic):
+    return Router(
+        name=name,
+        compile_rules=True,
+        default_upstream='http://me',
+        dynamic=dict({
+            '_type_': 'redis',
+            'key': 'rump-test',
+            'channel': 'rump-test',
+            'watch_timeout': 0.01,
+        }, **dynamic),
+        rules=[
+            'client_ip4 in 1.2.3.4/32 => prod',
+        ],
+    )
+
+
+def test_load_unchanged(server):
+    saver = router()
+    with saver.connect():
+        saver.compile_rules = False
+        saver.save()
+    assert server.commands == [
+        ('mset', 'rump-test', 'rump-test:version'), ('publish', 'rump-test'),
+    ]
+
+    loader = router()
+    with loader.connect():
+        del server.commands[:]
+        assert loader.load() is True
+        assert not loader.compile_rules
+        assert server.commands == [
+            ('get', 'rump-test:version'),
+            ('mget', 'rump-test', 'rump-test:version'),
+        ]
+
+        del server.commands[:]
+        assert loader.load() is False
+        assert server.commands == [('get', 'rump-test:version')]
+
+
+def test_load_unversioned(server):
+    saver = router()
+    saver.compile_rules = False
+    server.data['rump-test'] = dumps(saver.filter('dynamic'))
+
+    loader = router()
+    with loader.connect():
+        assert loader.load() is True
+        assert not loader.compile_rules
+        loader.compile_rules = True
+        assert loader.load() is False
+        assert loader.compile_rules
+
+
+def test_watch_debounce(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router)
+        router.load()
+
+    saver = router()
+    with saver.connect():
+        saver.save()
+
+    watcher = router(watch_debounce=0.2)
+    watcher.connect()
+    request.addfinalizer(watcher.disconnect)
+    watcher.load()
+    watcher.watch(_notify)
+
+    with saver.connect():
+        # same version as loaded
+        saver.save()
+        time.sleep(0.3)
+        assert notifications == []
+
+        # burst
+        for i in xrange(5):
+            saver.default_upstream = 'http://me-{0}'.format(i)
+            saver.save()
+        time.sleep(0.5)
+    assert notifications == [watcher]
+    assert str(watcher.default_upstream) == 'http://me-4,1'
+
+
+def test_shared_connection(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.name)
+
+    watchers = [
+        router(
+            name='test-{0}'.format(i),
+            key='rump-test-{0}'.format(i),
+            channel='rump-test-{0}'.format(i),
+            watch_debounce=0,
+        )
+        for i in xrange(40)
+    ]
+    for watcher in watchers:
+        watcher.connect()
+        request.addfinalizer(watcher.disconnect)
+        watcher.watch(_notify)
+    connection = watchers[0].dynamic._connection
+    assert len(server.clients) == 1
+    assert len(server.pubsubs) == 1
+    assert all(watcher.dynamic._cli is server.clients[0] for watcher in watchers)
+    # NOTE: only subscribed from here before the dispatcher started
+    assert server.pubsubs[0].subscribers == ['MainThread'] + ['rump-redis'] * 39
+
+    saver = router(
+        name='test-7', key='rump-test-7', channel='rump-test-7',
+    )
+    with saver.connect():
+        saver.save()
+        saver.default_upstream = 'http://other'
+        saver.save()
+    time.sleep(0.2)
+    assert notifications == ['test-7', 'test-7']
+
+    for watcher in watchers[:-1]:
+        watcher.disconnect()
+    assert sorted(server.pubsubs[0].handlers) == sorted([
+        connection.control, 'rump-test-39',
+    ])
+    thd = connection._thd
+    assert thd.is_alive()
+    watchers[-1].disconnect()
+    assert server.pubsubs[0].handlers == {}
+    assert not thd.is_alive()
+    assert server.disconnects == 1
+
+
+def test_connection_sleep_time(server):
+    connections = [
+        redis.Connection.acquire('redis://localhost:6379/0', sleep_time)
+        for sleep_time in [1.0, 0.01, 0.5]
+    ]
+    try:
+        assert all(connection is connections[0] for connection in connections)
+        assert connections[0].sleep_time == 0.01
+    finally:
+        for connection in connections:
+            connection.release()
+    assert server.disconnects == 1
+
+
+def test_disconnect_idempotent(server):
+    disconnected = router()
+    disconnected.dynamic.disconnect(disconnected)
+    with disconnected.connect():
+        pass
+    disconnected.dynamic.disconnect(disconnected)
+    assert not disconnected.is_connected
+
+def test_hash_layout(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.load())
+
+    saver = router(layout='hash')
+    saver.connect()
+    request.addfinalizer(saver.disconnect)
+    saver.overrides = ['path = "/{0}" => http://{0},1'.format(i) for i in xrange(10)]
+    saver.save()
+    assert server.data['rump-test:entries']['overrides'] == '10'
+    assert server.data['rump-test:entries']['overrides.3'] == '"path = \\"/3\\" => http://3,1"'
+
+    watcher = router(layout='hash', watch_debounce=0)
+    watcher.connect()
+    request.addfinalizer(watcher.disconnect)
+    assert watcher.load() is True
+    assert map(str, watcher.overrides) == saver.overrides
+    unchanged = watcher.overrides[0]
+    watcher.watch(_notify)
+
+    # partial save
+    del server.commands[:]
+    saver.overrides[3] = 'path = "/three" => http://3,1'
+    saver.compile_rules = False
+    saver.save()
+    assert server.commands[:3] == [
+        ('get', 'rump-test:version'),
+        ('hmset', 'rump-test:entries', 'compile_rules', 'overrides.3'),
+        ('set', 'rump-test:version'),
+    ]
+
+    # partial load
+    time.sleep(0.2)
+    assert notifications == [True]
+    assert ('hmget', 'rump-test:entries', 'compile_rules', 'overrides.3') in server.commands
+    assert ('hgetall', 'rump-test:entries') not in server.commands
+    assert not watcher.compile_rules
+    assert map(str, watcher.overrides) == saver.overrides
+    assert watcher.overrides[0].expression is unchanged.expression
+
+    # removal
+    del server.commands[:]
+    del saver.overrides[5:]
+    saver.save()
+    time.sleep(0.2)
+    assert notifications == [True, True]
+    assert ('hdel', 'rump-test:entries', 'overrides.5', 'overrides.6',
+            'overrides.7', 'overrides.8', 'overrides.9') in server.commands
+    assert ('hgetall', 'rump-test:entries') not in server.commands
+    assert map(str, watcher.overrides) == saver.overrides
+
+
+def test_hash_layout_missed(server):
+    saver = router(layout='hash')
+    loader = router(layout='hash')
+    with saver.connect(), loader.connect():
+        saver.overrides = ['path = "/a" => http://a,1']
+        saver.save()
+        assert loader.load() is True
+
+        # only notified of the last of two saves
+        saver.compile_rules = False
+        saver.save()
+        saver.overrides.append('path = "/b" => http://b,1')
+        saver.save()
+        loader.dynamic._pend({'changed': ['overrides', 'overrides.1']})
+        del server.commands[:]
+        assert loader.load() is True
+        assert ('hgetall', 'rump-test:entries') in server.commands
+        assert not loader.compile_rules
+        assert map(str, loader.overrides) == saver.overrides
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+
+from rump import reloader, Router
+
+
+def router(name):
+    return Router(name=name)
+
+
+class Reloads(list):
+    """
+    Records reloads, each blocking while `gate` is clear.
+    """
+
+    def __init__(self):
+        super(Reloads, self).__init__()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def reload(self, router):
+        self.append(router.name)
+        self.gate.wait()
+
+
+@pytest.fixture
+def reloads():
+    return Reloads()
+
+
+def test_coalesced(request, reloads):
+    r = reloader.Reloader(reloads.reload)
+    r.start()
+    request.addfinalizer(r.stop)
+    a, b = router('a'), router('b')
+
+    reloads.gate.clear()
+    r.enqueue(a)
+    time.sleep(0.05)
+    # NOTE: a in progress so these coalesce into one pending reload each
+    for _ in xrange(5):
+        r.enqueue(a)
+        r.enqueue(b)
+    assert r.coalesced == 8
+    reloads.gate.set()
+    assert r.wait(1.0)
+    assert reloads == ['a', 'a', 'b']
+
+
+def test_coalesced_replaced(request):
+    reloaded = []
+    gate = threading.Event()
+
+    def _reload(router):
+        gate.wait()
+        reloaded.append(router)
+
+    r = reloader.Reloader(_reload)
+    r.start()
+    request.addfinalizer(r.stop)
+    old, new = router('a'), router('a')
+    r.enqueue(router('a'))
+    time.sleep(0.05)
+    r.enqueue(old)
+    r.enqueue(new)
+    assert r.coalesced == 1
+    gate.set()
+    assert r.wait(1.0)
+    assert reloaded[-1] is new
+
+def test_serialized_per_router(request):
+    active, overlapped = set(), []
+    lock = threading.Lock()
+
+    def _reload(router):
+        with lock:
+            if router.name in active:
+                overlapped.append(router.name)
+            active.add(router.name)
+        time.sleep(0.01)
+        with lock:
+            active.discard(router.name)
+
+    r = reloader.Reloader(_reload, workers=4)
+    r.start()
+    request.addfinalizer(r.stop)
+    routers = [router('a'), router('b')]
+    for i in xrange(50):
+        r.enqueue(routers[i % 2])
+        time.sleep(0.001)
+    assert r.wait(2.0)
+    assert overlapped == []
+
+
+def test_failed(request, reloads):
+
+    def _reload(router):
+        reloads.append(router.name)
+        if router.name == 'a':
+            raise ValueError('boom')
+
+    r = reloader.Reloader(_reload)
+    r.start()
+    request.addfinalizer(r.stop)
+    r.enqueue(router('a'))
+    r.enqueue(router('b'))
+    assert r.wait(1.0)
+    assert reloads == ['a', 'b']
+
+
+def test_stop(reloads):
+    r = reloader.Reloader(reloads.reload)
+    r.start()
+    reloads.gate.clear()
+    r.enqueue(router('a'))
+    time.sleep(0.05)
+    r.enqueue(router('b'))
+    assert not r.wait(0.05)
+    threading.Timer(0.05, reloads.gate.set).start()
+    r.stop(1.0)
+    assert reloads == ['a']
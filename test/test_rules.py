@@ -1,5 +1,6 @@
 import json
 import StringIO
+import threading
 
 import mock
 import pytest
@@ -7,6 +8,7 @@ import pytest
 from rump import (
     parser, Upstream, Selection, Server, Request, types, Rule, Rules, exc
 )
+from rump.rule import Breaker
 
 
 @pytest.fixture
@@ -139,6 +141,31 @@ def test_rules_match_hit(rules):
     assert str(rules.match(req)) == 'http://me,1'
 
 
+def test_rules_match_index(rules):
+    rules = Rules(rules)
+    hit = Request(environ={'REQUEST_METHOD': 'GET', 'REMOTE_ADDR': '1.1.1.1'})
+    miss = Request(environ={'REQUEST_METHOD': 'PATCH', 'REMOTE_ADDR': '1.1.1.1'})
+    for compile in [False, True]:
+        rules.compile = compile
+        i, upstream = rules.match_index(hit)
+        assert i == 1
+        assert upstream == rules[1].upstream
+        assert rules.match_index(miss) == (None, None)
+
+
+def test_rules_match_regex():
+    rules = Rules().loads('\n'.join([
+        'path ~ "/a/[0-9]+" => http://a',
+        'path !~ "/b" => http://b',
+    ]))
+    for compile in [False, True]:
+        rules.compile = compile
+        for path, expected in [('/a/1', 'http://a,1'), ('/a/x', 'http://b,1')]:
+            req = Request(environ={'PATH_INFO': path})
+            assert str(rules.match(req)) == expected
+        assert rules.match(Request(environ={'PATH_INFO': '/b'})) is None
+
+
 def test_rules_enable_disable(rules):
     rules = Rules(rules)
     assert rules.disabled == set()
@@ -181,14 +208,125 @@ def test_rules_match_error_disable(rules):
         'REMOTE_ADDR': '1.2.3.4',
     })
 
-    rs = Rules(rules, compile=False)
+    rs = Rules(rules, compile=False, error_threshold=2)
     with mock.patch('rump.Rule.match') as patch:
         patch.side_effect = Exception('boom')
         rs.match(req, error='disable')
+        assert all(rule not in rs.disabled for rule in rs)
+        rs.match(req, error='disable')
     assert all(rule in rs.disabled for rule in rs)
 
-    rs = Rules(rules, compile=True)
+    rs = Rules(rules, compile=True, error_threshold=2)
     with mock.patch('rump.rule.CompiledRule.match_context') as patch:
         patch.side_effect = Exception('boom')
         rs.match(req, error='disable')
+        assert all(rule not in rs.disabled for rule in rs)
+        rs.match(req, error='disable')
     assert all(rule in rs.disabled for rule in rs)
+
+
+@pytest.mark.parametrize('compile', [False, True])
+def test_rules_match_error_breaker(rules, compile):
+    req = Request(environ={'REQUEST_METHOD': 'PATCH'})
+    rs = Rules(
+        rules,
+        compile=compile,
+        auto_disable=True,
+        error_threshold=2,
+        error_window=10,
+        error_retry=5,
+    )
+    patch_path = (
+        'rump.rule.CompiledRule.match_context' if compile else 'rump.Rule.match'
+    )
+    now = [1000.0]
+    with mock.patch('rump.rule.timer', lambda: now[0]):
+        with mock.patch(patch_path) as patch:
+            patch.side_effect = Exception('boom')
+            rs.match(req)
+            assert [
+                (i, breaker.state, breaker.errors) for i, breaker in rs.breakers()
+            ] == [(i, 'closed', 1) for i in xrange(len(rs))]
+
+            # errors outside window
+            now[0] += 11
+            rs.match(req)
+            assert not rs.disabled
+            assert rs.breaker(0).errors == 2
+
+            # open
+            now[0] += 1
+            rs.match(req)
+            assert rs.disabled == set(rs)
+            assert rs.breaker(0).state == 'open'
+            assert rs.breaker(0).trips == 1
+            assert rs.breaker(0).retry_at == now[0] + 5
+            assert patch.call_count == 3 * len(rs)
+            rs.match(req)
+            assert patch.call_count == 3 * len(rs)
+
+            # half-open, fails again
+            now[0] += 5
+            rs.match(req)
+            assert patch.call_count == 4 * len(rs)
+            assert rs.disabled == set(rs)
+            assert rs.breaker(0).trips == 2
+
+            # half-open, recovers
+            now[0] += 5
+            patch.side_effect = None
+            patch.return_value = None
+            rs.match(req)
+            assert not rs.disabled
+            assert rs.breaker(0).state == 'half-open'
+            now[0] += 10
+            assert rs.breaker(0).state == 'closed'
+            assert rs.breaker(0).as_dict() == {
+                'state': 'closed',
+                'errors': 4,
+                'trips': 2,
+                'last_error': 'boom',
+                'retry_at': None,
+            }
+
+
+def test_rules_match_error_logging(rules):
+    req = Request(environ={'REQUEST_METHOD': 'PATCH'})
+    rs = Rules(rules, error_threshold=1000)
+    with mock.patch('rump.Rule.match') as patch:
+        patch.side_effect = Exception('boom')
+        with mock.patch('rump.rule.logger') as logger:
+            for _ in xrange(10):
+                rs.match(req, error='disable')
+    assert logger.exception.call_count == len(rs)
+    assert not rs.disabled
+
+
+def test_breaker_concurrent():
+    breaker = Breaker(threshold=1)
+    threads = [
+        threading.Thread(
+            target=lambda: [breaker.failed(Exception('boom')) for _ in xrange(100)]
+        )
+        for _ in xrange(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert breaker.errors == 800
+    assert breaker.trips == 1
+
+
+def test_rules_breakers_forgotten(rules):
+    req = Request(environ={'REQUEST_METHOD': 'PATCH'})
+    rs = Rules(rules, error_threshold=1)
+    with mock.patch('rump.Rule.match') as patch:
+        patch.side_effect = Exception('boom')
+        rs.match(req, error='disable')
+    assert len(rs.breakers()) == len(rs) == len(rs.disabled)
+    rs[0] = 'method = GET => http://replaced'
+    del rs[1:]
+    assert rs.breakers() == []
+    assert not rs.disabled
+    assert rs._breakers == {}
@@ -1,6 +1,11 @@
+import threading
+
+import mock
+import pilo
 import pytest
 
 from rump import Settings, loads, dumps
+from rump.artifact import Artifact
 
 
 @pytest.fixture
@@ -25,7 +30,10 @@ def test_load(settings_path):
                 'hosts': [
                     'google.'
                 ],
-                'auto_disable_rules': True
+                'auto_disable_rules': True,
+                'rule_error_threshold': 5,
+                'rule_error_window': 60.0,
+                'rule_error_retry': 30.0,
             }, {
                 'name': 'router2',
                 'compile_rules': True,
@@ -33,6 +41,8 @@ def test_load(settings_path):
                 'dynamic': {
                     'url': 'redis://localhost:6379/0',
                     'watch_timeout': 1.0,
+                    'watch_debounce': 0.1,
+                    'layout': 'document',
                     '_type_': 'redis',
                     'key': 'test-router2',
                     'channel': 'test-router2'
@@ -44,7 +54,10 @@ def test_load(settings_path):
                 'hosts': [
                     'yahoo.'
                 ],
-                'auto_disable_rules': True
+                'auto_disable_rules': True,
+                'rule_error_threshold': 5,
+                'rule_error_window': 60.0,
+                'rule_error_retry': 30.0,
             }, {
                 'name': 'router3',
                 'compile_rules': False,
@@ -59,7 +72,8 @@ def test_load(settings_path):
                     ],
                     '_type_': 'zookeeper',
                     'timeout': 15,
-                    'root': 'test_router3'
+                    'root': 'test_router3',
+                    'watch_debounce': 0.1
                 },
                 'overrides': [],
                 'enabled': True,
@@ -68,7 +82,10 @@ def test_load(settings_path):
                 'hosts': [
                     'dev.'
                 ],
-                'auto_disable_rules': True
+                'auto_disable_rules': True,
+                'rule_error_threshold': 5,
+                'rule_error_window': 60.0,
+                'rule_error_retry': 30.0,
             }
     ]
 
@@ -89,7 +106,8 @@ def test_load_one(settings_path):
             ],
             '_type_': 'zookeeper',
             'timeout': 15,
-            'root': 'test_router3'
+            'root': 'test_router3',
+            'watch_debounce': 0.1
         },
         'overrides': [],
         'enabled': True,
@@ -98,5 +116,103 @@ def test_load_one(settings_path):
         'hosts': [
             'dev.'
         ],
-        'auto_disable_rules': True
+        'auto_disable_rules': True,
+        'rule_error_threshold': 5,
+        'rule_error_window': 60.0,
+        'rule_error_retry': 30.0,
     }]
+
+
+def test_load_compiled(tmpdir, settings_path):
+    compiled = tmpdir.join('rump.compiled')
+    artifact = Artifact(record=True)
+    with pilo.ctx(artifact=artifact):
+        expected = Settings.from_file(str(settings_path))
+    assert artifact.misses == 3
+    artifact.save(str(compiled))
+
+    settings_path.dirpath('include.conf').copy(tmpdir)
+    tmpdir.join('main.conf').write(settings_path.read().replace(
+        'includes = ./*.conf',
+        'includes = ./*.conf\ncompiled = ./rump.compiled',
+    ))
+    with mock.patch('rump.parser.for_rule', side_effect=AssertionError('parsed')):
+        settings = Settings.from_file(str(tmpdir.join('main.conf')))
+    assert settings.compiled == str(compiled)
+    assert loads(dumps(settings.routers)) == loads(dumps(expected.routers))
+
+
+def test_load_compiled_stale(tmpdir, settings_path):
+    compiled = tmpdir.join('rump.compiled')
+    with mock.patch('rump.artifact.__version__', '0.0.0'):
+        Artifact(record=True).save(str(compiled))
+    assert Artifact.load(str(compiled)) is None
+    assert Artifact.load(str(tmpdir.join('missing'))) is None
+
+
+def test_load_compiled_untrusted(tmpdir):
+    compiled = tmpdir.join('rump.compiled')
+    Artifact(record=True).save(str(compiled))
+    assert Artifact.load(str(compiled)) is not None
+    compiled.chmod(0o666)
+    assert Artifact.load(str(compiled)) is None
+
+
+@pytest.fixture
+def cached_settings_path(tmpdir, settings_path):
+    settings_path.dirpath('include.conf').copy(tmpdir)
+    path = tmpdir.join('main.conf')
+    path.write(settings_path.read().replace(
+        'includes = ./*.conf',
+        'includes = ./*.conf\ncache_dir = ./cache\nparse_workers = 2',
+    ))
+    return path
+
+
+def test_load_cached(tmpdir, settings_path, cached_settings_path):
+    expected = Settings.from_file(str(settings_path))
+    settings = Settings.from_file(str(cached_settings_path))
+    assert settings.cache_dir == str(tmpdir.join('cache'))
+    assert settings.parse_workers == 2
+    assert loads(dumps(settings.routers)) == loads(dumps(expected.routers))
+    assert len(tmpdir.join('cache').listdir()) == 2
+
+    with mock.patch('rump.parser.for_rule', side_effect=AssertionError('parsed')):
+        settings = Settings.from_file(str(cached_settings_path))
+    assert loads(dumps(settings.routers)) == loads(dumps(expected.routers))
+
+    include = tmpdir.join('include.conf')
+    include.write(include.read().replace(
+        'http://dev.bing.com',
+        'http://dev.bing.com\n    path endswith ".xml" => http://xml.me.com',
+    ))
+    settings = Settings.from_file(str(cached_settings_path), names=['router3'])
+    assert [router.name for router in settings.routers] == ['router3']
+    assert str(settings.routers[0].rules[-1]) == (
+        'path endswith ".xml" => http://xml.me.com,1'
+    )
+
+
+def test_load_cached_untrusted(tmpdir, settings_path, cached_settings_path):
+    expected = Settings.from_file(str(settings_path))
+    Settings.from_file(str(cached_settings_path))
+    cache = tmpdir.join('cache')
+    assert cache.stat().mode & 0o777 == 0o700
+    for cached in cache.listdir():
+        cached.chmod(0o666)
+    loaded = Settings.from_file(str(cached_settings_path))
+    assert loads(dumps(loaded.routers)) == loads(dumps(expected.routers))
+    # NOTE: parsed again and so rewritten
+    assert [cached.stat().mode & 0o777 for cached in cache.listdir()] == [0o600] * 2
+
+
+def test_load_parallel_thread(settings_path, cached_settings_path):
+    expected = Settings.from_file(str(settings_path))
+    loaded = []
+    with mock.patch('multiprocessing.Pool', side_effect=AssertionError('forked')):
+        thread = threading.Thread(
+            target=lambda: loaded.append(Settings.from_file(str(cached_settings_path))),
+        )
+        thread.start()
+        thread.join()
+    assert loads(dumps(loaded[0].routers)) == loads(dumps(expected.routers))
@@ -0,0 +1,107 @@
+import os
+import threading
+
+import mock
+import pytest
+
+from rump import snapshot, wsgi, Router
+
+
+def router(**dynamic):
+    return Router(
+        name='test',
+        default_upstream='http://me',
+        dynamic=dict({
+            '_type_': 'redis',
+            'key': 'rump-test',
+            'channel': 'rump-test',
+        }, **dynamic),
+    )
+
+
+@pytest.fixture
+def saved(tmpdir):
+    saver = router()
+    saver.compile_rules = False
+    saver.overrides.append('path = "/a" and not has_content => http://a,1')
+    saver.overrides.append('client_ip4 in 1.2.3.4/32 => http://b,1')
+    saver.dynamic.version = 'v1'
+    snap = snapshot.Snapshot.for_router(str(tmpdir), saver)
+    snap.save(saver)
+    return saver, snap
+
+
+def test_round_trip(saved):
+    saver, snap = saved
+    restorer = router()
+    with mock.patch('rump.parser.for_rule', side_effect=AssertionError('parsed')):
+        stamps = snap.restore(restorer)
+    assert stamps['stamp'] == 'v1'
+    assert stamps['router'] == 'test'
+    assert not restorer.compile_rules
+    assert map(str, restorer.overrides) == map(str, saver.overrides)
+
+
+def test_stale(saved, tmpdir):
+    saver, snap = saved
+    assert snap.restore(router(key='other')) is None
+    assert snap.restore(router(), max_age=0) is None
+    with mock.patch('rump.snapshot.FORMAT', snapshot.FORMAT + 1):
+        assert snap.restore(router()) is None
+    missing = snapshot.Snapshot(str(tmpdir.join('missing.snapshot')))
+    assert missing.restore(router()) is None
+
+
+def test_untrusted(saved):
+    saver, snap = saved
+    os.chmod(snap.path, 0o664)
+    assert snap.restore(router()) is None
+    os.chmod(snap.path, 0o644)
+    assert snap.restore(router()) is not None
+    with mock.patch('os.getuid', return_value=12345):
+        with mock.patch('os.fstat') as fstat:
+            fstat.return_value.st_uid = 54321
+            assert snap.restore(router()) is None
+
+
+def test_setup_restored(request, saved, tmpdir):
+    saver, snap = saved
+    app = wsgi._Application()
+    app.settings.snapshot_dir = str(tmpdir)
+    app.settings.routers = [router()]
+    restored = app.settings.routers[0]
+    connected = threading.Event()
+    reconciled = threading.Event()
+
+    def _connect(self, router):
+        connected.wait(1.0)
+        self._cli = mock.Mock()
+        self.version = None
+
+    def _disconnect(self, router):
+        self._cli = None
+
+    def _load(self, router):
+        assert self.version == 'v1'
+        reconciled.set()
+        return False
+
+    patches = [
+        mock.patch('rump.router.Redis.connect', _connect),
+        mock.patch('rump.router.Redis.disconnect', _disconnect),
+        mock.patch('rump.router.Redis.load', _load),
+        mock.patch('rump.router.Redis.watch'),
+    ]
+    for patch in patches:
+        patch.start()
+        request.addfinalizer(patch.stop)
+
+    app.setup()
+    request.addfinalizer(app.teardown)
+    # NOTE: served from the snapshot while connecting
+    assert map(str, restored.overrides) == map(str, saver.overrides)
+    assert app.unready() == []
+    connected.set()
+    assert reconciled.wait(1.0)
+    assert app.reloader.wait(1.0)
+    assert app.restored == {}
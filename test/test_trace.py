@@ -0,0 +1,113 @@
+import gc
+import json
+import StringIO
+
+import pytest
+
+from rump import trace, Router, Request, Server
+
+
+@pytest.fixture(params=[True, False])
+def router(request):
+    return Router(
+        name='one',
+        compile_rules=request.param,
+        default_upstream='http://default',
+        overrides=[
+            'path = "/override" => http://override',
+        ],
+        rules=[
+            'method = GET and path startswith "/a" => http://a',
+            'method = GET and query.b = "b" => http://b',
+            'method = POST => http://post',
+        ],
+    )
+
+
+def select(tracer, router, environ):
+    request = Request(environ)
+    record = tracer.begin(request)
+    upstream = router.match_upstream(request, trace=record)
+    server = upstream()
+    tracer.end(record, router, request, upstream, server)
+    return server
+
+
+def flushed(tracer):
+    io = StringIO.StringIO()
+    tracer.flush(io)
+    return [json.loads(line) for line in io.getvalue().splitlines()]
+
+
+def test_trace(router):
+    tracer = trace.Tracer()
+    for environ in [
+            {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/a', 'QUERY_STRING': ''},
+            {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/b', 'QUERY_STRING': 'b=b'},
+            {'REQUEST_METHOD': 'PUT', 'PATH_INFO': '/c', 'QUERY_STRING': ''},
+        ]:
+        select(tracer, router, environ)
+    assert all('fields' not in record for record in tracer.records)
+    records = flushed(tracer)
+    assert [
+        (record['router'], record.get('rules'), record.get('index'), record['server'])
+        for record in records
+    ] == [
+        ('one', 'rules', 0, 'http://a'),
+        ('one', 'rules', 1, 'http://b'),
+        ('one', None, None, 'http://default'),
+    ]
+    assert records[0]['fields'] == {'path': '/a', 'method': 'GET'}
+    assert records[1]['fields'] == {'path': '/b', 'method': 'GET', 'query.b': 'b'}
+    assert records[2]['fields'] == {'path': '/c', 'method': 'PUT'}
+    assert all(record['seconds'] >= 0 for record in records)
+
+
+def test_trace_override(router):
+    tracer = trace.Tracer()
+    select(tracer, router, {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/override'})
+    record, = flushed(tracer)
+    assert (record['rules'], record['index']) == ('overrides', 0)
+    assert record['fields'] == {'path': '/override'}
+
+
+def test_trace_sample(router):
+    tracer = trace.Tracer(rate=0)
+    assert tracer.begin(Request({})) is None
+    tracer.end(None, router, Request({}))
+    assert not tracer.records
+
+
+def test_trace_bounded(router):
+    tracer = trace.Tracer(size=2)
+    for _ in xrange(5):
+        select(tracer, router, {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/'})
+    assert len(tracer.records) == 2
+    assert tracer.dropped == 3
+
+
+def test_trace_flush(tmpdir, router):
+    path = tmpdir.join('trace.log')
+    tracer = trace.Tracer(str(path), interval=0.01)
+    select(tracer, router, {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/'})
+    select(tracer, router, {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/a'})
+    tracer.stop()
+    assert not tracer.records
+    records = [json.loads(line) for line in path.readlines()]
+    assert [
+        (record['index'], record['server'], record['upstream'])
+        for record in records
+    ] == [
+        (2, 'http://post', 'http://post,1'),
+        (0, 'http://a', 'http://a,1'),
+    ]
+
+
+def test_trace_fields_weak(router):
+    tracer = trace.Tracer()
+    select(tracer, router, {'REQUEST_METHOD': 'PUT', 'PATH_INFO': '/'})
+    flushed(tracer)
+    assert len(tracer._fields_for) == 4
+    router.rules = ['method = PUT => http://put']
+    gc.collect()
+    assert len(tracer._fields_for) == 1
@@ -0,0 +1,64 @@
+import os
+import threading
+
+import pytest
+
+from rump import watch
+
+
+class Changes(object):
+
+    def __init__(self):
+        self.paths = []
+        self.event = threading.Event()
+
+    def __call__(self, paths):
+        self.paths.extend(paths)
+        self.event.set()
+
+    def wait(self, timeout=5.0):
+        assert self.event.wait(timeout)
+        self.event.clear()
+        paths, self.paths = self.paths, []
+        return paths
+
+
+@pytest.fixture(params=['poll', 'inotify'])
+def watch_type(request):
+    if request.param == 'inotify':
+        if not watch.INotifyWatch.available():
+            pytest.skip('inotify not available')
+        return watch.INotifyWatch
+    return watch.PollWatch
+
+
+def test_watch(tmpdir, watch_type):
+    path = str(tmpdir.join('health'))
+    other = str(tmpdir.join('other'))
+    changes = Changes()
+    w = watch_type([path], changes, poll=0.05)
+    w.start()
+    try:
+        with open(other, 'w') as fo:
+            fo.write('ignored')
+        with open(path, 'w') as fo:
+            fo.write('up')
+        assert changes.wait() == [path]
+        os.rename(path, other)
+        assert changes.wait() == [path]
+        os.rename(other, path)
+        assert changes.wait() == [path]
+        os.remove(path)
+        assert changes.wait() == [path]
+    finally:
+        w.stop()
+    assert not w.is_alive()
+
+
+def test_watch_missing_directory(tmpdir):
+    path = str(tmpdir.join('missing', 'health'))
+    w = watch.watch([path], Changes(), poll=0.05)
+    try:
+        assert isinstance(w, watch.PollWatch)
+    finally:
+        w.stop()
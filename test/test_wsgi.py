@@ -1,12 +1,15 @@
+import json
 import os
 import threading
+import time
 import uuid
 import wsgiref.simple_server
 
+import mock
 import pytest
 import requests
 
-from rump import wsgi, __version__
+from rump import wsgi, request as rump_request, Request, Router, __version__
 
 
 @pytest.fixture
@@ -152,3 +155,292 @@ def test_select_xaccel_echo(server):
         'x-rump-version': __version__
     }
     assert resp.content == '/rump/yabba/dabba?doo=dle'
+
+
+@pytest.fixture
+def lean_server(request, settings):
+    settings['lean'] = True
+    return server(request, settings)
+
+
+def test_select_xaccel_lean(lean_server):
+    resp = requests.get(
+        lean_server + '/yabba/dabba?doo=dle',
+        headers={
+            'Host': 'one.me.com',
+        }
+    )
+    assert resp.status_code == 200
+    headers = resp.headers.copy()
+    headers.pop('server')
+    headers.pop('date')
+    assert headers == {
+        'content-length': '0',
+        'x-rump-redir-host': 'cache.one.internal.com',
+        'x-rump-redir-proto': 'http',
+        'x-accel-redirect': '/rump/yabba/dabba?doo=dle',
+    }
+
+
+def test_select_xaccel_lean_id(lean_server):
+    id = uuid.uuid4().hex
+    resp = requests.get(
+        lean_server + '/yabba/dabba?doo=dle',
+        headers={
+            'Host': 'one.me.com',
+            'X-Test-Id': id,
+        }
+    )
+    assert resp.status_code == 200
+    assert resp.headers['x-test-id'] == id
+    assert 'x-rump-version' not in resp.headers
+    assert 'x-rump-forward' not in resp.headers
+
+
+class SaucyRequest(Request):
+
+    sauce = rump_request.String('HTTP_X_SAUCE', default='blue')
+
+
+class EchoRequest(Request):
+
+    echo = rump_request.String('HTTP_X_ECHO', default='hello')
+
+
+@pytest.fixture
+def environ():
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/a/b',
+        'QUERY_STRING': '',
+        'HTTP_HOST': 'one.me.com',
+        'HTTP_X_SAUCE': 'mayo',
+    }
+
+
+def test_request_for_router(environ):
+    router = Router(name='one', hosts=['one'])
+    request = wsgi.Request(environ, 'X-Test-Id')
+    assert router.match_me(request)
+    assert request.for_router(router) is request
+    assert request.router is router
+
+
+def test_request_for_router_layered(environ):
+    router = Router(name='one', hosts=['one'], request_type=SaucyRequest)
+    request = wsgi.Request(environ, 'X-Test-Id')
+    assert router.match_me(request)
+    layered = request.for_router(router)
+    assert isinstance(layered, SaucyRequest)
+    assert isinstance(layered, wsgi.Request)
+    assert type(layered) is wsgi.Request.layer(SaucyRequest)
+    assert 'host' in layered
+    assert layered.host == 'one.me.com'
+    assert layered.sauce == 'mayo'
+    assert layered.redirect_prefix == '/rump'
+    assert layered.router is router
+
+
+def test_request_for_router_conflict(environ):
+    router = Router(name='one', hosts=['one'], request_type=EchoRequest)
+    request = wsgi.Request(environ, 'X-Test-Id')
+    assert router.match_me(request)
+    other = request.for_router(router)
+    assert type(other) is EchoRequest
+    assert 'host' in other
+    assert other.echo == 'hello'
+    assert request.echo is False
+
+
+@pytest.fixture
+def health_file(tmpdir):
+    path = tmpdir.join('health')
+    path.write('up')
+    return str(path)
+
+
+def wait_for(f, timeout=5.0):
+    expires_at = time.time() + timeout
+    while not f():
+        assert time.time() < expires_at
+        time.sleep(0.05)
+
+
+def test_health_cached(request, settings, health_file):
+    settings['health_file'] = health_file
+    root = server(request, settings)
+    wsgi.app.health.poll = 0.05
+    resp = requests.get(root + '/health')
+    assert resp.status_code == 200
+    assert resp.text == 'up'
+    os.remove(health_file)
+    wait_for(lambda: requests.get(root + '/health').status_code == 503)
+    assert requests.get(root + '/health').text == 'down'
+    with open(health_file, 'w') as fo:
+        fo.write('up again')
+    wait_for(lambda: requests.get(root + '/health').status_code == 200)
+    assert requests.get(root + '/health').text == 'up again'
+
+
+def test_ready(request, settings):
+    settings['ready_path'] = '/ready'
+    root = server(request, settings)
+    resp = requests.get(root + '/ready')
+    assert resp.status_code == 200
+    assert resp.text == 'ready'
+
+
+def test_not_ready(request, settings):
+    settings['routers'] = []
+    settings['ready_path'] = '/ready'
+    root = server(request, settings)
+    resp = requests.get(root + '/ready')
+    assert resp.status_code == 503
+    assert resp.text == 'no routers'
+
+
+def test_endpoints_disabled(server):
+    wsgi.app.metrics.reset()
+    for path in ['/ready', '/metrics']:
+        resp = requests.get(server + path, headers={'Host': 'one.me.com'})
+        assert resp.status_code == 200
+        assert resp.headers['x-rump-redir-host'] == 'cache.one.internal.com'
+    assert 'rump_requests_total{' not in wsgi.app.metrics.dumps()
+
+
+def test_unready_dynamic():
+    app = wsgi._Application()
+    app.settings.routers = [
+        Router(
+            name='dyn',
+            dynamic={'_type_': 'redis', 'key': 'dyn', 'channel': 'dyn'},
+        ),
+    ]
+    assert app.unready() == ['dyn disconnected']
+
+
+def test_metrics(request, settings):
+    settings['metrics'] = True
+    settings['metrics_path'] = '/metrics'
+    root = server(request, settings)
+    wsgi.app.metrics.reset()
+    requests.get(root + '/a', headers={'Host': 'one.me.com'})
+    requests.post(root + '/a', headers={'Host': 'one.me.com'})
+    requests.get(root + '/a', headers={'Host': 'hi.ppo.com'})
+    resp = requests.get(root + '/metrics')
+    assert resp.status_code == 200
+    assert resp.headers['content-type'] == 'text/plain; version=0.0.4'
+    lines = resp.text.splitlines()
+    for line in [
+            'rump_requests_total{router="one"} 2',
+            'rump_no_router_total 1',
+            'rump_no_upstream_total{router="one"} 1',
+            'rump_rule_hits_total{router="one",rules="rules",index="0"} 1',
+            'rump_server_selections_total{router="one",protocol="http",location="cache.one.internal.com"} 1',
+            'rump_selection_seconds_count{router="one"} 1',
+        ]:
+        assert line in lines
+
+
+def test_trace(tmpdir, server):
+    path = tmpdir.join('trace.log')
+    wsgi.app.settings.trace_file = str(path)
+    try:
+        requests.get(server + '/a', headers={'Host': 'one.me.com'})
+        requests.post(server + '/a', headers={'Host': 'one.me.com'})
+        requests.get(server + '/a', headers={'Host': 'hi.ppo.com'})
+    finally:
+        wsgi.app.settings.trace_file = None
+        wsgi.app.teardown()
+    records = [json.loads(line) for line in path.readlines()]
+    assert [
+        (record['router'], record.get('index'), record['server'], record['error'])
+        for record in records
+    ] == [
+        ('one', 0, 'http://cache.one.internal.com', None),
+        ('one', None, None, 'no upstream'),
+        (None, None, None, 'no router'),
+    ]
+    assert records[0]['fields'] == {'method': 'GET'}
+
+
+@pytest.fixture
+def conf_file(tmpdir):
+    tmpdir.join('one.conf').write(
+        '[one]\n'
+        'hosts = one\.me\.com\n'
+        'rules =\n'
+        '    method = GET => http://cache.one.internal.com\n'
+    )
+    tmpdir.join('two.conf').write(
+        '[two]\n'
+        'hosts = two\.me\.com\n'
+    )
+    path = tmpdir.join('rump.conf')
+    path.write(
+        '[rump]\n'
+        'includes = ./*.conf\n'
+        '\n'
+        '[rump:wsgi]\n'
+        'reload_files = true\n'
+    )
+    return path
+
+
+def test_files_changed(tmpdir, conf_file):
+    app = wsgi._Application()
+    app.settings.from_file(str(conf_file))
+    assert app.settings.reload_files
+    assert app.settings.file_path == str(conf_file)
+    with mock.patch('rump.watch.watch') as watch:
+        app.watch_files()
+    assert sorted(watch.call_args[0][0]) == [
+        str(tmpdir.join('one.conf')), str(conf_file), str(tmpdir.join('two.conf')),
+    ]
+    try:
+        one, two = app.settings.routers
+        path = tmpdir.join('one.conf')
+        path.write(path.read().replace('cache.one', 'fresh.one'))
+        assert app.files_changed([str(path)]) is True
+        assert app.settings.routers[1] is two
+        assert map(str, app.settings.routers[0].rules) == [
+            'method = "GET" => http://fresh.one.internal.com,1',
+        ]
+
+        routers = app.settings.routers
+        path.write(path.read().replace('method = GET', 'method =='))
+        assert app.files_changed([str(path)]) is False
+        assert app.settings.routers is routers
+
+        tmpdir.join('three.conf').write('[three]\nhosts = three\.me\.com\n')
+        assert app.files_changed([str(conf_file)]) is False
+        path.write(path.read().replace('method ==', 'method = GET'))
+        assert app.files_changed([str(conf_file)]) is True
+        assert [router.name for router in app.settings.routers] == [
+            'one', 'three', 'two',
+        ]
+        assert str(tmpdir.join('three.conf')) in app.settings.files
+    finally:
+        app.teardown()
+
+
+def test_files_watched(tmpdir, conf_file):
+    app = wsgi._Application()
+    app.files_poll = 0.05
+    app.settings.from_file(str(conf_file))
+    app.setup()
+    try:
+        path = tmpdir.join('two.conf')
+        tmpdir.join('two.tmp').write(
+            path.read() + 'default_upstream = http://two.internal.com\n'
+        )
+        tmpdir.join('two.tmp').rename(path)
+        for _ in range(100):
+            if app.settings.routers[1].default_upstream:
+                break
+            time.sleep(0.05)
+        assert str(app.settings.routers[1].default_upstream) == (
+            'http://two.internal.com,1'
+        )
+    finally:
+        app.teardown()
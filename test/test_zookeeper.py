@@ -0,0 +1,168 @@
+import threading
+import time
+
+import mock
+import pytest
+from kazoo.exceptions import NoNodeError
+from kazoo.protocol.states import ZnodeStat
+
+from rump import Router
+
+
+class FakeServer(object):
+    """
+    In-memory stand-in for a zookeeper ensemble.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.watches = {}
+        self.zxid = 0
+        self.commands = []
+        self.lock = threading.RLock()
+
+    def stat(self, czxid, mzxid, data):
+        return ZnodeStat(
+            czxid, mzxid, 0, 0, 0, 0, 0, 0, len(data), 0, czxid,
+        )
+
+    def get(self, path):
+        self.commands.append(('get', path))
+        with self.lock:
+            if path not in self.nodes:
+                raise NoNodeError()
+            return self.nodes[path]
+
+    def set(self, path, data):
+        self.commands.append(('set', path))
+        with self.lock:
+            self.zxid += 1
+            czxid = self.nodes[path][1].czxid if path in self.nodes else self.zxid
+            self.nodes[path] = (data, self.stat(czxid, self.zxid, data))
+            for watch in self.watches.get(path, []):
+                watch.changed(*self.nodes[path])
+
+
+class FakeDataWatch(object):
+
+    def __init__(self, server, path):
+        self.server = server
+        self.path = path
+        self._func = None
+
+    def __call__(self, func):
+        self._func = func
+        with self.server.lock:
+            self.server.watches.setdefault(self.path, []).append(self)
+            data, stat = self.server.nodes.get(self.path, (None, None))
+            self.changed(data, stat)
+        return func
+
+    def changed(self, data, stat):
+        self._func(data, stat, None)
+
+
+class FakeKazoo(object):
+
+    def __init__(self, server, hosts):
+        self.server = server
+
+    def start(self, timeout=None):
+        pass
+
+    def stop(self):
+        pass
+
+    def ensure_path(self, path):
+        with self.server.lock:
+            if path not in self.server.nodes:
+                self.server.set(path, '')
+
+    def get(self, path):
+        return self.server.get(path)
+
+    def set(self, path, data):
+        self.server.set(path, data)
+
+    def DataWatch(self, path):
+        return FakeDataWatch(self.server, path)
+
+
+@pytest.fixture
+def server(request):
+    server = FakeServer()
+    patch = mock.patch(
+        'rump.router.zookeeper.KazooClient',
+        lambda hosts: FakeKazoo(server, hosts),
+    )
+    patch.start()
+    request.addfinalizer(patch.stop)
+    return server
+
+
+def router(**dynamic):
+    return Router(
+        name='test',
+        compile_rules=True,
+        default_upstream='http://me',
+        dynamic=dict({
+            '_type_': 'zookeeper',
+            'root': '/rump/test',
+        }, **dynamic),
+        rules=[
+            'client_ip4 in 1.2.3.4/32 => prod',
+        ],
+    )
+
+
+def test_load_unchanged(server):
+    saver = router()
+    with saver.connect():
+        saver.overrides.append('path = "/a" => http://a,1')
+        saver.compile_rules = False
+        saver.save()
+
+    loader = router()
+    with loader.connect():
+        assert loader.load() is True
+        assert not loader.compile_rules
+        assert map(str, loader.overrides) == map(str, saver.overrides)
+        assert loader.load() is False
+
+        # only overrides changed, so config parse reused
+        config = loader.dynamic._parsed['/rump/test/config']
+        saver.overrides.append('path = "/b" => http://b,1')
+        server.set('/rump/test/overrides', saver.overrides.dumps())
+        assert loader.load() is True
+        assert loader.dynamic._parsed['/rump/test/config'] is config
+        assert map(str, loader.overrides) == map(str, saver.overrides)
+
+
+def test_watch_coalesced(request, server):
+    notifications = []
+
+    def _notify(router):
+        notifications.append(router.load())
+
+    saver = router()
+    saver.connect()
+    request.addfinalizer(saver.disconnect)
+    saver.save()
+
+    watcher = router(watch_debounce=0.2)
+    watcher.connect()
+    request.addfinalizer(watcher.disconnect)
+    watcher.load()
+    watcher.watch(_notify)
+
+    # touches both nodes
+    del server.commands[:]
+    saver.overrides.append('path = "/a" => http://a,1')
+    saver.compile_rules = False
+    saver.save()
+    time.sleep(0.3)
+    assert notifications == [True]
+    assert not watcher.compile_rules
+    assert map(str, watcher.overrides) == map(str, saver.overrides)
+    # NOTE: data delivered by the watch, so not re-fetched
+    assert [command for command in server.commands if command[0] == 'get'] == []